@@ -0,0 +1,85 @@
+""" async_dts.py
+
+Runs DTS can ingest, influx logging and a telemetry server in a single asyncio event loop
+
+The CanManager receiver is attached to the event loop, so the socketcan socket is read by
+the loop itself rather than a dedicated thread. Decoded telemetry is logged to influx once
+per second, and streamed as newline delimited json to every client connected to the
+telemetry server (e.g. nc localhost 8765).
+
+Simply run using python3 async_dts.py (requires vcan0, the DTS simulator and influxdb)
+"""
+
+import asyncio
+import json
+import os
+
+from can_manager import can_manager
+from database.database import Influx
+from dts_manager import dts_manager
+
+TELEMETRY_FIELDS = ['dc_bus_voltage', 'dc_bus_current', 'commanded_torque', 'torque_feedback',
+                    'module_a_temperature', 'motor_temperature']
+
+
+def snapshot(telemetry) -> dict:
+    """ Return the current value of the logged telemetry fields"""
+    return {field: getattr(telemetry, field, None) for field in TELEMETRY_FIELDS}
+
+
+async def ingest(bus, telemetry):
+    """ Decode every frame as it is received"""
+    async for frame in bus.frames():
+        if frame.arbitration_id in bus.messages:
+            telemetry.decode_message(frame.arbitration_id)
+
+
+async def log_to_influx(influx, telemetry, period=1.0):
+    """ Log a snapshot of the telemetry every period seconds
+
+    The influx client is blocking, so writes are handed to the default executor
+    """
+    loop = asyncio.get_event_loop()
+    while True:
+        await asyncio.sleep(period)
+        fields = {key: value for key, value in snapshot(telemetry).items() if value is not None}
+        if fields:
+            await loop.run_in_executor(None, influx.log_data, fields, 'dts', {'source': 'async_dts'})
+
+
+async def serve_telemetry(telemetry, port=8765, period=0.1):
+    """ Stream telemetry snapshots to every connected client"""
+    async def stream(reader, writer):
+        try:
+            while True:
+                writer.write((json.dumps(snapshot(telemetry)) + '\n').encode())
+                await writer.drain()
+                await asyncio.sleep(period)
+        except ConnectionError:
+            writer.close()
+
+    server = await asyncio.start_server(stream, port=port)
+    async with server:
+        await server.serve_forever()
+
+
+async def main():
+    bus = can_manager.CanManager('vcan0', 0.2)
+    bus.read_message_config('dts', 'message_config.json', path=os.path.dirname(dts_manager.__file__))
+    dts = dts_manager.DTS(bus)
+    influx = Influx('dts', 'localhost', 8086)
+
+    dts.control.configure_motor(dts_manager.MotorConfig(100, enable=dts_manager.InverterEnable.Inverter_On))
+    await bus.send(dts.control.command_id, dts.control.torque_command + dts.control.speed_command +
+                   dts.control.direction_command + dts.control.mode + dts.control.commanded_torque_limit)
+    try:
+        await asyncio.gather(ingest(bus, dts.telemetry),
+                             log_to_influx(influx, dts.telemetry),
+                             serve_telemetry(dts.telemetry))
+    finally:
+        bus.stop_periodic_messages()
+        bus.stop_receiver()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
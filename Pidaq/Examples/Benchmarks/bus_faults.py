@@ -0,0 +1,205 @@
+""" bus_faults.py
+
+Measures how CanManager ingest and DTSTelemetry decode behave on a misbehaving bus. The DTS
+simulator sends every message at the chosen rate through a FaultInjector, which drops,
+bursts, delays, reorders, duplicates and corrupts (DLC or payload) frames on a seeded
+schedule, while a receiver reads the bus with read_batch and decodes with dispatch_batch.
+
+The receiver records every frame it receives and every payload it decodes, and matches them
+against the injector's ground truth log by id, payload and send time. Reports, for each kind
+of fault: how many faulty frames were received and how many were decoded into the telemetry
+(i.e. got through), and the recovery time, from the fault to the next good frame of the same
+id being decoded. Also reports how often a short payload was left as the latest data of a
+reading by assign_message_data. Runs on a python-can virtual bus by default, with the
+simulator in a thread, pass a socketcan channel (e.g. vcan0) to run it in its own process.
+
+Simply run using python3 bus_faults.py [channel] [rate] [duration] [probability per fault %] [seed] [log.csv]
+"""
+
+import multiprocessing
+import os
+import queue
+import statistics
+import sys
+import threading
+
+from can_manager import can_manager
+from dts_manager import dts_manager
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'dts_simulator'))
+from dts_simulator import DEFAULT_RATES, DTSSimulator  # noqa: E402
+from fault_injection import FAULT_KINDS, FaultInjector  # noqa: E402
+
+# Largest difference in seconds between the time a faulty frame was logged as sent and its
+# receive timestamp, for them to be matched. Well under the message period, so a faulty frame
+# is not mistaken for the next frame of the same id when their payloads are the same
+MATCH_TOLERANCE = 0.0002
+# Faults that hold frames back, which may overwrite newer data when they are released
+HOLDING_FAULTS = ('burst', 'delay', 'reorder')
+
+
+def run_simulator(channel: str, interface: str, rate: float, duration: float, probability: float, seed: int,
+                  log_path, results) -> None:
+    """ Runs the simulator through the injector, and puts its outcome, or the exception that
+    stopped it, in the results queue
+    """
+    try:
+        injector = FaultInjector({kind: probability for kind in FAULT_KINDS}, seed=seed)
+        sim = DTSSimulator(channel, interface, {message_id: rate for message_id in DEFAULT_RATES},
+                           command_timeout=None, seed=seed, injector=injector)
+        counters = sim.run(duration, headless=True)
+        sim.can_bus.bus.shutdown()
+        if log_path is not None:
+            injector.write_log(log_path)
+        results.put({
+            'frames': injector.frames,
+            'counts': injector.counts,
+            'late_sends': counters['late_sends'],
+            'log': [(fault.time, fault.kind, fault.message_id, fault.data, fault.detail) for fault in injector.log],
+        })
+    except Exception as error:
+        results.put(error)
+
+
+def receive(channel: str, interface: str, generator) -> tuple:
+    """ Decodes the bus until the generator stops
+
+    Returns:
+        (tuple) received and decoded frames as (message id, timestamp, payload), and the number
+        of times a reading was left holding a payload too short for its decoder
+    """
+    bus = can_manager.CanManager(channel, 0.1, interface=interface)
+    dts = dts_manager.DTS(bus)
+    dts.read_message_config()
+    telemetry = dts.telemetry
+    bus.register_handler(telemetry.project, telemetry.decode_message)
+    decoded = []
+
+    def on_decoded(message_id: int, values: list) -> None:
+        reading = telemetry.messages[message_id]
+        decoded.append((message_id, reading.timestamp, bytes(reading.data)))
+
+    telemetry.decode_callbacks.append(on_decoded)
+
+    received = []
+    short_stored = 0
+    generator.start()
+    while True:
+        alive = generator.is_alive()
+        batch = bus.read_batch(max_frames=None, timeout_seconds=0.1)
+        if not batch and not alive:
+            break
+        received.extend((message.arbitration_id, message.timestamp, bytes(message.data)) for message in batch)
+        bus.dispatch_batch(batch)
+        for message_id in {message.arbitration_id for message in batch}:
+            reading = bus.messages.get(message_id)
+            if reading is not None and reading.decoder is not None and len(reading.data) < reading.decoder.size:
+                short_stored += 1
+    generator.join()
+    dts.control.shutdown()
+    bus.bus.shutdown()
+    return received, decoded, short_stored
+
+
+def match_faults(log: list, frames: list) -> dict:
+    """ Returns the fault each frame is, keyed by index in frames, for frames matching the log
+
+    Each fault matches one frame at most, dropped frames never reach the bus so match none
+    """
+    faults = {}
+    for fault in log:
+        if fault[1] != 'drop':
+            faults.setdefault((fault[2], fault[3]), []).append(fault)
+    matched = {}
+    for index, (message_id, timestamp, data) in enumerate(frames):
+        candidates = faults.get((message_id, data))
+        if not candidates:
+            continue
+        for position, fault in enumerate(candidates):
+            if abs(fault[0] - timestamp) < MATCH_TOLERANCE:
+                matched[index] = candidates.pop(position)
+                break
+    return matched
+
+
+def analyse(log: list, received: list, decoded: list) -> dict:
+    received_faults = match_faults(log, received)
+    decoded_faults = match_faults(log, decoded)
+    # Times of the good frames of each id that were decoded, to find when each fault was recovered from
+    good_decodes = {}
+    for index, (message_id, timestamp, _) in enumerate(decoded):
+        if index not in decoded_faults:
+            good_decodes.setdefault(message_id, []).append(timestamp)
+
+    # A held frame is stale if a newer frame of the same id was decoded while it was held
+    stale = dict.fromkeys(HOLDING_FAULTS, 0)
+    for fault in decoded_faults.values():
+        if fault[1] in HOLDING_FAULTS:
+            held_since = fault[0] - fault[4]
+            if any(held_since < timestamp < fault[0] for timestamp in good_decodes.get(fault[2], ())):
+                stale[fault[1]] += 1
+
+    results = {}
+    for kind in FAULT_KINDS:
+        faults = [fault for fault in log if fault[1] == kind]
+        recoveries = []
+        for fault in faults:
+            for timestamp in good_decodes.get(fault[2], ()):
+                if timestamp > fault[0]:
+                    recoveries.append(timestamp - fault[0])
+                    break
+        results[kind] = {
+            'injected': len(faults),
+            'received': sum(1 for fault in received_faults.values() if fault[1] == kind),
+            'decoded': sum(1 for fault in decoded_faults.values() if fault[1] == kind),
+            'stale': stale.get(kind),
+            'recovery_mean': statistics.mean(recoveries) if recoveries else None,
+            'recovery_max': max(recoveries) if recoveries else None,
+        }
+    return results
+
+
+if __name__ == "__main__":
+    channel = sys.argv[1] if len(sys.argv) > 1 else 'fault_benchmark'
+    interface = 'virtual' if channel == 'fault_benchmark' else 'socketcan'
+    rate = float(sys.argv[2]) if len(sys.argv) > 2 else 1000
+    duration = float(sys.argv[3]) if len(sys.argv) > 3 else 5.0
+    probability = float(sys.argv[4]) / 100 if len(sys.argv) > 4 else 0.002
+    seed = int(sys.argv[5]) if len(sys.argv) > 5 else 0
+    log_path = sys.argv[6] if len(sys.argv) > 6 else None
+    if probability * len(FAULT_KINDS) > 1:
+        raise ValueError(f'Error: the probability of each of the {len(FAULT_KINDS)} kinds of fault must be at most '
+                         f'{100 / len(FAULT_KINDS):.1f}%, not {probability * 100}%')
+
+    if interface == 'virtual':
+        results = queue.Queue()
+        generator = threading.Thread(target=run_simulator,
+                                     args=(channel, interface, rate, duration, probability, seed, log_path, results))
+    else:
+        results = multiprocessing.Queue()
+        generator = multiprocessing.Process(target=run_simulator,
+                                            args=(channel, interface, rate, duration, probability, seed, log_path,
+                                                  results))
+    received, decoded, short_stored = receive(channel, interface, generator)
+    try:
+        outcome = results.get(timeout=5)
+    except queue.Empty:
+        raise Exception('Error: the simulator stopped without reporting its outcome')
+    if isinstance(outcome, Exception):
+        raise outcome
+    log = outcome['log']
+
+    counts = outcome['counts']
+    # Both copies of a duplicated frame are logged
+    expected = outcome['frames'] - counts['drop'] + counts['duplicate'] // 2
+    print(f'{outcome["frames"]} frames sent at {rate:.0f}Hz per message ({outcome["late_sends"]} late), '
+          f'{len(log)} faulty, {len(received)}/{expected} frames received, {len(decoded)} decodes')
+    print(f'short payloads left as the latest data of a reading: {short_stored}')
+    print(f'{"fault":>10} {"injected":>9} {"received":>9} {"decoded":>8} {"stale":>6} '
+          f'{"recovery mean":>14} {"recovery max":>13}')
+    for kind, result in analyse(log, received, decoded).items():
+        mean = '-' if result['recovery_mean'] is None else f'{result["recovery_mean"] * 1e3:.2f}ms'
+        longest = '-' if result['recovery_max'] is None else f'{result["recovery_max"] * 1e3:.2f}ms'
+        stale = '-' if result['stale'] is None else result['stale']
+        print(f'{kind:>10} {result["injected"]:9d} {result["received"]:9d} {result["decoded"]:8d} {stale:>6} '
+              f'{mean:>14} {longest:>13}')
@@ -0,0 +1,77 @@
+""" command_transition.py
+
+Measures how quickly a new motor command reaches the bus, comparing the in-place update
+of the periodic command message (DTSControl.send_motor_command) with the previous
+approach of stopping the periodic task and starting a new one.
+
+For each of a series of step changes, reports the latency from the command being issued
+to the first command message on the bus carrying the new value, and the longest gap in
+the command stream around the change. Runs on a python-can virtual bus by default, pass
+a socketcan channel (e.g. vcan0) to measure the kernel broadcast manager instead.
+
+Simply run using python3 command_transition.py [channel] [steps]
+"""
+
+import statistics
+import sys
+import time
+
+import can
+
+from can_manager import can_manager
+from dts_manager import dts_manager
+
+PERIOD = 0.01
+
+
+def restart_command(control, command: float):
+    """ Previous implementation, stops the periodic task and starts a new one"""
+    control.bus.stop_periodic_message(control.command_id)
+    control.send_motor_command(command, duration=3600)
+
+
+def update_command(control, command: float):
+    control.send_motor_command(command)
+
+
+def measure(channel: str, interface: str, steps: int, issue_command) -> tuple:
+    bus = can_manager.CanManager(channel, PERIOD, interface=interface)
+    monitor = can.interface.Bus(channel=channel, interface=interface)
+    received = []
+    notifier = can.Notifier(monitor, [lambda msg: received.append((msg.timestamp, bytes(msg.data[:2])))])
+    control = dts_manager.DTS.DTSControl(bus)
+    control.configure_motor(dts_manager.MotorConfig(0, enable=dts_manager.InverterEnable.Inverter_On))
+
+    issue_command(control, 0)
+    time.sleep(5 * PERIOD)
+    issued = []
+    for step in range(1, steps + 1):
+        issued.append((time.time(), int(step * 10).to_bytes(2, 'little', signed=True)))
+        issue_command(control, step)
+        time.sleep(5 * PERIOD)
+    bus.stop_periodic_messages()
+    notifier.stop()
+    monitor.shutdown()
+    control.shutdown()
+    bus.bus.shutdown()
+
+    latencies, gaps = [], []
+    for issue_time, payload in issued:
+        after = [timestamp for timestamp, data in received if data == payload and timestamp >= issue_time]
+        if after:
+            latencies.append(after[0] - issue_time)
+        window = [timestamp for timestamp, _ in received if issue_time - 2 * PERIOD <= timestamp <= issue_time + 3 * PERIOD]
+        gaps.extend(later - earlier for earlier, later in zip(window, window[1:]))
+    return latencies, gaps
+
+
+if __name__ == "__main__":
+    channel = sys.argv[1] if len(sys.argv) > 1 else 'command_benchmark'
+    interface = 'virtual' if channel == 'command_benchmark' else 'socketcan'
+    steps = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+
+    for name, issue_command in (('stop/restart', restart_command), ('in-place update', update_command)):
+        latencies, gaps = measure(channel, interface, steps, issue_command)
+        print(f'{name:>16}: latency mean {statistics.mean(latencies) * 1e3:.2f}ms, '
+              f'max {max(latencies) * 1e3:.2f}ms | longest gap in command stream {max(gaps) * 1e3:.2f}ms '
+              f'(period {PERIOD * 1e3:.0f}ms)')
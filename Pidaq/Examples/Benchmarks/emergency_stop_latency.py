@@ -0,0 +1,109 @@
+""" emergency_stop_latency.py
+
+Measures the latency of the emergency stop path, from an over-limit telemetry message
+being put on the bus to the inverter disable message appearing on the bus.
+
+The motor command is sent periodically while a receiver thread decodes DTS telemetry
+with a LimitChecker on the DC bus voltage, which calls DTSControl.stop_on_alarm. For each
+trial an over-voltage message is injected, and a monitor bus records when the first
+disable message is seen. Reports the end to end latency, and the part of it spent between
+the alarm and the disable message being sent (DTSControl.stop_latency). Runs on a
+python-can virtual bus by default, pass a socketcan channel (e.g. vcan0) to measure
+socketcan instead.
+
+Simply run using python3 emergency_stop_latency.py [channel] [trials]
+"""
+
+import os
+import statistics
+import struct
+import sys
+import threading
+import time
+
+import can
+
+from can_manager import can_manager
+from dts_manager import dts_manager
+from dts_manager.limits import LimitChecker
+
+PERIOD = 0.01
+CONFIG_PATH = os.path.dirname(dts_manager.__file__)
+VOLTAGE_ID = 167
+
+
+def voltage_message(voltage: float) -> can.Message:
+    return can.Message(arbitration_id=VOLTAGE_ID, data=struct.pack('<hhhh', int(voltage * 10), 0, 0, 0),
+                       is_extended_id=False)
+
+
+def measure(channel: str, interface: str, trials: int) -> tuple:
+    bus = can_manager.CanManager(channel, PERIOD, interface=interface)
+    bus.read_message_config('dts', 'message_config.json', path=CONFIG_PATH)
+    dts = dts_manager.DTS(bus)
+    limits = LimitChecker(dts.telemetry, {'dc_bus_voltage': {'max': 400}})
+    limits.alarm_callbacks.append(dts.control.stop_on_alarm)
+
+    disable_data = bytes(dts.control.disable_message.data)
+    disabled = []
+    monitor = can.interface.Bus(channel=channel, interface=interface)
+    notifier = can.Notifier(monitor, [lambda msg: disabled.append(time.time())
+                                      if msg.arbitration_id == dts.control.command_id
+                                      and bytes(msg.data) == disable_data else None])
+    sender = can.interface.Bus(channel=channel, interface=interface)
+
+    running = True
+
+    def receive():
+        while running:
+            dts.telemetry.update_data_batch(timeout_seconds=0.1)
+
+    receiver = threading.Thread(target=receive)
+    receiver.start()
+
+    latencies, stop_latencies = [], []
+    for _ in range(trials):
+        # Running at a normal voltage, with a non zero command
+        sender.send(voltage_message(300))
+        time.sleep(5 * PERIOD)
+        dts.control.clear_emergency_stop()
+        limits.reset()
+        dts.control.configure_motor(dts_manager.MotorConfig(10, enable=dts_manager.InverterEnable.Inverter_On))
+        dts.control.send_motor_command(10)
+        time.sleep(5 * PERIOD)
+        disabled.clear()
+
+        injected = time.time()
+        sender.send(voltage_message(450))
+        time.sleep(5 * PERIOD)
+        if disabled:
+            latencies.append(disabled[0] - injected)
+        if dts.control.stop_latency is not None:
+            stop_latencies.append(dts.control.stop_latency)
+
+    running = False
+    receiver.join()
+    bus.stop_periodic_messages()
+    notifier.stop()
+    for shut in (monitor, sender, bus.bus):
+        shut.shutdown()
+    dts.control.shutdown()
+    return latencies, stop_latencies
+
+
+def summary(latencies: list) -> str:
+    ordered = sorted(latencies)
+    p99 = ordered[min(len(ordered) - 1, int(0.99 * len(ordered)))]
+    return (f'min {ordered[0] * 1e6:.0f}us, median {statistics.median(ordered) * 1e6:.0f}us, '
+            f'p99 {p99 * 1e6:.0f}us, max {ordered[-1] * 1e6:.0f}us')
+
+
+if __name__ == "__main__":
+    channel = sys.argv[1] if len(sys.argv) > 1 else 'estop_benchmark'
+    interface = 'virtual' if channel == 'estop_benchmark' else 'socketcan'
+    trials = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+
+    latencies, stop_latencies = measure(channel, interface, trials)
+    print(f'{len(latencies)}/{trials} emergency stops seen on the bus (command period {PERIOD * 1e3:.0f}ms)')
+    print(f'  over-limit message to disable message on the bus: {summary(latencies)}')
+    print(f'  alarm to disable message sent:                    {summary(stop_latencies)}')
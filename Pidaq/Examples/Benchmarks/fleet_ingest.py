@@ -0,0 +1,105 @@
+""" fleet_ingest.py
+
+Finds the number of inverters at which ingest saturates. For an increasing number of
+devices, a FleetSimulator sends every inverter's telemetry on its own can offset at a fixed
+bus load per device, while one CanManager reads the channel with read_batch and dispatches
+each inverter's messages to its own DTSTelemetry with dispatch_batch.
+
+Reports the frames sent and received, the decode rate, and the backlog left on the bus when
+the fleet stops: once ingest saturates, frames are received late (virtual bus) or dropped
+(socketcan). On the virtual bus the fleet runs in a thread of the same process, so the
+simulator and the receiver share the interpreter. Pass a socketcan channel (e.g. vcan0) to
+run the fleet in its own process instead.
+
+Simply run using python3 fleet_ingest.py [channel] [max devices] [load per device %] [duration]
+"""
+
+import multiprocessing
+import os
+import sys
+import threading
+import time
+
+from can_manager import can_manager
+from dts_manager import dts_manager
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'dts_simulator'))
+from fleet_load import DEFAULT_OFFSET_STRIDE, FleetSimulator  # noqa: E402
+
+
+def run_fleet(channel: str, interface: str, devices: int, load: float, duration: float, results=None) -> dict:
+    fleet = FleetSimulator(channel, devices, interface, bus_load=load, seed=0)
+    counters = fleet.run(duration)
+    fleet.shutdown()
+    if results is not None:
+        results.put(counters)
+    return counters
+
+
+def measure(channel: str, interface: str, devices: int, load_per_device: float, duration: float) -> dict:
+    bus = can_manager.CanManager(channel, 0.1, interface=interface)
+    inverters = []
+    for device in range(devices):
+        inverter = dts_manager.DTS(bus, can_offset=dts_manager.DEFAULT_CAN_OFFSET + DEFAULT_OFFSET_STRIDE * device)
+        inverter.read_message_config()
+        bus.register_handler(inverter.telemetry.project, inverter.telemetry.decode_message)
+        inverters.append(inverter)
+
+    load = load_per_device * devices
+    if interface == 'virtual':
+        results = []
+        generator = threading.Thread(target=lambda: results.append(
+            run_fleet(channel, interface, devices, load, duration)))
+    else:
+        queue = multiprocessing.Queue()
+        generator = multiprocessing.Process(target=run_fleet, args=(channel, interface, devices, load, duration, queue))
+    generator.start()
+
+    received = decoded = 0
+    start = time.perf_counter()
+    while generator.is_alive():
+        batch = bus.read_batch(timeout_seconds=0.1)
+        received += len(batch)
+        decoded += bus.dispatch_batch(batch)
+    stopped = time.perf_counter()
+    # Frames still queued when the fleet stopped were not ingested in time
+    backlog = 0
+    while True:
+        batch = bus.read_batch(max_frames=None, timeout_seconds=0.1)
+        if not batch:
+            break
+        backlog += len(batch)
+    generator.join()
+    counters = results[0] if interface == 'virtual' else queue.get()
+    for inverter in inverters:
+        inverter.control.shutdown()
+    bus.bus.shutdown()
+    return {
+        'devices': devices,
+        'sent': counters['sent'],
+        'offered_load': counters['offered_load'],
+        'achieved_load': counters['achieved_load'],
+        'received': received,
+        'backlog': backlog,
+        'lost': counters['sent'] - received - backlog,
+        'decode_rate': decoded / (stopped - start),
+    }
+
+
+if __name__ == "__main__":
+    channel = sys.argv[1] if len(sys.argv) > 1 else 'fleet_benchmark'
+    interface = 'virtual' if channel == 'fleet_benchmark' else 'socketcan'
+    max_devices = int(sys.argv[2]) if len(sys.argv) > 2 else 8
+    load_per_device = float(sys.argv[3]) / 100 if len(sys.argv) > 3 else 0.1
+    duration = float(sys.argv[4]) if len(sys.argv) > 4 else 5.0
+
+    devices = 1
+    while devices <= max_devices:
+        if load_per_device * devices > 1:
+            print(f'{devices} devices would need more than the whole bus, stopping')
+            break
+        result = measure(channel, interface, devices, load_per_device, duration)
+        print(f'{devices:3d} devices, {result["achieved_load"]:6.0%} bus load: sent {result["sent"]}, '
+              f'received {result["received"]}, backlog {result["backlog"]}, lost {result["lost"]}, '
+              f'{result["decode_rate"]:.0f} decodes/s')
+        devices *= 2
@@ -0,0 +1,81 @@
+""" ingest_throughput.py
+
+Compares the throughput of the per-frame ingest path (DTSTelemetry.update_data) with
+the batched path (DTSTelemetry.update_data_batch) on a python-can virtual bus.
+
+A burst of inverter messages (ids 160-173) is queued on the bus, then each path drains
+and decodes the whole burst. Each path is measured with the sample history and receive
+statistics of every reading, and without either. The fastest of several runs is reported.
+The virtual bus does not need socketcan, so this runs on any machine.
+
+Simply run using python3 ingest_throughput.py [frames] [runs]
+"""
+
+import os
+import struct
+import sys
+import time
+
+import can
+
+from can_manager import can_manager
+from dts_manager import dts_manager
+
+CHANNEL = 'ingest_benchmark'
+CONFIG_PATH = os.path.dirname(dts_manager.__file__)
+
+
+def create_receiver(bookkeeping=True):
+    """ Create a CanManager and DTSTelemetry instance listening on the benchmark channel
+
+    Args:
+        bookkeeping (bool): whether the readings keep a sample history and receive statistics
+    """
+    bus = can_manager.CanManager(CHANNEL, 0.1, interface='virtual')
+    bus.read_message_config('dts', 'message_config.json', path=CONFIG_PATH,
+                            history_length=256 if bookkeeping else 0, statistics=bookkeeping)
+    return bus, dts_manager.DTS.DTSTelemetry(bus)
+
+
+def queue_burst(sender, frames: int):
+    """ Queue a burst of inverter messages on the bus, cycling through ids 160-173"""
+    for index in range(frames):
+        value = index % 30000
+        data = struct.pack('<hhhh', value, -value, value // 2, 1000)
+        sender.send(can.Message(arbitration_id=160 + index % 14, data=data, is_extended_id=False))
+
+
+def per_frame(telemetry, frames: int) -> float:
+    start = time.perf_counter()
+    for _ in range(frames):
+        telemetry.update_data()
+    return time.perf_counter() - start
+
+
+def batched(telemetry, frames: int) -> float:
+    start = time.perf_counter()
+    received = 0
+    while received < frames:
+        received += telemetry.update_data_batch(max_frames=frames, timeout_seconds=1)
+    return time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    frames = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    runs = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    sender = can.interface.Bus(channel=CHANNEL, interface='virtual')
+
+    for name, ingest in (('per-frame', per_frame), ('batched', batched)):
+        for bookkeeping in (True, False):
+            elapsed = None
+            for _ in range(runs):
+                bus, telemetry = create_receiver(bookkeeping)
+                queue_burst(sender, frames)
+                run_time = ingest(telemetry, frames)
+                elapsed = run_time if elapsed is None else min(elapsed, run_time)
+                bus.bus.shutdown()
+            label = 'history and statistics' if bookkeeping else 'no history or statistics'
+            print(f'{name:>10}, {label:>24}: {frames} frames in {elapsed:.3f}s '
+                  f'({frames / elapsed:,.0f} frames/s, {elapsed / frames * 1e6:.2f} us/frame)')
+
+    sender.shutdown()
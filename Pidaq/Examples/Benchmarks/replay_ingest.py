@@ -0,0 +1,47 @@
+""" replay_ingest.py
+
+Replays a recorded capture through CanManager and DTSTelemetry, and reports ingest throughput
+
+The capture (a .pdqcap capture from can_manager.recorder, or a candump .log) is played onto
+a python-can virtual bus by a CaptureReplay thread, while the main thread drains and decodes
+it with DTSTelemetry.update_data_batch. With speed 'max' this measures the maximum ingest
+rate for real inverter traffic, with speed 1 it checks that ingest keeps up in real time.
+
+Simply run using python3 replay_ingest.py <capture> [speed|max]
+"""
+
+import os
+import sys
+import time
+
+import can
+
+from can_manager import can_manager
+from can_manager.replay import CaptureReplay
+from dts_manager import dts_manager
+
+CHANNEL = 'replay_benchmark'
+
+if __name__ == "__main__":
+    capture = sys.argv[1]
+    speed = None if len(sys.argv) < 3 or sys.argv[2] == 'max' else float(sys.argv[2])
+
+    bus = can_manager.CanManager(CHANNEL, 0.1, interface='virtual')
+    bus.read_message_config('dts', 'message_config.json', path=os.path.dirname(dts_manager.__file__))
+    telemetry = dts_manager.DTS.DTSTelemetry(bus)
+    sender = can.interface.Bus(channel=CHANNEL, interface='virtual')
+    replay = CaptureReplay(capture, sender, speed=speed)
+
+    received = 0
+    start = time.perf_counter()
+    replay.start()
+    while replay.running or received < replay.sent:
+        received += telemetry.update_data_batch(timeout_seconds=0.1)
+    elapsed = time.perf_counter() - start
+
+    print(f'Replayed {replay.sent} messages in {elapsed:.3f}s ({received / elapsed:,.0f} messages/s)')
+    if speed is not None:
+        print(f'Maximum replay lateness: {replay.max_lateness * 1e3:.3f}ms')
+    print(f'DC bus voltage at end of capture: {telemetry.dc_bus_voltage}')
+    bus.bus.shutdown()
+    sender.shutdown()
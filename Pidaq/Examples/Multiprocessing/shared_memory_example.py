@@ -0,0 +1,90 @@
+""" shared_memory_example.py
+
+Sharing the latest DTS telemetry between processes through shared memory
+The acquisition process decodes DTS messages and publishes every signal into a shared
+memory segment after each batch. Consumer processes (here a printer standing in for the
+dashboard, and a logger standing in for the influx logger) attach to the segment and read
+consistent snapshots whenever they need them, without pipes, pickling or locks. Adding
+more consumers does not add any work to the acquisition process.
+
+Simply run using python3 shared_memory_example.py (requires vcan0 and the DTS simulator)
+
+"""
+
+
+import time
+from multiprocessing import Event, Process
+
+from can_manager import can_manager
+from can_manager.shared_telemetry import TelemetryPublisher, TelemetryReader
+from dts_manager import dts_manager
+
+SEGMENT_NAME = 'dts_telemetry'
+# Time in seconds to wait for the acquisition process to start publishing
+STARTUP_TIMEOUT = 10
+
+
+def acquisition(ready, stop):
+    """ Decode DTS telemetry and publish it until stopped """
+    bus = can_manager.CanManager('vcan0', 0.01)
+    dts = dts_manager.DTS(bus)
+    bus.read_message_config('dts', 'message_config.json', '../../Lib/dts_manager')
+    with TelemetryPublisher(SEGMENT_NAME, dts.telemetry.store) as publisher:
+        ready.set()
+        while not stop.is_set():
+            dts.telemetry.update_data_batch(timeout_seconds=0.1)
+            publisher.publish()
+
+
+def printer(stop):
+    """ Print a few signals once per second """
+    with TelemetryReader(SEGMENT_NAME) as reader:
+        while not stop.is_set():
+            print('DC bus voltage: {}  Module A temperature: {}'.format(
+                reader.get('dc_bus_voltage'), reader.get('module_a_temperature')))
+            time.sleep(1)
+
+
+def logger(stop):
+    """ Take a snapshot of every signal 10 times per second, as the influx logger would """
+    with TelemetryReader(SEGMENT_NAME) as reader:
+        last_sequence = None
+        snapshots = 0
+        while not stop.is_set():
+            # Skip the snapshot if nothing was published since the last one
+            if reader.sequence() != last_sequence:
+                last_sequence = reader.sequence()
+                values, timestamps = reader.snapshot()
+                snapshots += 1
+            time.sleep(0.1)
+        print('Logger took {} snapshots of {} signals'.format(snapshots, len(reader.names)))
+
+
+if __name__ == "__main__":
+    ready = Event()
+    stop = Event()
+
+    p_acquisition = Process(target=acquisition, args=(ready, stop))
+    p_acquisition.start()
+    # The acquisition process fails if e.g. vcan0 does not exist, so do not wait for it forever
+    deadline = time.monotonic() + STARTUP_TIMEOUT
+    while not ready.wait(0.1):
+        if not p_acquisition.is_alive() or time.monotonic() >= deadline:
+            stop.set()
+            p_acquisition.join(1)
+            if p_acquisition.is_alive():
+                p_acquisition.terminate()
+            raise SystemExit('Error: the acquisition process did not start publishing, is vcan0 up?')
+
+    consumers = [Process(target=printer, args=(stop,)), Process(target=logger, args=(stop,))]
+    for consumer in consumers:
+        consumer.start()
+
+    # Run for 10 seconds
+    time.sleep(10)
+    stop.set()
+    for consumer in consumers:
+        consumer.join()
+    p_acquisition.join()
+
+    print("Child Processes Complete")
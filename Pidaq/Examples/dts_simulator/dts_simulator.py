@@ -1,11 +1,174 @@
+import heapq
+import struct
 import sys
 import time
 from enum import Enum
-from random import random
+from math import exp, pi, sin
 
 import can
+import numpy as np
 
 from can_manager import can_manager
+from dts_manager.dts_manager import COMMAND_OFFSET, DEFAULT_CAN_OFFSET
+
+COMMAND_ID = DEFAULT_CAN_OFFSET + COMMAND_OFFSET
+# Rate in Hz each message is sent at by default, as configured on the inverter, keyed by
+# message id at the default can offset
+DEFAULT_RATES = {
+    160: 10, 161: 10, 162: 10, 169: 10, 171: 10,
+    163: 100, 164: 100, 165: 100, 166: 100, 167: 100, 168: 100, 170: 100, 172: 100, 173: 100,
+}
+MAX_RATE = 1000
+
+# Layouts of the simulated messages
+SIGNALS = struct.Struct('<hhhh')
+INTERNAL_STATES = struct.Struct('<HBBBBBB')
+TORQUE_TIMER = struct.Struct('<hhI')
+
+# Standard deviation of the noise on each field of each message, in engineering units
+NOISE = {
+    160: (0.3, 0.3, 0.3, 0.3),
+    161: (0.2, 0.2, 0.2, 0.2),
+    162: (0.2, 0.2, 0.3),
+    163: (0.02, 0.02, 0.02, 0.02),
+    165: (2.0, 0.5),
+    166: (0.5, 0.5, 0.5, 0.2),
+    167: (0.5, 0.5, 0.5, 0.5),
+    168: (0.002, 0.3, 0.3),
+    169: (0.005, 0.005, 0.01, 0.05),
+}
+
+
+def _scaled(value: float, factor: float) -> int:
+    """ Converts a value to a signed 16 bit integer in units of 1/factor, saturating"""
+    scaled = int(value * factor)
+    return -32768 if scaled < -32768 else 32767 if scaled > 32767 else scaled
+
+
+class NoiseSource:
+    """ Gaussian noise for the fields of one message, generated by numpy a block at a time
+
+    Generating noise per field per frame costs a random() call each, so a block of frames is
+    generated at once and converted to python floats, and each frame then only takes a row
+
+    Fields:
+        deviations (numpy.ndarray): standard deviation of the noise on each field
+        block (int): number of frames of noise generated at once
+    """
+
+    def __init__(self, deviations, rng: np.random.Generator, block=1024):
+        self.deviations = np.asarray(deviations, dtype=float)
+        self.rng = rng
+        self.block = block
+        self.rows = []
+        self.index = 0
+
+    def next(self) -> list:
+        """ Returns the noise of each field for the next frame"""
+        if self.index >= len(self.rows):
+            self.rows = (self.rng.standard_normal((self.block, len(self.deviations))) * self.deviations).tolist()
+            self.index = 0
+        row = self.rows[self.index]
+        self.index += 1
+        return row
+
+
+class MotorModel:
+    """ First-order model of the motor and inverter, driven by the received command
+
+    The torque follows the commanded torque, and the speed follows the torque, each with a
+    first-order lag. In speed mode the commanded torque comes from a proportional speed loop
+    with feed forward. Currents, voltages and power follow from the torque and speed, and the
+    module and motor temperatures rise with the square of the current. Each lag is advanced
+    with its exact discrete solution, so the model is stable at any update rate
+
+    Fields:
+        commanded_torque (float): torque the inverter is commanding, in Nm
+        torque (float): torque feedback, in Nm
+        speed (float): motor speed, in rpm
+        angle (float): motor angle, in degrees
+        electrical_frequency (float): in Hz
+        current (float): peak phase current, in A
+        id_current, iq_current (float): d and q axis currents, in A
+        dc_bus_voltage (float), dc_bus_current (float), output_voltage (float)
+        ambient_temperature (float), module_temperature (float), motor_temperature (float): in C
+    """
+
+    TORQUE_TIME_CONSTANT = 0.02
+    MECHANICAL_TIME_CONSTANT = 0.5
+    RPM_PER_NM = 20.0
+    SPEED_GAIN = 0.5
+    MAX_TORQUE = 200.0
+    POLE_PAIRS = 4
+    AMPS_PER_NM = 1.5
+    VOLTS_PER_RPM = 0.05
+    NOMINAL_DC_BUS_VOLTAGE = 300.0
+    DC_BUS_RESISTANCE = 0.1
+    EFFICIENCY = 0.92
+    MODULE_TIME_CONSTANT = 30.0
+    MODULE_RISE_PER_AMP_SQUARED = 0.002
+    MOTOR_TIME_CONSTANT = 120.0
+    MOTOR_RISE_PER_AMP_SQUARED = 0.004
+
+    def __init__(self, start_time: float, ambient_temperature=25.0):
+        self.start_time = start_time
+        self.time = start_time
+        self.commanded_torque = 0.0
+        self.torque = 0.0
+        self.speed = 0.0
+        self.angle = 0.0
+        self.electrical_frequency = 0.0
+        self.current = 0.0
+        self.id_current = 0.0
+        self.iq_current = 0.0
+        self.dc_bus_voltage = self.NOMINAL_DC_BUS_VOLTAGE
+        self.dc_bus_current = 0.0
+        self.output_voltage = 0.0
+        self.ambient_temperature = ambient_temperature
+        self.module_temperature = ambient_temperature
+        self.motor_temperature = ambient_temperature
+
+    def advance(self, now: float, torque_command: float, speed_command: float, speed_mode: bool, enabled: bool,
+                torque_limit: float) -> None:
+        elapsed = now - self.time
+        if elapsed <= 0:
+            return
+        self.time = now
+        limit = torque_limit if torque_limit > 0 else self.MAX_TORQUE
+        if not enabled:
+            target = 0.0
+        elif speed_mode:
+            target = speed_command / self.RPM_PER_NM + self.SPEED_GAIN * (speed_command - self.speed)
+        else:
+            target = torque_command
+        self.commanded_torque = -limit if target < -limit else limit if target > limit else target
+
+        self.torque += (self.commanded_torque - self.torque) * (1 - exp(-elapsed / self.TORQUE_TIME_CONSTANT))
+        self.speed += (self.torque * self.RPM_PER_NM - self.speed) * (1 - exp(-elapsed / self.MECHANICAL_TIME_CONSTANT))
+        # rpm to degrees per second
+        self.angle = (self.angle + self.speed * 6 * elapsed) % 360
+        self.electrical_frequency = abs(self.speed) / 60 * self.POLE_PAIRS
+
+        self.iq_current = self.AMPS_PER_NM * self.torque
+        self.id_current = -0.1 * abs(self.iq_current)
+        self.current = abs(self.iq_current)
+        power = self.torque * self.speed * 2 * pi / 60
+        self.dc_bus_current = power / self.EFFICIENCY / self.NOMINAL_DC_BUS_VOLTAGE if power > 0 \
+            else power * self.EFFICIENCY / self.NOMINAL_DC_BUS_VOLTAGE
+        self.dc_bus_voltage = self.NOMINAL_DC_BUS_VOLTAGE - self.DC_BUS_RESISTANCE * self.dc_bus_current
+        self.output_voltage = min(self.VOLTS_PER_RPM * abs(self.speed), 0.6 * self.dc_bus_voltage)
+
+        squared = self.current * self.current
+        self.module_temperature += (self.ambient_temperature + self.MODULE_RISE_PER_AMP_SQUARED * squared -
+                                    self.module_temperature) * (1 - exp(-elapsed / self.MODULE_TIME_CONSTANT))
+        self.motor_temperature += (self.ambient_temperature + self.MOTOR_RISE_PER_AMP_SQUARED * squared -
+                                   self.motor_temperature) * (1 - exp(-elapsed / self.MOTOR_TIME_CONSTANT))
+
+    def phase_currents(self) -> tuple:
+        """ Returns the instantaneous phase a, b and c currents at the current electrical angle"""
+        electrical_angle = self.angle * pi / 180 * self.POLE_PAIRS
+        return (self.current * sin(electrical_angle), self.current * sin(electrical_angle - 2 * pi / 3),
+                self.current * sin(electrical_angle + 2 * pi / 3))
 
 
 class DTSSimulator:
@@ -13,14 +176,39 @@ class DTSSimulator:
 
     The majority of the data sent over the can bus contains spoofed data, however
     the simulator is able to correctly interpret command messages, and send back the correct
-    data based on the command message received.
+    data based on the command message received. Speed, torque, currents, voltages and
+    temperatures come from a first-order MotorModel driven by the command, with noise from
+    numpy generated blocks, and each message is packed in place with struct.
+
+    Each message is sent at its own rate by a deadline based scheduler (see run). Deadlines
+    are kept on time.monotonic() and advance by exactly one period per send, so rates do not
+    drift, and the time until the next deadline is spent waiting for command messages.
 
     Fields:
         See methods, too many to list here, but all are data that the real inverter
         sends through CAN messages
+        can_offset (int): can offset of the simulated inverter, its messages are sent with ids
+                          from can_offset, and commands received on can_offset + COMMAND_OFFSET
+        command_id (int)
+        injector (fault_injection.FaultInjector): injects faults into the frames sent, None for a
+                                                  well behaved bus
+        rates (dict): rate in Hz each message is sent at, keyed by message id
+        command_timeout (float): time in seconds without a command message after which the
+                                 simulation stops, None to run without commands
+        model (MotorModel): model of the motor the telemetry is generated from
+        noise (dict): NoiseSource of each message with noisy fields, keyed by message id at the
+                      default can offset
+        sent_counts (dict): number of messages sent, keyed by message id
+        commands_received (int): number of command messages received
+        send_errors (int): number of messages that could not be sent, e.g. transmit buffer full
+        late_sends (int): number of messages sent more than a period after their deadline
+        max_lateness (float): longest time in seconds a message was sent after its deadline
 
     Methods:
-        check_can_timeout(self, message)
+        run(self, duration=None, headless=False, display_interval=1.0) -> dict
+        counters(self) -> dict
+        advance_model(self)
+        check_can_timeout(self, message) -> bool
         display_currents(self)
         display_motor_info(self)
         display_temps(self)
@@ -44,34 +232,101 @@ class DTSSimulator:
         update_voltage_information(self)
     """
 
-    def __init__(self, bus_name: str):
+    def __init__(self, bus_name: str, interface='socketcan', rates=None, command_timeout=0.5, seed=None,
+                 can_offset=DEFAULT_CAN_OFFSET, can_bus=None, injector=None):
+        """
+        Args:
+            bus_name (str): channel to simulate the inverter on
+            interface (str): python-can interface of the channel
+            rates (dict): rate in Hz of each message id to send, defaults to DEFAULT_RATES moved to
+                          the can offset. Message ids not included are not sent
+            command_timeout (float): time in seconds without a command message after which the
+                                     simulation stops, None to run without commands
+            seed (int): seed of the noise, None for different noise on every run
+            can_offset (int): can offset of the simulated inverter
+            can_bus (can_manager.CanManager): bus to send on, shared by several simulators in one
+                                              process, by default a new one is created
+            injector (fault_injection.FaultInjector): sends the frames instead of the bus, to make
+                                                      the bus misbehave
+        """
         # Configure bus
-        self.can_bus = can_manager.CanManager(bus_name)
+        self.can_bus = can_manager.CanManager(bus_name, 1 / MAX_RATE, interface=interface) if can_bus is None \
+            else can_bus
+        self.can_offset = can_offset
+        self.command_id = can_offset + COMMAND_OFFSET
+        self.injector = injector
 
         # Configure messages
-        self.temperature1 = can.Message(arbitration_id=160, dlc=8)
-        self.temperature2 = can.Message(arbitration_id=161, dlc=8)
-        self.temperature3 = can.Message(arbitration_id=162, dlc=8)
-        self.analog_input_voltages = can.Message(arbitration_id=163, dlc=8)
-        self.digital_input_status = can.Message(arbitration_id=164, dlc=8)
-        self.motor_position_information = can.Message(
-            arbitration_id=165,
-            dlc=8
-        )
-        self.current_information = can.Message(arbitration_id=166, dlc=8)
-        self.voltage_information = can.Message(arbitration_id=167, dlc=8)
-        self.flux_information = can.Message(arbitration_id=168, dlc=8)
-        self.internal_voltages = can.Message(arbitration_id=169, dlc=8)
-        self.internal_states = can.Message(arbitration_id=170, dlc=8)
-        self.fault_codes = can.Message(arbitration_id=171, dlc=8)
-        self.torque_timer_info = can.Message(arbitration_id=172, dlc=8)
-        self.modulation_index_flux_weakening = can.Message(
-            arbitration_id=173,
-            dlc=8
-        )
-        self.firmware_information = can.Message(arbitration_id=174, dlc=8)
+        def message(index: int) -> can.Message:
+            return can.Message(arbitration_id=can_offset + index, data=bytes(8), is_extended_id=False)
+
+        self.temperature1 = message(0)
+        self.temperature2 = message(1)
+        self.temperature3 = message(2)
+        self.analog_input_voltages = message(3)
+        self.digital_input_status = message(4)
+        self.motor_position_information = message(5)
+        self.current_information = message(6)
+        self.voltage_information = message(7)
+        self.flux_information = message(8)
+        self.internal_voltages = message(9)
+        self.internal_states = message(10)
+        self.fault_codes = message(11)
+        self.torque_timer_info = message(12)
+        self.modulation_index_flux_weakening = message(13)
+        self.firmware_information = message(14)
         self.last_received_command_message = 0
 
+        # Message and update method of each message id
+        self.message_sources = {
+            message.arbitration_id: (message, update) for message, update in (
+                (self.temperature1, self.update_temperature1),
+                (self.temperature2, self.update_temperature2),
+                (self.temperature3, self.update_temperature3),
+                (self.analog_input_voltages, self.update_analog_input_voltages),
+                (self.digital_input_status, self.update_digital_input_status),
+                (self.motor_position_information, self.update_motor_position_information),
+                (self.current_information, self.update_current_information),
+                (self.voltage_information, self.update_voltage_information),
+                (self.flux_information, self.update_flux_information),
+                (self.internal_voltages, self.update_internal_voltages),
+                (self.internal_states, self.update_internal_states),
+                (self.fault_codes, self.update_fault_codes),
+                (self.torque_timer_info, self.update_torque_timer_information),
+                (self.modulation_index_flux_weakening, self.update_modulation_index),
+            )
+        }
+        if rates is None:
+            rates = {message_id - DEFAULT_CAN_OFFSET + can_offset: rate for message_id, rate in DEFAULT_RATES.items()}
+        self.rates = dict(rates)
+        for message_id, rate in self.rates.items():
+            if message_id not in self.message_sources:
+                raise ValueError(f'Error: message id {message_id} is not simulated')
+            if not 0 < rate <= MAX_RATE:
+                raise ValueError(f'Error: rate of message {message_id} must be between 0 and {MAX_RATE}Hz, not {rate}')
+        self.command_timeout = command_timeout
+
+        # Command state until the first command message is received
+        self.torque_command = 0.0
+        self.speed_command = 0.0
+        self.direction_command = False
+        self.inverter_enable = 0
+        self.inverter_discharge = 0
+        self.speed_mode_enable = 0
+        self.commanded_torque_limit = 0.0
+
+        self.model = MotorModel(time.monotonic())
+        rng = np.random.default_rng(seed)
+        self.noise = {message_id: NoiseSource(deviations, rng) for message_id, deviations in NOISE.items()}
+
+        # Counters
+        self.sent_counts = {message_id: 0 for message_id in self.rates}
+        self.commands_received = 0
+        self.send_errors = 0
+        self.late_sends = 0
+        self.max_lateness = 0.0
+        self.elapsed = 0.0
+
     def __str__(self):
         return f'''
         Current DTS Sim State:
@@ -98,17 +353,17 @@ class DTSSimulator:
         RTD 4 Temperature: {:.2f}
         RTD 5 Temperature: {:.2f}
         Motor Temperature: {:.2f}
-        '''.format(self.module_a_temp / 10,
-                   self.module_b_temp / 10,
-                   self.module_c_temp / 10,
-                   self.gate_driver_board_temp / 10,
-                   self.control_board_temp / 10,
-                   self.rtd_1_temp / 10,
-                   self.rtd_2_temp / 10,
-                   self.rtd_4_temp / 10,
-                   self.rtd_4_temp / 10,
-                   self.rtd_5_temp / 10,
-                   self.motor_temp / 10)
+        '''.format(self.module_a_temp,
+                   self.module_b_temp,
+                   self.module_c_temp,
+                   self.gate_driver_board_temp,
+                   self.control_board_temp,
+                   self.rtd_1_temp,
+                   self.rtd_2_temp,
+                   self.rtd_3_temp,
+                   self.rtd_4_temp,
+                   self.rtd_5_temp,
+                   self.motor_temp)
 
     def display_voltages(self):
         return '''
@@ -125,18 +380,18 @@ class DTSSimulator:
         Output Voltage: {:.2f}V
         VAB_Vd Voltage: {:.2f}V
         VBC_Vq Voltage: {:.2f}V
-        '''.format(self.analog_input_1 / 100,
-                   self.analog_input_2 / 100,
-                   self.analog_input_3 / 100,
-                   self.analog_input_4 / 100,
-                   self.one_five_voltage_ref / 100,
-                   self.two_five_voltage_ref / 100,
-                   self.five_voltage_ref / 100,
-                   self.twelve_system_voltage / 100,
-                   self.dc_bus_voltage / 10,
-                   self.output_voltage / 10,
-                   self.vab_vd_voltage / 10,
-                   self.vbc_vq_voltage / 10)
+        '''.format(self.analog_input_1,
+                   self.analog_input_2,
+                   self.analog_input_3,
+                   self.analog_input_4,
+                   self.one_five_voltage_ref,
+                   self.two_five_voltage_ref,
+                   self.five_voltage_ref,
+                   self.twelve_system_voltage,
+                   self.dc_bus_voltage,
+                   self.output_voltage,
+                   self.vab_vd_voltage,
+                   self.vbc_vq_voltage)
 
     def display_currents(self):
         return '''
@@ -147,12 +402,12 @@ class DTSSimulator:
         DC Bus Current: {:.2f}A
         Id Feedback Current: {:.2f}A
         Iq Feedback Current: {:.2f}A
-        '''.format(self.phase_a_current / 10,
-                   self.phase_b_current / 10,
-                   self.phase_c_current / 10,
-                   self.dc_bus_current / 10,
-                   self.id_feedback / 10,
-                   self.iq_feedback / 10)
+        '''.format(self.phase_a_current,
+                   self.phase_b_current,
+                   self.phase_c_current,
+                   self.dc_bus_current,
+                   self.id_feedback,
+                   self.iq_feedback)
 
     def display_motor_info(self):
         return '''
@@ -162,155 +417,146 @@ class DTSSimulator:
         Electrical Output Frequency: {:.2f}Hz
         Delta Filter Resolved: {:.2f}Degrees
         Commanded Torque: {:.2f} Nm
-        '''.format(self.motor_angle / 10,
+        Torque Feedback: {:.2f} Nm
+        '''.format(self.motor_angle,
                    self.motor_speed,
-                   self.electrical_output_frequency / 10,
-                   self.delta_filter_resolved / 10,
-                   self.torque_command)
-
-    def check_can_timeout(self, message: can.Message):
+                   self.electrical_output_frequency,
+                   self.delta_filter_resolved,
+                   self.model.commanded_torque,
+                   self.model.torque)
+
+    def check_can_timeout(self, message: can.Message) -> bool:
+        """ Returns True if no command message was received within the command timeout"""
+        if self.command_timeout is None:
+            return False
         if self.last_received_command_message == 0:
-            self.last_received_command_message = time.time()
-        if message is not None and message.arbitration_id == 192:
-            self.last_received_command_message = time.time()
-        if time.time() - self.last_received_command_message > .5:
-            sys.exit()
+            self.last_received_command_message = time.monotonic()
+        if message is not None and message.arbitration_id == self.command_id:
+            self.last_received_command_message = time.monotonic()
+        return time.monotonic() - self.last_received_command_message > self.command_timeout
+
+    def advance_model(self):
+        """ Advances the motor model to the current time, with the latest command
+
+        Called once before each batch of messages is sent rather than by every update, as the
+        model changes little between messages sent at the same time
+        """
+        self.model.advance(time.monotonic(), self.torque_command, self.speed_command, self.speed_mode_enable,
+                           self.inverter_enable, self.commanded_torque_limit)
 
     def update_temperature1(self):
-        self.module_a_temp = 200 + random() * 5.0
-        self.module_b_temp = 210 + random() * 4.5
-        self.module_c_temp = 205 + random() * 3.7
-        self.gate_driver_board_temp = 190 + random() * 6.2
-        module_a_temp_bytes = int(self.module_a_temp).to_bytes(2, 'little')
-        module_b_temp_bytes = int(self.module_b_temp).to_bytes(2, 'little')
-        module_c_temp_bytes = int(self.module_c_temp).to_bytes(2, 'little')
-        gate_driver_board_temp_bytes = int(
-            self.gate_driver_board_temp).to_bytes(2, 'little')
-        self.temperature1.data = module_a_temp_bytes + module_b_temp_bytes + \
-            module_c_temp_bytes + gate_driver_board_temp_bytes
+        model = self.model
+        noise = self.noise[160].next()
+        self.module_a_temp = model.module_temperature + noise[0]
+        self.module_b_temp = model.module_temperature + 1.0 + noise[1]
+        self.module_c_temp = model.module_temperature + 0.5 + noise[2]
+        self.gate_driver_board_temp = model.module_temperature - 1.0 + noise[3]
+        SIGNALS.pack_into(self.temperature1.data, 0, _scaled(self.module_a_temp, 10), _scaled(self.module_b_temp, 10),
+                          _scaled(self.module_c_temp, 10), _scaled(self.gate_driver_board_temp, 10))
 
     def update_temperature2(self):
-        self.control_board_temp = 240 + random() * 4.5
-        self.rtd_1_temp = 230 + random() * 6.3
-        self.rtd_2_temp = 225 + random() * 3.4
-        self.rtd_3_temp = 220 + random() * 2.3
-        control_board_temp_bytes = int(
-            self.control_board_temp).to_bytes(2, 'little')
-        rtd_1_temp_bytes = int(self.rtd_1_temp).to_bytes(2, 'little')
-        rtd_2_temp_bytes = int(self.rtd_2_temp).to_bytes(2, 'little')
-        rtd_3_temp_bytes = int(self.rtd_3_temp).to_bytes(2, 'little')
-        self.temperature2.data = control_board_temp_bytes + \
-            rtd_1_temp_bytes + rtd_2_temp_bytes + rtd_3_temp_bytes
+        model = self.model
+        noise = self.noise[161].next()
+        self.control_board_temp = model.ambient_temperature + 4.0 + noise[0]
+        self.rtd_1_temp = model.ambient_temperature + 3.0 + noise[1]
+        self.rtd_2_temp = model.ambient_temperature + 2.5 + noise[2]
+        self.rtd_3_temp = model.ambient_temperature + 2.0 + noise[3]
+        SIGNALS.pack_into(self.temperature2.data, 0, _scaled(self.control_board_temp, 10), _scaled(self.rtd_1_temp, 10),
+                          _scaled(self.rtd_2_temp, 10), _scaled(self.rtd_3_temp, 10))
 
     def update_temperature3(self):
-        self.rtd_4_temp = 203 + random() * 2.1
-        self.rtd_5_temp = 256 + random() * 3.9
-        self.motor_temp = 232 + random() * 4.2
-        rtd_4_temp_bytes = int(self.rtd_4_temp).to_bytes(2, 'little')
-        rtd_5_temp_bytes = int(self.rtd_5_temp).to_bytes(2, 'little')
-        motor_temp_bytes = int(self.motor_temp).to_bytes(2, 'little')
+        model = self.model
+        noise = self.noise[162].next()
+        self.rtd_4_temp = model.ambient_temperature + 0.5 + noise[0]
+        self.rtd_5_temp = model.ambient_temperature + 6.0 + noise[1]
+        self.motor_temp = model.motor_temperature + noise[2]
         # TODO once set torque value gets stored
-        torque_shudder_bytes = int(0).to_bytes(2, 'little')
-        self.temperature3.data = rtd_4_temp_bytes + \
-            rtd_5_temp_bytes + motor_temp_bytes + torque_shudder_bytes
+        SIGNALS.pack_into(self.temperature3.data, 0, _scaled(self.rtd_4_temp, 10), _scaled(self.rtd_5_temp, 10),
+                          _scaled(self.motor_temp, 10), 0)
 
     def update_analog_input_voltages(self):
-        self.analog_input_1 = 120 + random() * 10.4
-        self.analog_input_2 = 200 + random() * 7.1
-        self.analog_input_3 = 178 + random() * 2.3
-        self.analog_input_4 = 153 + random() * 6.6
-        analog_input_1_bytes = int(self.analog_input_1).to_bytes(2, 'little')
-        analog_input_2_bytes = int(self.analog_input_2).to_bytes(2, 'little')
-        analog_input_3_bytes = int(self.analog_input_3).to_bytes(2, 'little')
-        analog_input_4_bytes = int(self.analog_input_4).to_bytes(2, 'little')
-        self.analog_input_voltages.data = analog_input_1_bytes + \
-            analog_input_2_bytes + analog_input_3_bytes + analog_input_4_bytes
+        noise = self.noise[163].next()
+        self.analog_input_1 = 1.25 + noise[0]
+        self.analog_input_2 = 2.03 + noise[1]
+        self.analog_input_3 = 1.79 + noise[2]
+        self.analog_input_4 = 1.56 + noise[3]
+        SIGNALS.pack_into(self.analog_input_voltages.data, 0, _scaled(self.analog_input_1, 100),
+                          _scaled(self.analog_input_2, 100), _scaled(self.analog_input_3, 100),
+                          _scaled(self.analog_input_4, 100))
 
     def update_digital_input_status(self):
         pass
 
     def update_motor_position_information(self):
-        self.motor_angle = 180 + random() * 180
-        self.motor_speed = (
-            self.speed_command if self.speed_mode_enable else self.torque_command)
-        self.electrical_output_frequency = 1000 + random() * 20
-        self.delta_filter_resolved = 900 + random() * 900
-        motor_angle_bytes = int(self.motor_angle).to_bytes(2, 'little')
-        motor_speed_bytes = int(self.motor_speed * 10).to_bytes(2, 'little')
-        electrical_output_frequency_bytes = int(
-            self.electrical_output_frequency).to_bytes(2, 'little')
-        delta_filter_resolved_bytes = int(
-            self.delta_filter_resolved).to_bytes(2, 'little')
-        self.motor_position_information.data = motor_angle_bytes + motor_speed_bytes + \
-            electrical_output_frequency_bytes + delta_filter_resolved_bytes
+        model = self.model
+        noise = self.noise[165].next()
+        self.motor_angle = model.angle
+        self.motor_speed = model.speed + noise[0]
+        self.electrical_output_frequency = model.electrical_frequency
+        self.delta_filter_resolved = noise[1]
+        SIGNALS.pack_into(self.motor_position_information.data, 0, _scaled(self.motor_angle, 10),
+                          _scaled(self.motor_speed, 1), _scaled(self.electrical_output_frequency, 10),
+                          _scaled(self.delta_filter_resolved, 10))
 
     def update_current_information(self):
-        self.phase_a_current = 20 + random() * 5
-        self.phase_b_current = 20 + random() * 5
-        self.phase_c_current = 20 + random() * 5
-        self.dc_bus_current = 15 + random() * 6
-        phase_a_current_bytes = int(self.phase_a_current).to_bytes(2, 'little')
-        phase_b_current_bytes = int(self.phase_b_current).to_bytes(2, 'little')
-        phase_c_current_bytes = int(self.phase_c_current).to_bytes(2, 'little')
-        dc_bus_current_bytes = int(self.dc_bus_current).to_bytes(2, 'little')
-        self.current_information.data = phase_a_current_bytes + \
-            phase_b_current_bytes + phase_c_current_bytes + dc_bus_current_bytes
+        model = self.model
+        noise = self.noise[166].next()
+        self.phase_a_current, self.phase_b_current, self.phase_c_current = model.phase_currents()
+        self.phase_a_current += noise[0]
+        self.phase_b_current += noise[1]
+        self.phase_c_current += noise[2]
+        self.dc_bus_current = model.dc_bus_current + noise[3]
+        SIGNALS.pack_into(self.current_information.data, 0, _scaled(self.phase_a_current, 10),
+                          _scaled(self.phase_b_current, 10), _scaled(self.phase_c_current, 10),
+                          _scaled(self.dc_bus_current, 10))
 
     def update_voltage_information(self):
-        self.dc_bus_voltage = 200 + random() * 7.1
-        self.output_voltage = 205 + random() * 5.5
-        self.vab_vd_voltage = 190 + random() * 9.1
-        self.vbc_vq_voltage = 180 + random() * 6.4
-        dc_bus_voltage_bytes = int(self.dc_bus_voltage).to_bytes(2, 'little')
-        output_voltage_bytes = int(self.output_voltage).to_bytes(2, 'little')
-        vab_vd_voltage_bytes = int(self.vab_vd_voltage).to_bytes(2, 'little')
-        vbc_vq_voltage_bytes = int(self.vbc_vq_voltage).to_bytes(2, 'little')
-        self.voltage_information.data = dc_bus_voltage_bytes + \
-            output_voltage_bytes + vab_vd_voltage_bytes + vbc_vq_voltage_bytes
+        model = self.model
+        noise = self.noise[167].next()
+        self.dc_bus_voltage = model.dc_bus_voltage + noise[0]
+        self.output_voltage = model.output_voltage + noise[1]
+        self.vab_vd_voltage = -0.2 * model.output_voltage + noise[2]
+        self.vbc_vq_voltage = model.output_voltage + noise[3]
+        SIGNALS.pack_into(self.voltage_information.data, 0, _scaled(self.dc_bus_voltage, 10),
+                          _scaled(self.output_voltage, 10), _scaled(self.vab_vd_voltage, 10),
+                          _scaled(self.vbc_vq_voltage, 10))
 
     def update_flux_information(self):
-        self.flux_command = 2 + random() * .64
-        self.flux_feedback = 2 + random() * .64
-        self.id_feedback = 20 + random() * 5
-        self.iq_feedback = 20 + random() * 5
-        flux_command_bytes = int(self.flux_command).to_bytes(2, 'little')
-        flux_feedback_bytes = int(self.flux_feedback).to_bytes(2, 'little')
-        id_feedback_bytes = int(self.id_feedback).to_bytes(2, 'little')
-        iq_feedback_bytes = int(self.iq_feedback).to_bytes(2, 'little')
-        self.flux_information.data = flux_command_bytes + \
-            flux_feedback_bytes + id_feedback_bytes + iq_feedback_bytes
+        model = self.model
+        noise = self.noise[168].next()
+        self.flux_command = 0.05
+        self.flux_feedback = 0.05 + noise[0]
+        self.id_feedback = model.id_current + noise[1]
+        self.iq_feedback = model.iq_current + noise[2]
+        SIGNALS.pack_into(self.flux_information.data, 0, _scaled(self.flux_command, 1000),
+                          _scaled(self.flux_feedback, 1000), _scaled(self.id_feedback, 10),
+                          _scaled(self.iq_feedback, 10))
 
     def update_internal_voltages(self):
-        self.one_five_voltage_ref = 150
-        self.two_five_voltage_ref = 250
-        self.five_voltage_ref = 500
-        self.twelve_system_voltage = 1200
-        one_five_voltage_ref_bytes = int(
-            self.one_five_voltage_ref).to_bytes(2, 'little')
-        two_five_voltage_ref_bytes = int(
-            self.two_five_voltage_ref).to_bytes(2, 'little')
-        five_voltage_ref_bytes = int(
-            self.five_voltage_ref).to_bytes(2, 'little')
-        twelve_system_voltage_bytes = int(
-            self.twelve_system_voltage).to_bytes(2, 'little')
-        self.internal_voltages.data = one_five_voltage_ref_bytes + \
-            two_five_voltage_ref_bytes + five_voltage_ref_bytes + twelve_system_voltage_bytes
+        noise = self.noise[169].next()
+        self.one_five_voltage_ref = 1.5 + noise[0]
+        self.two_five_voltage_ref = 2.5 + noise[1]
+        self.five_voltage_ref = 5.0 + noise[2]
+        self.twelve_system_voltage = 12.0 + noise[3]
+        SIGNALS.pack_into(self.internal_voltages.data, 0, _scaled(self.one_five_voltage_ref, 100),
+                          _scaled(self.two_five_voltage_ref, 100), _scaled(self.five_voltage_ref, 100),
+                          _scaled(self.twelve_system_voltage, 100))
 
     def update_internal_states(self):
-        pass
+        # VSM state 6 is motor running, 4 is ready
+        enabled = 1 if self.inverter_enable else 0
+        INTERNAL_STATES.pack_into(self.internal_states.data, 0, 6 if enabled else 4, 0, 0,
+                                  1 if self.speed_mode_enable else 0, 0, enabled, int(self.direction_command))
 
     def update_fault_codes(self):
         pass
 
     def update_torque_timer_information(self):
-        self.power_on_timer = time.time() * 0.03
-        commanded_torque_bytes = int(
-            self.torque_command * 10).to_bytes(2, 'little')
-        torque_feedback_bytes = int(
-            self.torque_command * 10).to_bytes(2, 'little')
-        power_on_timer_bytes = int(self.power_on_timer).to_bytes(4, 'little')
-        self.torque_timer_info.data = commanded_torque_bytes + \
-            torque_feedback_bytes + power_on_timer_bytes
+        model = self.model
+        # Power on timer counts in 3ms steps
+        self.power_on_timer = int((time.monotonic() - model.start_time) / 0.003) & 0xFFFFFFFF
+        TORQUE_TIMER.pack_into(self.torque_timer_info.data, 0, _scaled(model.commanded_torque, 10),
+                               _scaled(model.torque, 10), self.power_on_timer)
 
     def update_modulation_index(self):
         pass
@@ -319,6 +565,8 @@ class DTSSimulator:
         BIT_1 = 1
         BIT_2 = 2
         BIT_3 = 4
+        # Advance the model with the previous command up to now, before applying the new one
+        self.advance_model()
         self.torque_command = int.from_bytes(
             message.data[:2], byteorder='little', signed=True) / 10
         self.speed_command = int.from_bytes(
@@ -331,57 +579,178 @@ class DTSSimulator:
             message.data[6:], byteorder='little', signed=True) / 10
 
     def send_information_messages_10hz(self):
-        time.sleep(1 / 10)
-        self.can_bus.bus.send(self.temperature1)
-        self.can_bus.bus.send(self.temperature2)
-        self.can_bus.bus.send(self.temperature3)
-        self.can_bus.bus.send(self.internal_voltages)
-        self.can_bus.bus.send(self.fault_codes)
+        """ Sends the messages sent at 10Hz by default once, see run for scheduled sending"""
+        self.advance_model()
+        for index in (0, 1, 2, 9, 11):
+            self._send(self.can_offset + index)
 
     def send_information_messages_100hz(self):
-        time.sleep(1 / 100)
-        self.can_bus.bus.send(self.analog_input_voltages)
-        self.can_bus.bus.send(self.digital_input_status)
-        self.can_bus.bus.send(self.motor_position_information)
-        self.can_bus.bus.send(self.current_information)
-        self.can_bus.bus.send(self.voltage_information)
-        self.can_bus.bus.send(self.flux_information)
-        self.can_bus.bus.send(self.internal_states)
-        self.can_bus.bus.send(self.torque_timer_info)
-        self.can_bus.bus.send(self.modulation_index_flux_weakening)
-
-
-def run_simulation(bus_name: str):
-    sim = DTSSimulator(bus_name)
-    simulator_configured = False
-    while simulator_configured == False:
-        message = sim.can_bus.bus.recv()
-        if message.arbitration_id == 192:
-            sim.read_configuration_message(message)
-            simulator_configured = True
-    while True:
-        message = sim.can_bus.bus.recv(0.1)
-        sim.check_can_timeout(message)
-        if message is not None and message.arbitration_id == 192:
+        """ Sends the messages sent at 100Hz by default once, see run for scheduled sending"""
+        self.advance_model()
+        for index in (3, 4, 5, 6, 7, 8, 10, 12, 13):
+            self._send(self.can_offset + index)
+
+    def _send(self, message_id: int) -> None:
+        message, update = self.message_sources[message_id]
+        update()
+        if self.injector is not None:
+            self.injector.send(self.can_bus.bus, message)
+            return
+        try:
+            self.can_bus.bus.send(message)
+        except can.CanError:
+            self.send_errors += 1
+
+    def update_all(self):
+        self.advance_model()
+        for _, update in self.message_sources.values():
+            update()
+
+    def run(self, duration=None, headless=False, display_interval=1.0) -> dict:
+        """ Sends every message at its rate until the duration elapses or commands time out
+
+        Args:
+            duration (float): time in seconds to run for, None to run until commands time out
+            headless (bool): only keep counters, without printing the simulator state
+            display_interval (float): time in seconds between prints of the simulator state
+
+        Returns:
+            (dict) counters, see counters
+        """
+        run_scheduled([self], duration, headless, display_interval)
+        return self.counters()
+
+    def counters(self) -> dict:
+        """ Returns the counters of the last run, with the rate each message was sent at"""
+        elapsed = self.elapsed or float('nan')
+        return {
+            'elapsed': self.elapsed,
+            'sent': sum(self.sent_counts.values()),
+            'rates': {message_id: count / elapsed for message_id, count in self.sent_counts.items()},
+            'commands_received': self.commands_received,
+            'send_errors': self.send_errors,
+            'late_sends': self.late_sends,
+            'max_lateness': self.max_lateness,
+        }
+
+
+def run_scheduled(simulators: list, duration=None, headless=False, display_interval=1.0) -> None:
+    """ Sends the messages of several simulators sharing a bus, each message at its rate
+
+    The messages due next are kept in a heap ordered by deadline. Each message is updated
+    just before it is sent, and its next deadline is one period after the previous one, so
+    late sends do not delay the following ones. A message that falls more than a period
+    behind (e.g. when the machine is overloaded) skips the missed sends rather than bursting
+    to catch up. Between deadlines the bus is read for command messages, which are passed to
+    the simulator with that command id, and frames delayed by fault injectors are released
+
+    Args:
+        simulators (list(DTSSimulator)): simulators to run, all sending on the same CanManager
+        duration (float): time in seconds to run for, None to run until commands time out
+        headless (bool): only keep counters, without printing the simulator state
+        display_interval (float): time in seconds between prints of the state of the first simulator
+    """
+    bus = simulators[0].can_bus.bus
+    by_command_id = {sim.command_id: sim for sim in simulators}
+    injectors = [sim.injector for sim in simulators if sim.injector is not None]
+    for sim in simulators:
+        sim.update_all()
+    start = time.monotonic()
+    end = None if duration is None else start + duration
+    periods = [{message_id: 1 / rate for message_id, rate in sim.rates.items()} for sim in simulators]
+    schedule = [(start, index, message_id) for index, sim in enumerate(simulators) for message_id in sim.rates]
+    heapq.heapify(schedule)
+    next_display = start + display_interval
+
+    while schedule:
+        now = time.monotonic()
+        if end is not None and now >= end:
+            break
+        # Wait for commands until the next deadline, or just poll if it has passed
+        deadline = schedule[0][0] if end is None else min(schedule[0][0], end)
+        for injector in injectors:
+            release = injector.next_release()
+            if release is not None and release < deadline:
+                deadline = release
+        message = bus.recv(deadline - now if deadline > now else 0)
+        if message is not None and message.arbitration_id in by_command_id:
+            sim = by_command_id[message.arbitration_id]
             sim.read_configuration_message(message)
-        sim.update_temperature1()
-        sim.update_temperature2()
-        sim.update_temperature3()
-        sim.update_analog_input_voltages()
-        sim.update_digital_input_status()
-        sim.update_motor_position_information()
-        sim.update_current_information()
-        sim.update_voltage_information()
-        sim.update_flux_information()
-        sim.update_internal_voltages()
-        sim.update_internal_states()
-        sim.update_fault_codes()
-        sim.update_torque_timer_information()
-        sim.update_modulation_index()
-        sim.send_information_messages_10hz()
-        sim.send_information_messages_100hz()
-        print(sim)
+            sim.commands_received += 1
+        if any(sim.check_can_timeout(message) for sim in simulators):
+            break
+
+        now = time.monotonic()
+        for injector in injectors:
+            injector.release(bus, now)
+        advanced = set()
+        while schedule[0][0] <= now:
+            deadline, index, message_id = schedule[0]
+            sim = simulators[index]
+            if index not in advanced:
+                sim.advance_model()
+                advanced.add(index)
+            sim._send(message_id)
+            sim.sent_counts[message_id] += 1
+            period = periods[index][message_id]
+            lateness = now - deadline
+            if lateness > sim.max_lateness:
+                sim.max_lateness = lateness
+            next_deadline = deadline + period
+            if lateness > period:
+                sim.late_sends += 1
+                next_deadline = now + period
+            heapq.heapreplace(schedule, (next_deadline, index, message_id))
+
+        if not headless and now >= next_display:
+            next_display += display_interval
+            print(simulators[0])
+    for injector in injectors:
+        injector.flush(bus)
+    elapsed = time.monotonic() - start
+    for sim in simulators:
+        sim.elapsed = elapsed
+
+
+def run_simulation(bus_name: str, interface='socketcan', headless=False, rates=None, duration=None,
+                   can_offset=DEFAULT_CAN_OFFSET):
+    """ Simulates the inverter on a channel
+
+    Unless headless, waits for the first command message before sending, and stops once
+    commands stop arriving, like the real inverter. Headless simulations run without
+    commands, to generate load for ingest benchmarks
+
+    Args:
+        bus_name (str): channel to simulate the inverter on
+        interface (str): python-can interface of the channel
+        headless (bool): run without commands and without printing, only counting messages
+        rates (dict): rate in Hz of each message id, defaults to DEFAULT_RATES moved to the can offset
+        duration (float): time in seconds to run for, None to run until commands time out
+        can_offset (int): can offset of the simulated inverter
+
+    Returns:
+        (dict) counters of the simulation
+    """
+    sim = DTSSimulator(bus_name, interface, rates, command_timeout=None if headless else 0.5,
+                       can_offset=can_offset)
+    if not headless:
+        simulator_configured = False
+        while simulator_configured == False:
+            message = sim.can_bus.bus.recv()
+            if message.arbitration_id == sim.command_id:
+                sim.read_configuration_message(message)
+                simulator_configured = True
+    return sim.run(duration, headless)
 
 
 if __name__ == "__main__":
-    run_simulation('vcan0')
+    # python3 dts_simulator.py [channel] [headless] [rate] [duration] [can offset]
+    # rate in Hz overrides the rate of every message
+    channel = sys.argv[1] if len(sys.argv) > 1 else 'vcan0'
+    headless = len(sys.argv) > 2 and sys.argv[2] == 'headless'
+    can_offset = int(sys.argv[5]) if len(sys.argv) > 5 else DEFAULT_CAN_OFFSET
+    rates = {message_id - DEFAULT_CAN_OFFSET + can_offset: float(sys.argv[3]) for message_id in DEFAULT_RATES} \
+        if len(sys.argv) > 3 else None
+    duration = float(sys.argv[4]) if len(sys.argv) > 4 else None
+    counters = run_simulation(channel, headless=headless, rates=rates, duration=duration, can_offset=can_offset)
+    print(counters)
@@ -0,0 +1,250 @@
+""" fault_injection.py
+
+Makes a simulated bus misbehave, to measure how CanManager and DTSTelemetry cope. A
+FaultInjector sits between a DTSSimulator and its bus, and for every frame draws from a
+seeded random generator whether to pass it on untouched or to:
+    drop       not send it
+    burst      hold it and the following frames, then send them back to back
+    delay      send it after a fixed delay, after newer frames of the same id
+    reorder    send it after the next frame
+    duplicate  send it twice
+    dlc        send it with a shorter DLC, cutting off the end of the payload
+    payload    send it with one payload byte corrupted
+Every fault is recorded in a ground truth log, so a receiver can tell which frames it
+received, assigned or decoded were faulty.
+
+    injector = FaultInjector({'drop': 0.01, 'payload': 0.005}, seed=1)
+    sim = DTSSimulator('vcan0', command_timeout=None, injector=injector)
+    sim.run(10, headless=True)
+    injector.write_log('faults.csv')
+"""
+
+import csv
+import heapq
+import random
+import time
+
+import can
+
+FAULT_KINDS = ('drop', 'burst', 'delay', 'reorder', 'duplicate', 'dlc', 'payload')
+
+
+class InjectedFault():
+    """ Ground truth record of one faulty frame
+
+    Fields:
+        time (float): time.time() the frame was sent, or would have been for dropped frames
+        kind (str): one of FAULT_KINDS
+        message_id (int)
+        data (bytes): payload as sent, the original payload for dropped frames
+        detail: depends on the kind. Time in seconds the frame was held for burst, delay and
+                reorder, copy number (1 or 2) for duplicate, length of the original payload for dlc,
+                and index of the corrupted byte for payload. None for drop
+    """
+
+    __slots__ = ('time', 'kind', 'message_id', 'data', 'detail')
+
+    def __init__(self, sent_time: float, kind: str, message_id: int, data: bytes, detail=None):
+        self.time = sent_time
+        self.kind = kind
+        self.message_id = message_id
+        self.data = data
+        self.detail = detail
+
+    def __repr__(self) -> str:
+        return f'InjectedFault({self.kind}, id={self.message_id}, time={self.time}, data={self.data.hex()}, detail={self.detail})'
+
+
+def _copy(message: can.Message, data=None) -> can.Message:
+    """ Copies a message, simulator messages are updated in place so held frames need their own"""
+    return can.Message(arbitration_id=message.arbitration_id, data=bytes(message.data) if data is None else data,
+                       is_extended_id=message.is_extended_id)
+
+
+class FaultInjector():
+    """ Injects faults into the frames sent on a bus, according to a seeded schedule
+
+    One fault at most is drawn for each frame, in the order the frames are sent, so the same
+    seed and the same sequence of frames always give the same faults. Frames held by a burst
+    are passed on untouched
+
+    Fields:
+        probabilities (dict): probability of each kind of fault, per frame
+        delay (float): time in seconds delayed frames are held for
+        burst_frames (int): number of frames held and released together by a burst
+        message_ids (set): ids of the frames that can be faulty, None for all
+        log (list(InjectedFault)): ground truth of every fault injected, in the order sent
+        frames (int): number of frames passed to the injector
+        counts (dict): number of log entries of each kind of fault, i.e. frames affected, and both
+                       copies of duplicated frames
+        send_errors (int): number of frames the bus failed to send
+
+    Methods:
+        send(self, bus: can.BusABC, message: can.Message)
+            Sends a frame through the injector
+        next_release(self) -> float
+            Returns the time.monotonic() the next delayed frame is due, None if there is none
+        release(self, bus: can.BusABC, now=None)
+            Sends the delayed frames that are due
+        flush(self, bus: can.BusABC)
+            Sends every held frame
+        write_log(self, path: str)
+            Writes the ground truth log to a csv file
+    """
+
+    def __init__(self, probabilities: dict, seed=None, delay=0.02, burst_frames=16, message_ids=None):
+        """
+        Args:
+            probabilities (dict): probability of each kind of fault per frame, keyed by kind,
+                                  missing kinds are never injected
+            seed (int): seed of the schedule, None for different faults on every run
+            delay (float): time in seconds delayed frames are held for
+            burst_frames (int): number of frames held and released together by a burst
+            message_ids (list(int)): ids of the frames that can be faulty, None for all
+        """
+        unknown = set(probabilities) - set(FAULT_KINDS)
+        if unknown:
+            raise ValueError(f'Error: {sorted(unknown)} are not kinds of fault, must be in {FAULT_KINDS}')
+        if any(probability < 0 for probability in probabilities.values()) or sum(probabilities.values()) > 1:
+            raise ValueError(f'Error: fault probabilities must be positive and add up to at most 1, not {probabilities}')
+        if burst_frames < 2:
+            raise ValueError(f'Error: a burst needs at least 2 frames, not {burst_frames}')
+        self.probabilities = dict(probabilities)
+        self.delay = delay
+        self.burst_frames = burst_frames
+        self.message_ids = None if message_ids is None else set(message_ids)
+        self.rng = random.Random(seed)
+        # Upper bound of the random draw that selects each kind of fault
+        self.thresholds = []
+        total = 0.0
+        for kind in FAULT_KINDS:
+            if self.probabilities.get(kind, 0) > 0:
+                total += self.probabilities[kind]
+                self.thresholds.append((total, kind))
+        self.fault_probability = total
+
+        self.log = []
+        self.frames = 0
+        self.counts = {kind: 0 for kind in FAULT_KINDS}
+        self.send_errors = 0
+        # (release time, sequence, message, held since) of delayed frames
+        self.delayed = []
+        self.sequence = 0
+        # (message, held since) of the frame waiting for the next one to be sent
+        self.held = None
+        # Frames of the current burst, and the time.monotonic() it started
+        self.burst = None
+        self.burst_start = None
+
+    def _draw(self, message_id: int):
+        if self.message_ids is not None and message_id not in self.message_ids:
+            return None
+        draw = self.rng.random()
+        if draw >= self.fault_probability:
+            return None
+        for threshold, kind in self.thresholds:
+            if draw < threshold:
+                return kind
+        return self.thresholds[-1][1]
+
+    def _transmit(self, bus: can.BusABC, message: can.Message) -> float:
+        sent_time = time.time()
+        try:
+            bus.send(message)
+        except can.CanError:
+            self.send_errors += 1
+        return sent_time
+
+    def _record(self, sent_time: float, kind: str, message: can.Message, detail=None) -> None:
+        self.counts[kind] += 1
+        self.log.append(InjectedFault(sent_time, kind, message.arbitration_id, bytes(message.data), detail))
+
+    def _release_held(self, bus: can.BusABC, kind: str, message: can.Message, since: float) -> None:
+        sent_time = self._transmit(bus, message)
+        self._record(sent_time, kind, message, time.monotonic() - since)
+
+    def send(self, bus: can.BusABC, message: can.Message) -> None:
+        """ Sends a frame, or injects a fault in its place
+
+        Args:
+            bus (can.BusABC): bus to send on
+            message (can.Message): frame to send, held frames are copied so it can be modified
+                                   once this returns
+        """
+        self.frames += 1
+        if self.burst is not None:
+            self.burst.append(_copy(message))
+            if len(self.burst) >= self.burst_frames:
+                burst, self.burst = self.burst, None
+                since = self.burst_start
+                for held in burst:
+                    self._release_held(bus, 'burst', held, since)
+            return
+
+        # A frame held for reordering goes after this one, whatever happens to this one
+        held, self.held = self.held, None
+        kind = self._draw(message.arbitration_id)
+        if kind is None:
+            self._transmit(bus, message)
+        elif kind == 'drop':
+            self._record(time.time(), kind, message)
+        elif kind == 'duplicate':
+            self._record(self._transmit(bus, message), kind, message, 1)
+            self._record(self._transmit(bus, message), kind, message, 2)
+        elif kind == 'dlc':
+            faulty = _copy(message, bytes(message.data[:self.rng.randrange(len(message.data))]))
+            self._record(self._transmit(bus, faulty), kind, faulty, len(message.data))
+        elif kind == 'payload':
+            data = bytearray(message.data)
+            index = self.rng.randrange(len(data))
+            data[index] ^= self.rng.randrange(1, 256)
+            faulty = _copy(message, data)
+            self._record(self._transmit(bus, faulty), kind, faulty, index)
+        elif kind == 'delay':
+            now = time.monotonic()
+            heapq.heappush(self.delayed, (now + self.delay, self.sequence, _copy(message), now))
+            self.sequence += 1
+        elif kind == 'reorder':
+            if held is None:
+                self.held = (_copy(message), time.monotonic())
+            else:
+                # Already holding a frame, which goes out after this one anyway
+                self._transmit(bus, message)
+        elif kind == 'burst':
+            self.burst = [_copy(message)]
+            self.burst_start = time.monotonic()
+        if held is not None:
+            self._release_held(bus, 'reorder', *held)
+
+    def next_release(self):
+        return self.delayed[0][0] if self.delayed else None
+
+    def release(self, bus: can.BusABC, now=None) -> None:
+        """ Sends the delayed frames that are due at now (time.monotonic()), defaults to the current time"""
+        now = time.monotonic() if now is None else now
+        delayed = self.delayed
+        while delayed and delayed[0][0] <= now:
+            _, _, message, since = heapq.heappop(delayed)
+            self._release_held(bus, 'delay', message, since)
+
+    def flush(self, bus: can.BusABC) -> None:
+        """ Sends every frame still held, e.g. at the end of a run, so the log is complete"""
+        while self.delayed:
+            _, _, message, since = heapq.heappop(self.delayed)
+            self._release_held(bus, 'delay', message, since)
+        if self.held is not None:
+            held, self.held = self.held, None
+            self._release_held(bus, 'reorder', *held)
+        if self.burst is not None:
+            burst, self.burst = self.burst, None
+            for message in burst:
+                self._release_held(bus, 'burst', message, self.burst_start)
+
+    def write_log(self, path: str) -> None:
+        """ Writes the ground truth log to a csv file, one row per faulty frame"""
+        with open(path, 'w', newline='') as log_file:
+            writer = csv.writer(log_file)
+            writer.writerow(['time', 'kind', 'message_id', 'data', 'detail'])
+            for fault in self.log:
+                writer.writerow([f'{fault.time:.6f}', fault.kind, fault.message_id, fault.data.hex(),
+                                 '' if fault.detail is None else fault.detail])
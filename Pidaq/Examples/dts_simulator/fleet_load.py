@@ -0,0 +1,162 @@
+""" fleet_load.py
+
+Simulates a fleet of DTS inverters on one channel, each on its own can offset, from a single
+process. The message rates of every inverter are scaled so that the fleet offers a chosen
+bus load, to find the point at which CanManager ingest and DTSTelemetry decode saturate as
+devices are added.
+
+Simply run using python3 fleet_load.py [channel] [devices] [bus load %] [duration]
+"""
+
+import sys
+
+from can_manager import can_manager
+from dts_manager.dts_manager import COMMAND_OFFSET, DEFAULT_CAN_OFFSET
+from dts_simulator import DEFAULT_RATES, MAX_RATE, DTSSimulator, run_scheduled
+
+# Bits on the wire of a standard 8 byte data frame, including typical bit stuffing and the
+# interframe space
+FRAME_BITS = 125
+# Highest standard (11 bit) id
+MAX_STANDARD_ID = 0x7FF
+# Offsets are spaced so the messages and command of each inverter do not collide with the
+# next inverter's
+DEFAULT_OFFSET_STRIDE = 48
+
+
+def bus_load(frame_rate: float, bitrate: int) -> float:
+    """ Returns the fraction of the bus used by frame_rate frames per second"""
+    return frame_rate * FRAME_BITS / bitrate
+
+
+def fleet_rates(devices: int, load=None, bitrate=500000) -> dict:
+    """ Returns the rates of each inverter's messages for a fleet offering a bus load
+
+    The default rates are scaled by the same factor, so the 10Hz and 100Hz messages keep
+    their proportions
+
+    Args:
+        devices (int): number of inverters in the fleet
+        load (float): fraction of the bus the fleet should use, None for the default rates
+        bitrate (int): bitrate of the channel in bits per second
+
+    Returns:
+        (dict) rate in Hz of each message, keyed by message id at the default can offset
+
+    Raises:
+        ValueError: if the load needs a message faster than MAX_RATE
+    """
+    if load is None:
+        return dict(DEFAULT_RATES)
+    if not 0 < load <= 1:
+        raise ValueError(f'Error: bus load must be between 0 and 1, not {load}')
+    device_rate = load * bitrate / FRAME_BITS / devices
+    scale = device_rate / sum(DEFAULT_RATES.values())
+    rates = {message_id: rate * scale for message_id, rate in DEFAULT_RATES.items()}
+    if max(rates.values()) > MAX_RATE:
+        raise ValueError(f'Error: a {load:.0%} load with {devices} devices needs messages faster than '
+                         f'{MAX_RATE}Hz, add devices or lower the load')
+    return rates
+
+
+class FleetSimulator():
+    """ Several DTSSimulators on different can offsets, sending on one shared bus
+
+    The simulators run headless, without waiting for commands, and every message of the fleet
+    is scheduled from one heap (see dts_simulator.run_scheduled), so the fleet runs in a single
+    thread
+
+        fleet = FleetSimulator('vcan0', 8, bus_load=0.6)
+        print(fleet.run(60))
+
+    Fields:
+        can_bus (can_manager.CanManager): bus shared by the simulators
+        bitrate (int): bitrate of the channel in bits per second
+        offsets (list(int)): can offset of each simulated inverter
+        simulators (list(DTSSimulator))
+
+    Methods:
+        offered_load(self) -> float
+            Returns the fraction of the bus the fleet's message rates use
+        run(self, duration: float) -> dict
+            Runs the fleet for the duration, returns its counters
+    """
+
+    def __init__(self, bus_name: str, devices: int, interface='socketcan', bus_load=None, bitrate=500000,
+                 first_offset=DEFAULT_CAN_OFFSET, offset_stride=DEFAULT_OFFSET_STRIDE, seed=None):
+        """
+        Args:
+            bus_name (str): channel to simulate the fleet on
+            devices (int): number of inverters
+            interface (str): python-can interface of the channel
+            bus_load (float): fraction of the bus the fleet should use, None for the default rates
+            bitrate (int): bitrate of the channel in bits per second, used to scale the rates
+            first_offset (int): can offset of the first inverter
+            offset_stride (int): difference between the can offsets of consecutive inverters
+            seed (int): seed of the noise, each inverter gets a different seed derived from it
+        """
+        if devices < 1:
+            raise ValueError(f'Error: a fleet needs at least one device, not {devices}')
+        if offset_stride <= max(DEFAULT_RATES) - DEFAULT_CAN_OFFSET:
+            raise ValueError(f'Error: offset stride {offset_stride} would overlap the messages of consecutive inverters')
+        self.offsets = [first_offset + device * offset_stride for device in range(devices)]
+        ids = {offset + index for offset in self.offsets
+               for index in [*range(len(DEFAULT_RATES)), COMMAND_OFFSET]}
+        if len(ids) < devices * (len(DEFAULT_RATES) + 1):
+            raise ValueError(f'Error: offset stride {offset_stride} makes the command ids collide with messages')
+        if max(ids) > MAX_STANDARD_ID:
+            raise ValueError(f'Error: {devices} devices from offset {first_offset} with stride {offset_stride} '
+                             f'do not fit in standard ids')
+
+        self.bitrate = bitrate
+        self.can_bus = can_manager.CanManager(bus_name, 1 / MAX_RATE, interface=interface)
+        rates = fleet_rates(devices, bus_load, bitrate)
+        self.simulators = [
+            DTSSimulator(bus_name, interface, {message_id - DEFAULT_CAN_OFFSET + offset: rate
+                                               for message_id, rate in rates.items()},
+                         command_timeout=None, seed=None if seed is None else seed + device,
+                         can_offset=offset, can_bus=self.can_bus)
+            for device, offset in enumerate(self.offsets)
+        ]
+
+    def offered_load(self) -> float:
+        return bus_load(sum(sum(sim.rates.values()) for sim in self.simulators), self.bitrate)
+
+    def run(self, duration: float) -> dict:
+        """ Sends the fleet's messages for the duration
+
+        Returns:
+            (dict) elapsed time, total messages sent, the resulting frame rate and bus load, late
+            sends, and the counters of each simulator keyed by can offset
+        """
+        run_scheduled(self.simulators, duration, headless=True)
+        elapsed = self.simulators[0].elapsed
+        sent = sum(sum(sim.sent_counts.values()) for sim in self.simulators)
+        frame_rate = sent / elapsed if elapsed else 0.0
+        return {
+            'elapsed': elapsed,
+            'sent': sent,
+            'frame_rate': frame_rate,
+            'offered_load': self.offered_load(),
+            'achieved_load': bus_load(frame_rate, self.bitrate),
+            'late_sends': sum(sim.late_sends for sim in self.simulators),
+            'send_errors': sum(sim.send_errors for sim in self.simulators),
+            'devices': {sim.can_offset: sim.counters() for sim in self.simulators},
+        }
+
+    def shutdown(self) -> None:
+        self.can_bus.bus.shutdown()
+
+
+if __name__ == "__main__":
+    channel = sys.argv[1] if len(sys.argv) > 1 else 'vcan0'
+    devices = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+    load = float(sys.argv[3]) / 100 if len(sys.argv) > 3 else None
+    duration = float(sys.argv[4]) if len(sys.argv) > 4 else 10.0
+
+    fleet = FleetSimulator(channel, devices, bus_load=load)
+    print(f'{devices} inverters on offsets {fleet.offsets}, offering {fleet.offered_load():.0%} of the bus')
+    counters = fleet.run(duration)
+    fleet.shutdown()
+    print(f'sent {counters["sent"]} messages in {counters["elapsed"]:.1f}s, {counters["frame_rate"]:.0f} frames/s '
+          f'({counters["achieved_load"]:.0%} of the bus), {counters["late_sends"]} late sends')
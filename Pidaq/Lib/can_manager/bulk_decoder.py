@@ -0,0 +1,118 @@
+"""Contains functions to decode whole can captures into columnar arrays
+
+Rather than decoding frame by frame, every frame of a capture is viewed as a numpy
+structured array, frames are grouped by arbitration id, and each signal defined in the
+message configuration is converted for all of its frames at once. Reprocessing a full
+test run takes milliseconds instead of minutes.
+
+Functions:
+    load_records
+    decode_capture
+    to_dataframe
+"""
+import numpy as np
+import pandas as pd
+
+import can
+
+from can_manager import recorder
+
+# Layout of a capture record, see can_manager.recorder
+RECORD_DTYPE = np.dtype({
+    'names': ['timestamp', 'arbitration_id', 'dlc', 'flags', 'data'],
+    'formats': ['<f8', '<u4', 'u1', 'u1', 'V8'],
+    'offsets': [0, 8, 12, 13, 16],
+    'itemsize': recorder.RECORD.size,
+})
+
+# numpy equivalents of the struct types supported by MessageDecoder
+NUMPY_TYPES = {'b': 'i1', 'B': 'u1', 'h': '<i2', 'H': '<u2', 'i': '<i4', 'I': '<u4', 'q': '<i8', 'Q': '<u8'}
+
+
+def load_records(capture) -> np.ndarray:
+    """Returns the frames of a capture as a structured array with RECORD_DTYPE
+
+    Args:
+        capture: a recorder.CaptureReader, the path of a .pdqcap capture, or the path of any
+                 log that python-can can read (e.g. a candump .log file). The records of a
+                 CaptureReader are not copied, so the array must be released before the
+                 reader is closed
+    """
+    if isinstance(capture, recorder.CaptureReader):
+        return np.frombuffer(capture.records, dtype=RECORD_DTYPE)
+    if capture.endswith('.pdqcap'):
+        with recorder.CaptureReader(capture) as reader:
+            return np.frombuffer(reader.records, dtype=RECORD_DTYPE).copy()
+    # Pack other log formats into capture records first
+    messages = list(can.LogReader(capture))
+    buffer = bytearray(recorder.RECORD.size * len(messages))
+    for position, message in enumerate(messages):
+        flags = recorder.FLAG_EXTENDED if message.is_extended_id else 0
+        if message.is_error_frame:
+            flags |= recorder.FLAG_ERROR
+        recorder.RECORD.pack_into(buffer, position * recorder.RECORD.size, message.timestamp,
+                                  message.arbitration_id, message.dlc, flags, message.data)
+    return np.frombuffer(buffer, dtype=RECORD_DTYPE)
+
+
+def payload_dtype(decoder) -> np.dtype:
+    """Returns a structured dtype viewing the 8 data bytes of a record as the fields of a decoder"""
+    return np.dtype({
+        'names': [f'field_{index}' for index in range(len(decoder.fields))],
+        'formats': [NUMPY_TYPES[signal_type] for _, signal_type in decoder.fields],
+        'offsets': [start for start, _ in decoder.fields],
+        'itemsize': 8,
+    })
+
+
+def decode_capture(capture, messages: dict) -> dict:
+    """Decodes every configured signal of a capture
+
+    Frames shorter than their decoder's layout and error frames are skipped, in the same
+    way as the per frame decoders
+
+    Args:
+        capture: a recorder.CaptureReader, or the path of a capture, see load_records
+        messages (dict): SensorReading objects keyed by message id, e.g. CanManager.messages
+                         or the result of can_manager.load_message_config
+
+    Returns:
+        (dict) for each decoded message id, a dict of numpy columns holding the 'timestamp'
+               of each frame and the value of each signal
+    """
+    records = load_records(capture)
+    valid = (records['flags'] & recorder.FLAG_ERROR) == 0
+    ids = records['arbitration_id']
+    decoded = {}
+    for message_id, reading in messages.items():
+        decoder = reading.decoder
+        if decoder is None or decoder.size > 8:
+            continue
+        frames = records[(ids == message_id) & valid & (records['dlc'] >= decoder.size)]
+        fields = frames['data'].view(payload_dtype(decoder))
+        columns = {'timestamp': frames['timestamp']}
+        for name, index, divisor in zip(decoder.names, decoder.scaled_indices, decoder.divisors):
+            columns[name] = fields[f'field_{index}'].astype(np.float64) / divisor
+        for name, (index, bit) in zip(decoder.names[len(decoder.divisors):], decoder.bits):
+            columns[name] = (fields[f'field_{index}'] >> bit & 1).astype(bool)
+        decoded[message_id] = columns
+    return decoded
+
+
+def to_dataframe(decoded: dict, fill=True) -> pd.DataFrame:
+    """Combines decoded columns into a single DataFrame indexed by timestamp
+
+    Args:
+        decoded (dict): result of decode_capture
+        fill (bool): forward fill each signal, so every row holds the latest value of every
+                     signal at that time, as DTSTelemetry would. Otherwise signals are NaN
+                     at the timestamps of other messages
+
+    Returns:
+        (pandas.DataFrame)
+    """
+    frames = [pd.DataFrame(columns).set_index('timestamp') for columns in decoded.values()]
+    if not frames:
+        return pd.DataFrame()
+    data = pd.concat(frames, sort=False).sort_index(kind='mergesort')
+    return data.ffill() if fill else data
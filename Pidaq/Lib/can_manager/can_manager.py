@@ -3,15 +3,30 @@
 Classes:
     CanManager
     SensorReading
+    SampleHistory
+    ReadingListener
 
 Functions:
-    parse_conversion_factor
+    load_message_config
 """
+import asyncio
 import json
 import os
+import selectors
+import socket
+import time
+from array import array
 
 import can
 
+from can_manager.decoder import compile_decoder
+from can_manager.statistics import MessageStatistics, interface_statistics, socket_statistics
+
+# Mask used for kernel filters, matches the full (extended) arbitration id
+CAN_ID_MASK = 0x1FFFFFFF
+# Interval between polls of buses which have no file descriptor to wait on (e.g. virtual buses)
+POLL_INTERVAL = 0.0005
+
 
 class CanManager:
     """Manages the can bus, and sets the SensorReading objects for the test being run
@@ -20,80 +35,598 @@ class CanManager:
     the sensor board, as well as the configured sensor readings for the particular project
     that is being tested
 
+    A CanManager can own several channels (e.g. the inverter on can0 and the sensor nodes
+    on can1), which are all read by a single loop waiting on every socket at once. Readings
+    are configured per channel, and received messages are routed by (channel, id). Methods
+    taking a channel default to the first (primary) channel
+
+    The readings of several projects (e.g. dts and windtunnel) can be loaded side by side.
+    Each project can register a handler, and dispatch_batch calls the handler of the project
+    owning each updated id, so a single ingest loop can serve all of them
+
     Attributes:
-        bus (can.interfaces.socketcan.SocketcanBus)
+        interface (str): python-can interface of the buses
+        channel (str): primary channel
+        bus (can.interfaces.socketcan.SocketcanBus): bus of the primary channel
+        buses (dict): bus of each channel, keyed by channel
         messages (dict): dict of all the messages to be expected from the
-                         sensor board. Keys are message ids, and values are
-                         SensorReading objects
+                         sensor board on the primary channel. Keys are message ids,
+                         and values are SensorReading objects
+        channel_messages (dict): messages of each channel, keyed by channel then message id
+        unknown_id_counts (dict): number of messages received for each (channel, id) that
+                                  is not configured
+        error_frame_counts (dict): number of error frames received on each channel
+        projects (dict): ids of the readings of each loaded project, keyed by channel then project
+        handlers (dict): handler of each project, keyed by (channel, project)
+        dispatch_table (dict): handler of each configured message, keyed by (channel, id)
 
     Methods:
         read_message_config(project: str)
             Reads the configuration of sensor readings from messageconfig.json
+        register_handler(project: str, handler: callable)
+            Registers the function called with the id of each updated message of a project
+        apply_filters(passthrough_ids: list)
+            Installs kernel filters so only configured messages are received
         send_message(id: int, data: list)
+        send_can_message(message: can.Message)
+            Sends a message built by the caller, e.g. with a standard (11 bit) id
+        open_bus(channel: str) -> can.BusABC
+            Opens an additional bus on a channel, e.g. for time critical messages
         read_bus
-            Reads the bus for a message
-        assign_message_data(bus_message: can.Message)
+            Reads the next message from any channel
+        read_batch(max_frames: int, timeout_seconds: float)
+            Drains all pending messages from every channel
+        channel_of(bus_message: can.Message) -> str
+            Returns the channel a message is routed to
+        assign_message_data(bus_message: can.Message) -> str
             assigns data to the correct SensorReading object
+        assign_batch(bus_messages: list)
+            assigns the latest data of each message id in a batch
+        dispatch_batch(bus_messages: list) -> int
+            assigns a batch and calls the project handler of each updated message
+        start_receiver(listeners: list, loop: asyncio.AbstractEventLoop)
+            Starts a background receiver which receives and assigns all messages
+        stop_receiver
+            Stops the background receiver
+        update_periodic_message(message: can.Message)
+            Sends a message periodically, modifying the data of the running task for its id
+        stop_periodic_message(id: int)
+            Stops the periodic message with the given id
+        stop_periodic_messages
+            Stops all periodic messages that are being sent
+        stats(channel: str) -> dict
+            Returns receive statistics of each message id and of the bus of a channel
+        reset_stats
+
+    Coroutines:
+        frames
+            Asynchronously iterates over all received messages
+        send(id: int, data: list)
+            Sends a message without blocking the event loop
     """
 
-    def __init__(self, bus_name: str, message_frequency: float) -> None:
-        self.bus = can.interfaces.socketcan.SocketcanBus(channel=bus_name)
-        self.messages = {}
+    def __init__(self, bus_name, message_frequency: float, interface='socketcan') -> None:
+        """
+        Args:
+            bus_name (str or list(str)): channel of the bus, e.g. vcan0, or a list of channels,
+                                         the first of which is the primary channel
+            message_frequency (float): period in seconds of periodically sent messages
+            interface (str): python-can interface of the bus, defaults to socketcan. Other
+                             interfaces (e.g. virtual) can be used for benchmarking and replay
+        """
+        channels = [bus_name] if isinstance(bus_name, str) else list(bus_name)
+        if not channels:
+            raise ValueError('Error: at least one channel is required')
+        if len(set(channels)) != len(channels):
+            raise ValueError(f'Error: channels {channels} contain duplicates')
+        self.interface = interface
+        self.buses = {}
+        for channel in channels:
+            self.buses[channel] = self._open_bus(channel)
+        self.channel = channels[0]
+        self.bus = self.buses[self.channel]
+        self.channel_messages = {channel: {} for channel in channels}
+        self.messages = self.channel_messages[self.channel]
         self.message_frequency = message_frequency
+        self.notifier = None
+        self.async_reader = None
+        self.periodic_tasks = {}
+        self.passthrough_ids = {channel: set() for channel in channels}
+        self.unknown_id_counts = {}
+        self.error_frame_counts = {channel: 0 for channel in channels}
+        self.projects = {channel: {} for channel in channels}
+        self.handlers = {}
+        self.dispatch_table = {}
+        self._selector = self._register_buses()
+        self._poll_order = channels
+
+    def _register_buses(self):
+        """Registers the socket of every bus with a selector, so all channels can be waited on at once
+
+        Returns:
+            (selectors.BaseSelector) the selector, or None if a bus has no file descriptor, in
+                                     which case the buses are polled instead
+        """
+        if len(self.buses) == 1:
+            return None
+        selector = selectors.DefaultSelector()
+        try:
+            for channel, bus in self.buses.items():
+                selector.register(bus.fileno(), selectors.EVENT_READ, channel)
+        except (NotImplementedError, ValueError, OSError):
+            selector.close()
+            return None
+        return selector
+
+    def _open_bus(self, channel: str) -> can.BusABC:
+        if self.interface == 'socketcan':
+            return can.interfaces.socketcan.SocketcanBus(channel=channel)
+        return can.interface.Bus(channel=channel, interface=self.interface)
+
+    def open_bus(self, channel=None, receive=True) -> can.BusABC:
+        """Opens an additional bus (socket) on a channel, owned by the caller
+
+        Messages sent on it do not wait behind anything else sent by this CanManager, e.g. for
+        an emergency stop. The bus is not read or filtered by the CanManager, and must be shut
+        down by the caller
+
+        A bus that is only sent on should not receive, as nothing drains its receive queue.
+        With socketcan an empty filter is installed, so the kernel does not queue any message
+        for the socket
+
+        Parameters:
+            channel (str): channel to open, defaults to the primary channel
+            receive (bool): whether the bus receives messages, False for a send only bus
+
+        Raises:
+            ValueError: if a send only bus is requested on an interface other than socketcan
+        """
+        if not receive and self.interface != 'socketcan':
+            raise ValueError(f'Error: send only buses can only be opened with socketcan, not {self.interface}')
+        bus = self._open_bus(self._channel(channel))
+        if not receive:
+            bus.socket.setsockopt(socket.SOL_CAN_RAW, socket.CAN_RAW_FILTER, b'')
+        return bus
+
+    def _channel(self, channel) -> str:
+        if channel is None:
+            return self.channel
+        if channel not in self.buses:
+            raise ValueError(f'Error: {channel} is not a channel of this CanManager')
+        return channel
 
-    def read_message_config(self, project: str, config_file: str, path=None) -> None:
+    def read_message_config(self, project: str, config_file: str, path=None, history_length=256,
+                            filter_messages=True, passthrough_ids=None, channel=None, id_offset=0,
+                            name=None, statistics=True) -> None:
         """Reads sensor readings configuration from messageconfig.json
 
         Constructs SensorReading objects for all expected sensor readings,
-        and appends them to a list
+        and appends them to a list. Readings that define their signals get
+        a decoder compiled for them. Unless disabled, kernel filters are then
+        installed so that only the configured messages are received
+
+        Several projects can be read onto the same channel, as long as their message ids do
+        not collide. Reading a project again replaces its previous readings. The same project
+        can be read several times under different names with different id offsets, e.g. for
+        several inverters on one channel
 
         Parameters:
-            project (str): current project, must be one of dts, suspension, or windtunnel
+            project (str): project to add, must be one of dts, suspension, or windtunnel
             config_file (str): message configuration file name
             path (str): path to folder containing configuration file, if no path specified, current working
                         directory is assumed
+            history_length (int): number of samples kept in the history of each SensorReading, 0 for
+                                  no history
+            filter_messages (bool): whether to install kernel filters for the configured messages
+            passthrough_ids (list(int)): ids of additional messages to let through the filters,
+                                         e.g. control messages such as 192
+            channel (str): channel the readings are received on, defaults to the primary channel
+            id_offset (int): added to every message id of the configuration
+            name (str): name the readings are registered under (SensorReading.project), defaults
+                        to the project
+            statistics (bool): whether to keep receive statistics of each SensorReading, reported
+                               by stats
+
+        Raises:
+            ValueError: if an id of the project is already used by another project on the channel
+        """
+        channel = self._channel(channel)
+        readings = load_message_config(project, config_file, path, history_length, id_offset, name, statistics)
+        project = (project if name is None else name).lower()
+        messages = self.channel_messages[channel]
+        for message_id in readings:
+            owner = messages.get(message_id)
+            # Placeholder readings without an integer id are never received, so can not collide
+            if isinstance(message_id, int) and owner is not None and owner.project != project:
+                raise ValueError(f'Error: ID: {message_id} of {project} is already in use by '
+                                 f'{owner.project} on {channel}')
+        for message_id in self.projects[channel].get(project, ()):
+            messages.pop(message_id, None)
+        messages.update(readings)
+        self.projects[channel][project] = tuple(readings)
+        self._build_dispatch_table()
+        if filter_messages:
+            self.apply_filters(passthrough_ids, channel)
+
+    def register_handler(self, project: str, handler, channel=None) -> None:
+        """Registers the handler of a project, which is called by dispatch_batch
+
+        Parameters:
+            project (str): project whose messages are handled
+            handler (callable): called with the message id of every updated message of the
+                                project, e.g. DTSTelemetry.decode_message. None removes the handler
+            channel (str): channel the project is read on, defaults to the primary channel
+        """
+        key = (self._channel(channel), project.lower())
+        if handler is None:
+            self.handlers.pop(key, None)
+        else:
+            self.handlers[key] = handler
+        self._build_dispatch_table()
+
+    def _build_dispatch_table(self) -> None:
+        self.dispatch_table = {
+            (channel, message_id): self.handlers[(channel, project)]
+            for channel, projects in self.projects.items()
+            for project, message_ids in projects.items() if (channel, project) in self.handlers
+            for message_id in message_ids
+        }
+
+    def apply_filters(self, passthrough_ids=None, channel=None) -> None:
+        """Installs kernel filters so that only configured messages are received
+
+        With socketcan the filters are applied by the kernel, so messages with any other
+        id never reach python. Interfaces without kernel filtering fall back to python-can's
+        software filtering. Passthrough ids are kept for subsequent calls
+
+        Parameters:
+            passthrough_ids (list(int)): ids of additional messages to receive, which are
+                                         not assigned to a SensorReading
+            channel (str): channel to filter, defaults to the primary channel
+        """
+        channel = self._channel(channel)
+        self.passthrough_ids[channel].update(passthrough_ids or [])
+        ids = {message_id for message_id in self.channel_messages[channel] if isinstance(message_id, int)}
+        ids.update(self.passthrough_ids[channel])
+        self.buses[channel].set_filters(
+            [{'can_id': message_id, 'can_mask': CAN_ID_MASK} for message_id in sorted(ids)])
+
+    def send_message(self, id: int, data: list, channel=None) -> None:
+        self.send_can_message(can.Message(arbitration_id=id, data=data), channel)
+
+    def send_can_message(self, message: can.Message, channel=None) -> None:
+        channel = self._channel(channel)
+        if message.arbitration_id in self.channel_messages[channel].keys():
+            raise Exception(f'Error: ID: {message.arbitration_id} is already in use')
+        self.buses[channel].send(message)
+
+    def send_message_periodic(self, message: can.Message, duration: float, channel=None):
+        channel = self._channel(channel)
+        if message.arbitration_id in self.channel_messages[channel].keys():
+            raise Exception(f'Error: ID: {message.arbitration_id} is already in use')
+        task = self.buses[channel].send_periodic(message, self.message_frequency, duration=duration)
+        self.periodic_tasks[(channel, message.arbitration_id)] = task
+        return task
+
+    def update_periodic_message(self, message: can.Message, channel=None):
+        """Sends a message periodically, reusing the running periodic task for its id
+
+        If a periodic task is already sending messages with the same id, its data is
+        modified in place (with socketcan, the kernel broadcast manager job is updated
+        without restarting its timer), so the new data goes out on the very next period
+        without a gap in the message stream. Otherwise a new task is started, which runs
+        until it is stopped
+
+        Parameters:
+            message (can.Message): message with the new data
+            channel (str): channel to send on, defaults to the primary channel
+
+        Returns:
+            the periodic task sending the message
+        """
+        channel = self._channel(channel)
+        task = self.periodic_tasks.get((channel, message.arbitration_id))
+        if isinstance(task, can.ModifiableCyclicTaskABC):
+            task.modify_data(message)
+            return task
+        return self.send_message_periodic(message, None, channel)
+
+    def stop_periodic_message(self, id: int, channel=None) -> None:
+        """Stops the periodic message with the given id, if one is being sent"""
+        task = self.periodic_tasks.pop((self._channel(channel), id), None)
+        if task is not None:
+            task.stop()
+
+    def stop_periodic_messages(self) -> None:
+        """Stops every periodic message started with send_message_periodic"""
+        for task in self.periodic_tasks.values():
+            task.stop()
+        self.periodic_tasks.clear()
+
+    async def send(self, id: int, data: list, timeout_seconds=1.0, channel=None) -> None:
+        """Sends a message from within an event loop
+
+        The message is sent without blocking, if the transmit buffer is full the
+        coroutine yields to the event loop and retries until timeout_seconds elapse
+
+        Parameters:
+            id (int): arbitration id of the message
+            data (list): message payload
+            timeout_seconds (float): time to keep retrying while the transmit buffer is full
+            channel (str): channel to send on, defaults to the primary channel
         """
-        if project.lower() not in ["dts", "suspension", "windtunnel"]:
-            raise ValueError(f'Error: {project} is not a valid project')
-        file_path = os.getcwd() if path is None else path
-        with open(os.path.join(file_path, config_file), 'r+') as config:
-            config_dict = json.load(config)
-            for reading in config_dict[project.lower()]['readings']:
-                message_id = reading['message_id']
-                self.messages[message_id] = SensorReading(
-                    reading['message_id'],
-                    reading['reading'],
-                    reading['conversion_factor'] if reading['conversion_factor'] else None,
-                )
-
-    def send_message(self, id: int, data: list) -> None:
-        if id in self.messages.keys():
+        channel = self._channel(channel)
+        if id in self.channel_messages[channel].keys():
             raise Exception(f'Error: ID: {id} is already in use')
         message = can.Message(arbitration_id=id, data=data)
-        self.bus.send(message)
+        bus = self.buses[channel]
+        loop = asyncio.get_event_loop()
+        deadline = loop.time() + timeout_seconds
+        while True:
+            try:
+                bus.send(message, timeout=0)
+                return
+            except can.CanError:
+                if loop.time() >= deadline:
+                    raise
+                await asyncio.sleep(0.001)
 
-    def send_message_periodic(self, message: can.Message, duration: float):
-        if message.arbitration_id in self.messages.keys():
-            raise Exception(f'Error: ID: {id} is already in use')
-        return self.bus.send_periodic(message, self.message_frequency, duration=duration)
+    async def frames(self):
+        """Asynchronously iterates over every message received on any channel
+
+        Starts the receiver on the running event loop if it is not already running.
+        Each message is assigned to its SensorReading object before it is yielded
+
+            async for frame in bus.frames():
+                ...
+        """
+        if self.async_reader is None:
+            self.start_receiver(loop=asyncio.get_event_loop())
+        reader = self.async_reader
+        while True:
+            yield await reader.get_message()
 
     def read_bus(self, timeout_seconds=None) -> can.Message:
+        if len(self.buses) == 1:
+            return self.bus.recv(timeout_seconds)
+        batch = self.read_batch(1, timeout_seconds)
+        return batch[0] if batch else None
+
+    def read_batch(self, max_frames=256, timeout_seconds=None) -> list:
+        """Reads every message that is pending on the bus
+
+        Blocks for up to timeout_seconds for the first message, then drains the
+        messages already queued in the socket without waiting, so a burst of
+        frames is handled in a single call
+
+        With several channels, a single wait covers the sockets of every channel, and each
+        channel with pending messages is then drained in turn. The channel attribute of
+        each message is set to the channel it was received on
+
+        Parameters:
+            max_frames (int): maximum number of messages to return, None for no limit
+            timeout_seconds (float): time to wait for the first message, None to block
+
+        Returns:
+            (list(can.Message)) received messages in arrival order on each channel,
+                                empty on timeout
+        """
+        if len(self.buses) > 1:
+            return self._read_channels(max_frames, timeout_seconds)
         message = self.bus.recv(timeout_seconds)
-        return message
+        if message is None:
+            return []
+        batch = [message]
+        recv = self.bus.recv
+        while max_frames is None or len(batch) < max_frames:
+            message = recv(0)
+            if message is None:
+                break
+            batch.append(message)
+        return batch
+
+    def _read_channels(self, max_frames, timeout_seconds) -> list:
+        ready = self._wait_channels(timeout_seconds)
+        if not ready:
+            return []
+        batch = []
+        # Share the batch between the ready channels, so a busy channel can not starve the others
+        quota = None if max_frames is None else -(-max_frames // len(ready))
+        for channel, message in ready:
+            recv = self.buses[channel].recv
+            limit = None if quota is None else min(len(batch) + quota, max_frames)
+            if message is None:
+                message = recv(0)
+            while message is not None:
+                message.channel = channel
+                batch.append(message)
+                if limit is not None and len(batch) >= limit:
+                    break
+                message = recv(0)
+        return batch
+
+    def _wait_channels(self, timeout_seconds) -> list:
+        """Waits for up to timeout_seconds until messages are pending on any channel
+
+        Returns:
+            (list(tuple)) (channel, message) for each channel with pending messages. message is
+                          None if the socket is ready to read, or the first message of the
+                          channel if the buses had to be polled
+        """
+        if self._selector is not None:
+            return [(key.data, None) for key, _ in self._selector.select(timeout_seconds)]
+        deadline = None if timeout_seconds is None else time.perf_counter() + timeout_seconds
+        while True:
+            for position, channel in enumerate(self._poll_order):
+                message = self.buses[channel].recv(0)
+                if message is not None:
+                    # Poll the other channels first next time
+                    self._poll_order = self._poll_order[position + 1:] + self._poll_order[:position + 1]
+                    return [(channel, message)]
+            if deadline is not None and time.perf_counter() >= deadline:
+                return []
+            time.sleep(POLL_INTERVAL)
+
+    def channel_of(self, bus_message: can.Message) -> str:
+        """Returns the channel a message is routed to
+
+        Messages without a known channel (e.g. from a log file) are routed to the primary channel
+        """
+        channel = bus_message.channel
+        return channel if channel in self.channel_messages else self.channel
+
+    def assign_batch(self, bus_messages: list, channel=None) -> list:
+        """Assigns the latest data of each message id in a batch
+
+        Only the most recent message of each arbitration_id is assigned, older
+        messages of the same id in the batch are superseded
+
+        Parameters:
+            bus_messages (list(can.Message)): messages in arrival order
+            channel (str): channel whose updated ids are returned, defaults to the primary channel.
+                           Messages of every channel are assigned
+
+        Returns:
+            (list(int)) ids of the SensorReading objects of the channel that were updated
+        """
+        channel = self._channel(channel)
+        single_channel = len(self.buses) == 1
+        assign_message_data = self.assign_message_data
+        updated = {}
+        for message in bus_messages:
+            if assign_message_data(message) == channel or single_channel:
+                updated[message.arbitration_id] = None
+        messages = self.channel_messages[channel]
+        return [message_id for message_id in updated if message_id in messages]
+
+    def dispatch_batch(self, bus_messages: list) -> int:
+        """Assigns a batch of messages from any channel, and calls the handler of each updated message
+
+        As in assign_batch, each (channel, id) is handled once per batch, after the latest
+        message has been assigned. Messages of projects without a handler are only assigned
+
+        Parameters:
+            bus_messages (list(can.Message)): messages in arrival order
+
+        Returns:
+            (int) number of handler calls
+        """
+        assign_message_data = self.assign_message_data
+        updated = {}
+        for message in bus_messages:
+            updated[(assign_message_data(message), message.arbitration_id)] = None
+        dispatch_table = self.dispatch_table
+        handled = 0
+        for key in updated:
+            handler = dispatch_table.get(key)
+            if handler is not None:
+                handler(key[1])
+                handled += 1
+        return handled
 
     def assign_message_data(self, bus_message: can.Message) -> None:
         """Assigns message data to the correct SensorReading object
 
         Assigns message data to the correct SensorReading object
-        based on the arbitration_id of the message, checks to ensure
-        that arbitration_id is in list of ids for the test
+        based on the channel and arbitration_id of the message, checks to ensure
+        that arbitration_id is in list of ids for the test. Called for every received
+        message, so channel_of is inlined
 
         Parameters:
             bus_message(can.Message)
+
+        Returns:
+            (str) channel the message was routed to
         """
+        channel = bus_message.channel
+        messages = self.channel_messages.get(channel)
+        if messages is None:
+            channel = self.channel
+            messages = self.channel_messages[channel]
         message_id = bus_message.arbitration_id
-        if message_id in self.messages.keys():
-            self.messages[message_id].data = bus_message.data
+        reading = messages.get(message_id)
+        if reading is not None:
+            reading.count += 1
+            reading.timestamp = bus_message.timestamp
+            if reading.statistics is not None:
+                reading.statistics.record(bus_message.timestamp)
+            if reading.history is not None:
+                reading.history.append(bus_message.timestamp, bus_message.data)
+            reading.data = bus_message.data
+        elif bus_message.is_error_frame:
+            self.error_frame_counts[channel] += 1
+        else:
+            key = (channel, message_id)
+            self.unknown_id_counts[key] = self.unknown_id_counts.get(key, 0) + 1
+        return channel
+
+    def stats(self, channel=None) -> dict:
+        """Returns receive statistics of each message id and of the bus of a channel
+
+        For each configured message id that keeps statistics: number of messages received, effective rate (Hz),
+        minimum, mean, maximum and 99th percentile of the time between messages, and the
+        time since the latest message. For the bus: counts of messages with unknown ids and
+        of error frames, the receive counters of the network interface, which include
+        messages dropped by the driver, and the drop counter of the socket, which counts
+        messages dropped because they were not read before the receive buffer filled up
+
+        Note: error frames are only received if an error mask is set on the socket
+
+        Parameters:
+            channel (str): channel to report, defaults to the primary channel
+        """
+        channel = self._channel(channel)
+        now = time.time()
+        return {
+            'messages': {message_id: reading.statistics.summary(now)
+                         for message_id, reading in self.channel_messages[channel].items()
+                         if reading.statistics is not None},
+            'unknown_ids': {message_id: count for (unknown_channel, message_id), count
+                            in self.unknown_id_counts.items() if unknown_channel == channel},
+            'error_frames': self.error_frame_counts[channel],
+            'interface': interface_statistics(channel),
+            'socket': socket_statistics(self.buses[channel]),
+        }
+
+    def reset_stats(self) -> None:
+        """Resets the receive statistics of every channel"""
+        for messages in self.channel_messages.values():
+            for reading in messages.values():
+                if reading.statistics is not None:
+                    reading.statistics.reset()
+        self.unknown_id_counts.clear()
+        for channel in self.error_frame_counts:
+            self.error_frame_counts[channel] = 0
+
+    def start_receiver(self, listeners=None, loop=None) -> None:
+        """Starts a background receiver which receives every message on every channel
+
+        Uses a python-can Notifier, so messages are read from the bus as soon as they
+        arrive and assigned to their SensorReading objects, independent of the caller's
+        loop. The latest data and history of each reading can then be read at any time
+
+        If an event loop is given, the socket is read by the event loop itself instead of
+        a thread, and received messages are also buffered for the frames coroutine
+
+        Parameters:
+            listeners (list(can.Listener)): additional listeners to be notified of every message
+            loop (asyncio.AbstractEventLoop): event loop to receive messages in
+        """
+        if self.notifier is not None:
+            raise Exception('Error: receiver is already running')
+        listeners = [ReadingListener(self)] + list(listeners or [])
+        if loop is not None:
+            self.async_reader = can.AsyncBufferedReader()
+            listeners.append(self.async_reader)
+        buses = self.bus if len(self.buses) == 1 else list(self.buses.values())
+        self.notifier = can.Notifier(buses, listeners, timeout=0.1, loop=loop)
+
+    def stop_receiver(self, timeout=5) -> None:
+        """Stops the background receiver, if running"""
+        if self.notifier is not None:
+            self.notifier.stop(timeout)
+            self.notifier = None
+            self.async_reader = None
 
 
 class SensorReading:
@@ -107,17 +640,164 @@ class SensorReading:
         reading (str): contains the name of the measurement
         conversion_factor: contains the conversion factor for the reading,
                             or a dict of factors if there are multiple
+        project (str): project the reading belongs to
+        decoder (can_manager.decoder.MessageDecoder): compiled decoder for the signals of the
+                                                      reading, None if no signals are configured
+        history (SampleHistory): timestamped payloads of the most recently received messages, None
+                                 if the history length is 0
+        count (int): number of messages received
+        timestamp (float): timestamp of the latest message received, None before the first
+        statistics (can_manager.statistics.MessageStatistics): receive statistics of the message,
+                                                               None if not kept
         data (int or float)
     """
 
     def __init__(self, message_id: str, reading: str,
-                 conversion_factor) -> None:
+                 conversion_factor, signals=None, history_length=256, project=None, statistics=True) -> None:
         self.message_id = message_id
         self.reading = reading
         self.conversion_factor = conversion_factor
+        self.project = project
+        self.decoder = compile_decoder(message_id, signals, conversion_factor) if signals else None
+        self.history = SampleHistory(history_length) if history_length else None
+        self.count = 0
+        self.timestamp = None
+        self.statistics = MessageStatistics() if statistics else None
         self.data = None
 
 
+class SampleHistory:
+    """Fixed size ring buffer of timestamped message payloads
+
+    All storage is preallocated when the history is created, and appending a sample
+    overwrites the oldest slot in place, so nothing is allocated per message. A single
+    thread appends samples, any number of threads can read them
+
+    Attributes:
+        capacity (int): number of samples kept
+        payload_size (int): maximum payload length stored per sample, longer payloads are truncated
+        count (int): total number of samples appended since the history was created
+        timestamps (array.array): timestamp of the sample in each slot
+        lengths (bytearray): payload length of the sample in each slot
+        payloads (bytearray): payload of each slot, packed payload_size bytes per slot
+
+    Methods:
+        append(timestamp: float, data: bytes)
+        latest() -> tuple
+            Returns the most recent (timestamp, payload), None if empty
+        last(n: int) -> list
+            Returns up to the n most recent (timestamp, payload) samples, oldest first
+    """
+
+    def __init__(self, capacity=256, payload_size=8) -> None:
+        if capacity < 1:
+            raise ValueError(f'Error: history capacity must be at least 1, not {capacity}')
+        self.capacity = capacity
+        self.payload_size = payload_size
+        self.count = 0
+        self.timestamps = array('d', bytes(8 * capacity))
+        self.lengths = bytearray(capacity)
+        self.payloads = bytearray(payload_size * capacity)
+
+    def __len__(self) -> int:
+        return min(self.count, self.capacity)
+
+    def append(self, timestamp: float, data: bytes) -> None:
+        slot = self.count % self.capacity
+        offset = slot * self.payload_size
+        length = len(data)
+        if length > self.payload_size:
+            length = self.payload_size
+            data = data[:length]
+        self.payloads[offset:offset + length] = data
+        self.lengths[slot] = length
+        self.timestamps[slot] = timestamp
+        # Publish the sample only once the slot has been written
+        self.count += 1
+
+    def _sample(self, slot: int) -> tuple:
+        offset = slot * self.payload_size
+        return self.timestamps[slot], bytes(self.payloads[offset:offset + self.lengths[slot]])
+
+    def latest(self):
+        count = self.count
+        if count == 0:
+            return None
+        return self._sample((count - 1) % self.capacity)
+
+    def last(self, n: int) -> list:
+        while True:
+            count = self.count
+            n = min(n, count, self.capacity)
+            samples = [self._sample(index % self.capacity) for index in range(count - n, count)]
+            # Retry if the writer wrapped around onto the copied samples in the meantime
+            if self.count - count <= self.capacity - n:
+                return samples
+
+
+class ReadingListener(can.Listener):
+    """Listener which assigns every received message to its SensorReading object
+
+    Used by CanManager.start_receiver, messages with ids that are not configured are counted
+    but otherwise ignored
+    """
+
+    def __init__(self, manager: CanManager) -> None:
+        self.manager = manager
+
+    def on_message_received(self, msg: can.Message) -> None:
+        self.manager.assign_message_data(msg)
+
+
+def load_message_config(project: str, config_file: str, path=None, history_length=256, id_offset=0,
+                        name=None, statistics=True) -> dict:
+    """Reads the sensor readings of a project from the message configuration, without a bus
+
+    Used by CanManager.read_message_config, and for offline processing of recorded captures
+
+    Parameters:
+        project (str): must be one of dts, suspension, or windtunnel
+        config_file (str): message configuration file name
+        path (str): path to folder containing configuration file, if no path specified, current working
+                    directory is assumed
+        history_length (int): number of samples kept in the history of each SensorReading, 0 for
+                              no history
+        id_offset (int): added to every integer message id, e.g. for an inverter configured with
+                         a different can offset
+        name (str): project the readings belong to (SensorReading.project), defaults to project
+        statistics (bool): whether to keep receive statistics of each SensorReading
+
+    Returns:
+        (dict) SensorReading objects keyed by message id
+
+    Raises:
+        ValueError: if the project is not valid, or defines the same message id twice
+    """
+    if project.lower() not in ["dts", "suspension", "windtunnel"]:
+        raise ValueError(f'Error: {project} is not a valid project')
+    file_path = os.getcwd() if path is None else path
+    messages = {}
+    with open(os.path.join(file_path, config_file), 'r+') as config:
+        config_dict = json.load(config)
+        for reading in config_dict[project.lower()]['readings']:
+            message_id = reading['message_id']
+            # Placeholder ids of readings that are not received yet are not offset
+            if isinstance(message_id, int):
+                message_id += id_offset
+            if message_id in messages:
+                raise ValueError(f'Error: ID: {message_id} is defined twice in {project}')
+            messages[message_id] = SensorReading(
+                message_id,
+                reading['reading'],
+                reading['conversion_factor'] if reading['conversion_factor'] else None,
+                reading.get('signals'),
+                history_length,
+                (project if name is None else name).lower(),
+                statistics,
+            )
+    return messages
+
+
 if __name__ == "__main__":
     """Note: To send messages in test case, must be running linux to make use of socketcan
 
@@ -0,0 +1,142 @@
+"""Contains classes and functions to compile can message decoders from the message configuration
+
+Each reading in the message configuration can describe the signals packed into its
+payload. Rather than slicing and converting every field separately for every frame,
+the signals of a message are compiled once into a single struct layout and a tuple
+of conversion factors, so a whole frame is decoded with one unpack call.
+
+Classes:
+    MessageDecoder
+
+Functions:
+    compile_decoder
+"""
+import struct
+from operator import truediv
+
+
+class MessageDecoder:
+    """Precompiled decoder for all of the signals contained in a single can message
+
+    Attributes:
+        message_id (int): can arbitration id of the message being decoded
+        fields (tuple(tuple)): (start byte, struct type) of each field unpacked from the payload
+        layout (struct.Struct): little endian layout of the payload, unused bytes are padded
+        size (int): minimum payload length required to decode the message
+        names (tuple(str)): names of the decoded signals, in the order decode returns them.
+                            Scaled signals come first, followed by boolean (bit) signals
+        divisors (tuple(float)): conversion factor of each scaled signal
+        scaled_indices (tuple(int)): index of the unpacked field of each scaled signal
+        bits (tuple(tuple)): (field index, bit) of each boolean signal
+
+    Methods:
+        decode(data: bytes) -> list
+            Decodes a payload into a list of signal values, ordered as names
+    """
+
+    def __init__(self, message_id: int, fields: list, scaled_fields: list, bit_fields: list) -> None:
+        """
+        Args:
+            message_id (int): can arbitration id of the message
+            fields (list(tuple)): (start byte, struct type) of each field, in byte order
+            scaled_fields (list(tuple)): (name, field index, conversion factor) of each scaled signal
+            bit_fields (list(tuple)): (name, field index, bit) of each boolean signal
+        """
+        self.message_id = message_id
+        self.fields = tuple(fields)
+        # Pad any bytes between fields that are not decoded
+        layout = '<'
+        offset = 0
+        for start, signal_type in self.fields:
+            layout += 'x' * (start - offset) + signal_type
+            offset = start + struct.calcsize('<' + signal_type)
+        self.layout = struct.Struct(layout)
+        self.size = self.layout.size
+        self.names = tuple(name for name, _, _ in scaled_fields) + \
+            tuple(name for name, _, _ in bit_fields)
+        self.divisors = tuple(factor for _, _, factor in scaled_fields)
+        self.scaled_indices = tuple(index for _, index, _ in scaled_fields)
+        self.bits = tuple((index, bit) for _, index, bit in bit_fields)
+        # Most messages map every unpacked field to exactly one scaled signal, in which case
+        # the unpacked tuple can be scaled directly without selecting fields first
+        self._direct = self.scaled_indices == tuple(range(len(self.fields)))
+
+    def decode(self, data: bytes):
+        """Decodes a message payload
+
+        Args:
+            data (bytes): raw payload of the can message
+
+        Returns:
+            (list) signal values ordered as self.names, or None if the payload is too short
+        """
+        if len(data) < self.size:
+            return None
+        raw = self.layout.unpack_from(data)
+        if self._direct:
+            values = list(map(truediv, raw, self.divisors))
+        else:
+            values = [raw[index] / divisor for index, divisor in zip(self.scaled_indices, self.divisors)]
+        if self.bits:
+            values.extend([bool(raw[index] >> bit & 1) for index, bit in self.bits])
+        return values
+
+
+def compile_decoder(message_id: int, signals: list, conversion_factor=None) -> MessageDecoder:
+    """Compiles the signal definitions of a reading into a MessageDecoder
+
+    Each signal definition is a dict with the following keys:
+        name (str): name of the signal
+        start (int): byte offset of the signal within the payload
+        type (str, optional): struct format character of the signal, defaults to 'h' (int16)
+        conversion_factor (str or number, optional): the key of the factor to use when the reading
+                                                     has a dict of factors, or an explicit factor.
+                                                     Defaults to the reading's conversion factor
+        bit (int, optional): if present, the signal is the boolean value of this bit of the field,
+                             and no conversion factor is applied
+
+    Parameters:
+        message_id (int): can arbitration id of the message
+        signals (list(dict)): signal definitions of the reading
+        conversion_factor: conversion factor of the reading, or a dict of factors
+
+    Returns:
+        (MessageDecoder)
+    """
+    fields = set()
+    scaled_signals = []
+    bit_signals = []
+    for signal in signals:
+        field = (signal['start'], signal.get('type', 'h'))
+        if field[1] not in 'bBhHiIqQ':
+            raise ValueError(f'Error: {field[1]} is not a valid type for signal {signal["name"]}')
+        fields.add(field)
+        if 'bit' in signal:
+            bit_signals.append((signal['name'], field, signal['bit']))
+            continue
+        factor = signal.get('conversion_factor', conversion_factor)
+        if isinstance(factor, str):
+            try:
+                factor = conversion_factor[factor]
+            except (KeyError, TypeError):
+                raise ValueError(f'Error: {factor} is not a conversion factor of message {message_id}')
+        elif isinstance(factor, dict):
+            raise ValueError(f'Error: signal {signal["name"]} must specify which conversion factor to use')
+        scaled_signals.append((signal['name'], field, 1 if factor is None else factor))
+
+    # Fields are laid out in byte order
+    fields = sorted(fields)
+    field_indices = {}
+    offset = 0
+    for start, signal_type in fields:
+        if start < offset:
+            raise ValueError(f'Error: signals overlap at byte {start} of message {message_id}')
+        field_indices[(start, signal_type)] = len(field_indices)
+        offset = start + struct.calcsize('<' + signal_type)
+
+    return MessageDecoder(
+        message_id,
+        fields,
+        [(name, field_indices[field], factor) for name, field, factor in scaled_signals],
+        [(name, field_indices[field], bit) for name, field, bit in bit_signals],
+    )
@@ -0,0 +1,240 @@
+"""Contains classes to capture raw can messages to a compact binary log, and read them back
+
+Every message is stored as a fixed width record, so a capture can be memory-mapped and any
+record located by its position alone. A sparse time index, holding the timestamp of every
+index_interval-th record, is written next to the capture so a reader can seek to any
+timestamp without scanning the file.
+
+Capture file layout:
+    header: magic (8 bytes), record size (uint32), index interval (uint32)
+    records: timestamp (float64), arbitration id (uint32), dlc (uint8), flags (uint8),
+             padding (2 bytes), data (8 bytes)
+
+Index file layout (capture path + '.idx'):
+    timestamps (float64) of records 0, index_interval, 2 * index_interval, ...
+
+Classes:
+    CaptureRecorder
+    CaptureReader
+"""
+import mmap
+import os
+import struct
+from array import array
+from bisect import bisect_left
+
+import can
+
+MAGIC = b'PDQCAP01'
+HEADER = struct.Struct('<8sII')
+RECORD = struct.Struct('<dIBB2x8s')
+
+# Record flags
+FLAG_EXTENDED = 1 << 0
+FLAG_REMOTE = 1 << 1
+FLAG_ERROR = 1 << 2
+
+
+def index_path(capture_path: str) -> str:
+    return capture_path + '.idx'
+
+
+class CaptureRecorder(can.Listener):
+    """Listener which appends every received message to a binary capture
+
+    Records are packed into a preallocated buffer, which is written to the file once full,
+    so the cost per message is a single pack. Pass an instance to CanManager.start_receiver
+    to capture every message at full rate
+
+        recorder = CaptureRecorder('run.pdqcap')
+        bus.start_receiver(listeners=[recorder])
+
+    Attributes:
+        path (str): path of the capture file
+        index_interval (int): number of records between index entries
+        record_count (int): number of records captured so far
+
+    Methods:
+        on_message_received(msg: can.Message)
+        flush
+            Writes buffered records to the capture and index files
+        stop
+            Flushes and closes the capture
+    """
+
+    def __init__(self, path: str, index_interval=1024, buffer_records=4096) -> None:
+        """
+        Args:
+            path (str): path of the capture file, overwritten if it already exists
+            index_interval (int): number of records between index entries
+            buffer_records (int): number of records buffered before they are written to the file
+        """
+        self.path = path
+        self.index_interval = index_interval
+        self.record_count = 0
+        self._capture = open(path, 'wb')
+        self._index = open(index_path(path), 'wb')
+        self._capture.write(HEADER.pack(MAGIC, RECORD.size, index_interval))
+        self._capture.flush()
+        self._buffer = bytearray(RECORD.size * buffer_records)
+        self._buffer_size = len(self._buffer)
+        self._offset = 0
+        self._index_entries = array('d')
+
+    def on_message_received(self, msg: can.Message) -> None:
+        flags = FLAG_EXTENDED if msg.is_extended_id else 0
+        if msg.is_remote_frame:
+            flags |= FLAG_REMOTE
+        if msg.is_error_frame:
+            flags |= FLAG_ERROR
+        RECORD.pack_into(self._buffer, self._offset, msg.timestamp, msg.arbitration_id,
+                         msg.dlc, flags, msg.data)
+        if self.record_count % self.index_interval == 0:
+            self._index_entries.append(msg.timestamp)
+        self.record_count += 1
+        self._offset += RECORD.size
+        if self._offset == self._buffer_size:
+            self.flush()
+
+    def flush(self) -> None:
+        if self._offset:
+            self._capture.write(memoryview(self._buffer)[:self._offset])
+            self._offset = 0
+        if self._index_entries:
+            self._index_entries.tofile(self._index)
+            del self._index_entries[:]
+        self._capture.flush()
+        self._index.flush()
+
+    def stop(self) -> None:
+        if not self._capture.closed:
+            self.flush()
+            self._capture.close()
+            self._index.close()
+
+
+class CaptureReader:
+    """Memory-mapped reader for captures written by CaptureRecorder
+
+    Records are read directly from the mapped file, nothing is loaded up front other
+    than the sparse time index. If the index file is missing (e.g. the recording was
+    interrupted) it is rebuilt from every index_interval-th record
+
+    Attributes:
+        path (str): path of the capture file
+        index_interval (int): number of records between index entries
+        index (array.array): timestamps of every index_interval-th record
+        records (memoryview): raw record bytes of the whole capture
+
+    Methods:
+        record(position: int) -> tuple
+            Returns (timestamp, arbitration_id, dlc, flags, data) of a record
+        message(position: int) -> can.Message
+        seek(timestamp: float) -> int
+            Returns the position of the first record at or after timestamp
+        messages(start_time: float, end_time: float)
+            Iterates over the messages between two timestamps
+        close
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._file = open(path, 'rb')
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, record_size, self.index_interval = HEADER.unpack_from(self._map)
+        if magic != MAGIC or record_size != RECORD.size:
+            self.close()
+            raise ValueError(f'Error: {path} is not a valid capture file')
+        # Ignore a partially written trailing record
+        self._count = (len(self._map) - HEADER.size) // RECORD.size
+        self.records = memoryview(self._map)[HEADER.size:HEADER.size + self._count * RECORD.size]
+        self.index = self._load_index()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def __len__(self) -> int:
+        return self._count
+
+    def _load_index(self) -> array:
+        index = array('d')
+        expected = -(-self._count // self.index_interval)
+        if os.path.isfile(index_path(self.path)):
+            with open(index_path(self.path), 'rb') as index_file:
+                index.frombytes(index_file.read())
+        if len(index) < expected:
+            index = array('d', (self.timestamp(position)
+                                for position in range(0, self._count, self.index_interval)))
+        return index[:expected]
+
+    def timestamp(self, position: int) -> float:
+        return struct.unpack_from('<d', self.records, position * RECORD.size)[0]
+
+    def record(self, position: int) -> tuple:
+        return RECORD.unpack_from(self.records, position * RECORD.size)
+
+    def message(self, position: int) -> can.Message:
+        timestamp, arbitration_id, dlc, flags, data = self.record(position)
+        return can.Message(timestamp=timestamp, arbitration_id=arbitration_id,
+                           is_extended_id=bool(flags & FLAG_EXTENDED),
+                           is_remote_frame=bool(flags & FLAG_REMOTE),
+                           is_error_frame=bool(flags & FLAG_ERROR),
+                           dlc=dlc, data=data[:dlc])
+
+    def seek(self, timestamp: float) -> int:
+        """Returns the position of the first record with a timestamp at or after timestamp
+
+        The index narrows the search down to a single block of index_interval records,
+        which is then binary searched in the mapped file
+        """
+        block = bisect_left(self.index, timestamp)
+        low = max(block - 1, 0) * self.index_interval
+        high = min(block * self.index_interval, self._count)
+        while low < high:
+            middle = (low + high) // 2
+            if self.timestamp(middle) < timestamp:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def messages(self, start_time=None, end_time=None):
+        position = 0 if start_time is None else self.seek(start_time)
+        for position in range(position, self._count):
+            message = self.message(position)
+            if end_time is not None and message.timestamp > end_time:
+                return
+            yield message
+
+    def close(self) -> None:
+        if hasattr(self, 'records'):
+            self.records.release()
+        self._map.close()
+        self._file.close()
+
+
+if __name__ == "__main__":
+    """Captures every message on a bus until interrupted
+
+    Usage: python3 recorder.py <channel> <capture path>
+    """
+    import sys
+    import time
+
+    from can_manager import can_manager
+
+    bus = can_manager.CanManager(sys.argv[1], 0.1)
+    recorder = CaptureRecorder(sys.argv[2])
+    bus.start_receiver(listeners=[recorder])
+    try:
+        while True:
+            time.sleep(1)
+            print(f'{recorder.record_count} messages captured')
+    except KeyboardInterrupt:
+        pass
+    finally:
+        bus.stop_receiver()
+        recorder.stop()
@@ -0,0 +1,114 @@
+"""Contains a class to replay recorded can captures onto a bus
+
+Captures recorded by can_manager.recorder (.pdqcap) and any log format supported by
+python-can's LogReader (e.g. candump .log files) can be replayed onto a python-can
+virtual bus or a vcan interface. A CanManager listening on the same channel then
+receives the recorded traffic as if it came from the inverter, so the ingest and
+decode paths can be benchmarked and regression tested without the motor rig.
+
+Classes:
+    CaptureReplay
+"""
+import threading
+import time
+
+import can
+
+from can_manager.recorder import CaptureReader
+
+
+class CaptureReplay:
+    """Plays a recorded capture onto a can bus
+
+    Messages are sent with the relative timing of the recording, scaled by speed. A speed
+    of 1 replays in real time, N replays N times faster, and None replays as fast as possible
+
+        sender = can.interface.Bus(channel='replay', interface='virtual')
+        replay = CaptureReplay('dts_run.pdqcap', sender, speed=10)
+        replay.start()
+
+    Attributes:
+        path (str): path of the capture, .pdqcap captures are read with CaptureReader,
+                    any other format with can.LogReader
+        bus (can.BusABC): bus the messages are sent on
+        speed (float): replay speed relative to the recording, None for as fast as possible
+        start_time (float): only replay messages recorded at or after this timestamp
+        end_time (float): only replay messages recorded at or before this timestamp
+        sent (int): number of messages sent so far
+        max_lateness (float): largest delay in seconds between when a message was due and when it was sent
+        running (bool): whether a background replay is in progress
+
+    Methods:
+        messages
+            Iterates over the messages of the capture within the replay window
+        run -> int
+            Replays the capture in the calling thread, returns the number of messages sent
+        start
+            Replays the capture in a background thread
+        stop
+            Stops a replay in progress
+        join(timeout: float)
+            Waits for a background replay to finish
+    """
+
+    def __init__(self, path: str, bus: can.BusABC, speed=1.0, start_time=None, end_time=None) -> None:
+        if speed is not None and speed <= 0:
+            raise ValueError(f'Error: replay speed must be positive, not {speed}')
+        self.path = path
+        self.bus = bus
+        self.speed = speed
+        self.start_time = start_time
+        self.end_time = end_time
+        self.sent = 0
+        self.max_lateness = 0.0
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def messages(self):
+        if self.path.endswith('.pdqcap'):
+            with CaptureReader(self.path) as capture:
+                yield from capture.messages(self.start_time, self.end_time)
+            return
+        for message in can.LogReader(self.path):
+            if self.start_time is not None and message.timestamp < self.start_time:
+                continue
+            if self.end_time is not None and message.timestamp > self.end_time:
+                return
+            yield message
+
+    def run(self) -> int:
+        origin = None
+        for message in self.messages():
+            if self._stop_event.is_set():
+                break
+            if self.speed is not None:
+                if origin is None:
+                    origin = (time.perf_counter(), message.timestamp)
+                due = origin[0] + (message.timestamp - origin[1]) / self.speed
+                delay = due - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                else:
+                    self.max_lateness = max(self.max_lateness, -delay)
+            self.bus.send(message)
+            self.sent += 1
+        return self.sent
+
+    def start(self) -> None:
+        if self._thread is not None and self._thread.is_alive():
+            raise Exception('Error: replay is already running')
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self.run, daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop_event.set()
+        self.join()
+
+    def join(self, timeout=None) -> None:
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
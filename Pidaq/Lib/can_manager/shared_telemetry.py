@@ -0,0 +1,343 @@
+"""Contains classes to share the latest telemetry between processes through shared memory
+
+The acquisition process publishes the values and timestamps of a SignalStore into a
+multiprocessing.shared_memory segment, and any number of consumer processes (dashboard,
+influx logger, UDP publisher, ...) read them directly from the segment, without pipes,
+pickling or locks. Readers never write to the segment, so publishing costs the same
+however many readers there are.
+
+Consistency is provided by a seqlock: the publisher increments a sequence number before
+and after writing, so it is odd while a write is in progress. A reader copies the data,
+and retries if the sequence number was odd or changed in the meantime. A publisher that
+dies in the middle of a write leaves the sequence number odd, so readers give up after
+retrying for read_timeout.
+
+Segment layout:
+    header: magic (8 bytes), sequence (uint64), signal count (uint32), capacity (uint32)
+    names: capacity slots of NAME_SIZE bytes, utf-8, null padded
+    flags: capacity bytes, FLAG_BOOLEAN for boolean signals, padded to 8 bytes
+    values: capacity float64
+    timestamps: capacity float64
+
+Classes:
+    TelemetryPublisher
+    TelemetryReader
+"""
+import struct
+import time
+from array import array
+from multiprocessing import resource_tracker, shared_memory
+
+MAGIC = b'PDQTEL01'
+HEADER = struct.Struct('<8sQII')
+NAME_SIZE = 48
+# Default time in seconds a reader retries for while the segment is being written
+READ_TIMEOUT = 0.1
+
+# Signal flags
+FLAG_BOOLEAN = 1 << 0
+
+
+def segment_size(capacity: int) -> int:
+    flags_size = -(-capacity // 8) * 8
+    return HEADER.size + capacity * NAME_SIZE + flags_size + 2 * 8 * capacity
+
+
+class _Segment:
+    """Views of the regions of a telemetry segment"""
+
+    def __init__(self, segment: shared_memory.SharedMemory, capacity: int) -> None:
+        self.segment = segment
+        self.capacity = capacity
+        buffer = segment.buf
+        self.buffer = buffer
+        self.sequence = buffer[8:16].cast('Q')
+        self.names_offset = HEADER.size
+        self.flags_offset = self.names_offset + capacity * NAME_SIZE
+        self.values_offset = self.flags_offset + -(-capacity // 8) * 8
+        self.timestamps_offset = self.values_offset + 8 * capacity
+        self.values = buffer[self.values_offset:self.timestamps_offset].cast('d')
+        self.timestamps = buffer[self.timestamps_offset:self.timestamps_offset + 8 * capacity].cast('d')
+
+    def count(self) -> int:
+        return struct.unpack_from('<I', self.buffer, 16)[0]
+
+    def release(self) -> None:
+        for view in (self.sequence, self.values, self.timestamps, self.buffer):
+            view.release()
+
+
+class TelemetryPublisher:
+    """Publishes the signals of a SignalStore into a shared memory segment
+
+        publisher = TelemetryPublisher('dts_telemetry', dts.telemetry.store)
+        while True:
+            dts.telemetry.update_data_batch()
+            publisher.publish()
+
+    Attributes:
+        name (str): name of the shared memory segment, used by readers to attach
+        store (can_manager.signal_store.SignalStore): signals that are published
+        capacity (int): maximum number of signals
+        published_version (int): version of the store last published
+
+    Methods:
+        publish(force: bool) -> bool
+            Copies the latest values into the segment if the store has changed
+        close
+            Closes and removes the segment
+    """
+
+    def __init__(self, name: str, store, capacity=256) -> None:
+        """
+        Args:
+            name (str): name of the shared memory segment, replaced if it already exists
+            store (can_manager.signal_store.SignalStore): signals to publish
+            capacity (int): maximum number of signals, signals added to the store beyond
+                            this are not published
+        """
+        self.name = name
+        self.store = store
+        self.capacity = capacity
+        self.published_version = None
+        self._published_count = 0
+        try:
+            stale = shared_memory.SharedMemory(name=name)
+            stale.close()
+            stale.unlink()
+        except FileNotFoundError:
+            pass
+        segment = shared_memory.SharedMemory(name=name, create=True, size=segment_size(capacity))
+        HEADER.pack_into(segment.buf, 0, MAGIC, 0, 0, capacity)
+        self._segment = _Segment(segment, capacity)
+        # Publish the signals already in the store, so readers can look them up straight away
+        self.publish(force=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def _write_names(self, start: int, count: int) -> None:
+        segment = self._segment
+        for index in range(start, count):
+            name = self.store.names[index].encode()
+            if len(name) > NAME_SIZE:
+                raise ValueError(f'Error: signal name {self.store.names[index]} is longer than {NAME_SIZE} bytes')
+            struct.pack_into(f'{NAME_SIZE}s', segment.buffer, segment.names_offset + index * NAME_SIZE, name)
+            segment.buffer[segment.flags_offset + index] = \
+                FLAG_BOOLEAN if self.store.names[index] in self.store.booleans else 0
+        struct.pack_into('<I', segment.buffer, 16, count)
+
+    def publish(self, force=False) -> bool:
+        """Copies the values and timestamps of the store into the segment
+
+        Args:
+            force (bool): publish even if the store has not changed since the last publish
+
+        Returns:
+            (bool) True if the segment was written
+        """
+        store = self.store
+        if not force and store.version == self.published_version:
+            return False
+        segment = self._segment
+        count = min(len(store), self.capacity)
+        sequence = segment.sequence[0]
+        segment.sequence[0] = sequence + 1
+        if count != self._published_count:
+            self._write_names(self._published_count, count)
+            self._published_count = count
+        if count == len(store):
+            segment.values[:count] = store.values
+            segment.timestamps[:count] = store.timestamps
+        else:
+            segment.values[:count] = store.values[:count]
+            segment.timestamps[:count] = store.timestamps[:count]
+        segment.sequence[0] = sequence + 2
+        self.published_version = store.version
+        return True
+
+    def close(self) -> None:
+        if self._segment is not None:
+            segment = self._segment.segment
+            self._segment.release()
+            self._segment = None
+            segment.close()
+            segment.unlink()
+
+
+class TelemetryReader:
+    """Reads consistent snapshots of the signals published by a TelemetryPublisher
+
+    Attributes:
+        name (str): name of the shared memory segment
+        read_timeout (float): time in seconds a read retries for while the publisher is writing
+        names (list(str)): names of the published signals
+        index (dict): slot of each signal, keyed by name
+        booleans (set): names of the boolean signals
+
+    Methods:
+        sequence -> int
+            Returns the sequence number of the segment, which changes on every publish
+        snapshot -> tuple
+            Returns copies of the values and timestamps arrays
+        get(name: str)
+            Returns the latest value of a signal, None if not decoded yet. Raises KeyError
+            if the signal is not published
+        as_dict -> dict
+            Returns the latest value of every signal, keyed by name
+        close
+
+    Raises:
+        TimeoutError: from snapshot, get and as_dict, if the segment is being written for longer
+                      than read_timeout, i.e. the publisher stopped in the middle of a write
+    """
+
+    def __init__(self, name: str, timeout=None, read_timeout=READ_TIMEOUT) -> None:
+        """
+        Args:
+            name (str): name of the shared memory segment
+            timeout (float): time to wait for the publisher to create the segment, None to fail immediately
+            read_timeout (float): time in seconds a read retries for while the publisher is writing
+        """
+        self.name = name
+        self.read_timeout = read_timeout
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            try:
+                segment = _attach(name)
+                break
+            except FileNotFoundError:
+                if deadline is None or time.monotonic() >= deadline:
+                    raise
+                time.sleep(0.01)
+        magic, _, _, capacity = HEADER.unpack_from(segment.buf)
+        if magic != MAGIC:
+            segment.close()
+            raise ValueError(f'Error: {name} is not a telemetry segment')
+        self._segment = _Segment(segment, capacity)
+        self.names = []
+        self.index = {}
+        self.booleans = set()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def sequence(self) -> int:
+        return self._segment.sequence[0]
+
+    def _retry(self, deadline):
+        """Returns the deadline of a read that has to be retried, raises TimeoutError once it has passed"""
+        now = time.monotonic()
+        if deadline is None:
+            return now + self.read_timeout
+        if now >= deadline:
+            raise TimeoutError(f'Error: {self.name} has been written for more than {self.read_timeout}s, '
+                               f'the publisher may have stopped in the middle of a write')
+        return deadline
+
+    def _read_names(self, count: int) -> None:
+        segment = self._segment
+        for index in range(len(self.names), count):
+            offset = segment.names_offset + index * NAME_SIZE
+            name = bytes(segment.buffer[offset:offset + NAME_SIZE]).rstrip(b'\0').decode()
+            self.names.append(name)
+            self.index[name] = index
+            if segment.buffer[segment.flags_offset + index] & FLAG_BOOLEAN:
+                self.booleans.add(name)
+
+    def snapshot(self) -> tuple:
+        """Returns a consistent copy of the published values and timestamps
+
+        Retries while the publisher is writing, so the values are never a mix of two publishes
+
+        Returns:
+            (tuple(array.array)) values and timestamps, ordered as names
+
+        Raises:
+            TimeoutError: if the segment is being written for longer than read_timeout
+        """
+        segment = self._segment
+        buffer = segment.buffer
+        deadline = None
+        while True:
+            start = segment.sequence[0]
+            if start & 1:
+                deadline = self._retry(deadline)
+                time.sleep(0)
+                continue
+            count = segment.count()
+            values = array('d')
+            values.frombytes(buffer[segment.values_offset:segment.values_offset + 8 * count])
+            timestamps = array('d')
+            timestamps.frombytes(buffer[segment.timestamps_offset:segment.timestamps_offset + 8 * count])
+            if segment.sequence[0] == start:
+                break
+            deadline = self._retry(deadline)
+        if count != len(self.names):
+            self._read_names(count)
+        return values, timestamps
+
+    def get(self, name: str):
+        """Returns the latest value of a signal, None if not decoded yet
+
+        Raises:
+            KeyError: if the signal is not published
+            TimeoutError: if the segment is being written for longer than read_timeout
+        """
+        if name not in self.index:
+            self.snapshot()
+        index = self.index[name]
+        segment = self._segment
+        deadline = None
+        while True:
+            start = segment.sequence[0]
+            value = segment.values[index]
+            if not start & 1 and segment.sequence[0] == start:
+                break
+            deadline = self._retry(deadline)
+            time.sleep(0)
+        if value != value:
+            return None
+        return bool(value) if name in self.booleans else value
+
+    def as_dict(self) -> dict:
+        values, _ = self.snapshot()
+        return {name: None if value != value else bool(value) if name in self.booleans else value
+                for name, value in zip(self.names, values)}
+
+    def close(self) -> None:
+        if self._segment is not None:
+            segment = self._segment.segment
+            self._segment.release()
+            self._segment = None
+            segment.close()
+
+
+def _attach(name: str) -> shared_memory.SharedMemory:
+    """Attaches to an existing segment without registering it with the resource tracker
+
+    Otherwise the tracker would remove the segment when the reader process exits. Before
+    python 3.13 attached segments are always registered, so registration is skipped while
+    attaching. Unregistering afterwards is not an option, as processes started with fork
+    share the publisher's tracker
+    """
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        pass
+    register = resource_tracker.register
+    resource_tracker.register = _skip_register
+    try:
+        return shared_memory.SharedMemory(name=name)
+    finally:
+        resource_tracker.register = register
+
+
+def _skip_register(name: str, rtype: str) -> None:
+    pass
@@ -0,0 +1,142 @@
+"""Contains a class to store the latest value of decoded signals in columnar arrays
+
+Rather than one attribute per signal, the value and timestamp of every signal are kept
+in two parallel float64 arrays, indexed through a name to index map. A snapshot, export
+or diff of every signal is then a single array copy or comparison, and the arrays can be
+written to shared memory. Signals are meant to be added up front: once the store is
+frozen no signal can be added, so the arrays are never resized and can be viewed without
+copying by numpy (numpy.frombuffer). An array that is being viewed can not be resized.
+
+Classes:
+    SignalStore
+"""
+from array import array
+
+NAN = float('nan')
+
+
+class SignalStore:
+    """Latest value and timestamp of a set of named signals
+
+    Signals that have not been decoded yet hold NaN. Boolean signals are stored as 0.0 or 1.0,
+    and returned as bool by get
+
+    Attributes:
+        names (list(str)): name of the signal in each slot
+        index (dict): slot of each signal, keyed by name
+        values (array.array): latest value of each signal
+        timestamps (array.array): timestamp of the latest value of each signal
+        booleans (set): names of the boolean signals
+        version (int): incremented each time values are written
+        frozen (bool): whether signals can no longer be added
+
+    Methods:
+        add(name: str, boolean: bool) -> int
+            Adds a signal, returns its slot. Raises ValueError for a new signal once frozen
+        freeze
+            Prevents any more signals being added, so the arrays can be viewed without copying
+        indices(names: list, booleans: list) -> tuple
+            Returns the slots of several signals, adding any that are missing
+        get(name: str)
+            Returns the latest value of a signal, None if not decoded yet
+        set(name: str, value: float, timestamp: float)
+        update(indices: tuple, values: list, timestamp: float)
+            Writes the values of several signals at once
+        snapshot -> tuple
+            Returns copies of the values and timestamps arrays
+        changed(previous: array.array) -> list
+            Returns the names of the signals whose value differs from a snapshot
+        as_dict -> dict
+            Returns the latest value of every signal, keyed by name
+    """
+
+    def __init__(self, names=(), booleans=()) -> None:
+        """
+        Args:
+            names (list(str)): signals to preallocate
+            booleans (list(str)): names of the boolean signals, added if not in names
+        """
+        self.names = []
+        self.index = {}
+        self.values = array('d')
+        self.timestamps = array('d')
+        self.booleans = set()
+        self.version = 0
+        self.frozen = False
+        for name in names:
+            self.add(name)
+        for name in booleans:
+            self.add(name, True)
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.index
+
+    def add(self, name: str, boolean=False) -> int:
+        if boolean:
+            self.booleans.add(name)
+        index = self.index.get(name)
+        if index is None:
+            if self.frozen:
+                raise ValueError(f'Error: {name} can not be added to a frozen signal store')
+            index = self.index[name] = len(self.names)
+            self.names.append(name)
+            self.values.append(NAN)
+            self.timestamps.append(NAN)
+        return index
+
+    def freeze(self) -> None:
+        self.frozen = True
+
+    def indices(self, names, booleans=()) -> tuple:
+        booleans = set(booleans)
+        return tuple(self.add(name, name in booleans) for name in names)
+
+    def get(self, name: str):
+        value = self.values[self.index[name]]
+        if value != value:
+            return None
+        return bool(value) if name in self.booleans else value
+
+    def set(self, name: str, value, timestamp=None) -> None:
+        index = self.index[name] if name in self.index else self.add(name, isinstance(value, bool))
+        self.values[index] = NAN if value is None else value
+        self.timestamps[index] = NAN if timestamp is None else timestamp
+        self.version += 1
+
+    def update(self, indices: tuple, values: list, timestamp=None) -> None:
+        """Writes the values of several signals, all with the same timestamp
+
+        Args:
+            indices (tuple(int)): slot of each value, see indices
+            values (list): values in the same order as indices
+            timestamp (float): timestamp of the values, None if unknown
+        """
+        store_values = self.values
+        store_timestamps = self.timestamps
+        timestamp = NAN if timestamp is None else timestamp
+        for index, value in zip(indices, values):
+            store_values[index] = value
+            store_timestamps[index] = timestamp
+        self.version += 1
+
+    def snapshot(self) -> tuple:
+        return self.values[:], self.timestamps[:]
+
+    def changed(self, previous: array) -> list:
+        """Returns the names of the signals whose value differs from a previous snapshot
+
+        Signals added since the snapshot was taken count as changed once they have a value
+        """
+        values = self.values
+        changed = []
+        for index, value in enumerate(values):
+            old = previous[index] if index < len(previous) else NAN
+            if value != old and (value == value or old == old):
+                changed.append(self.names[index])
+        return changed
+
+    def as_dict(self) -> dict:
+        return {name: self.get(name) for name in self.names}
@@ -0,0 +1,171 @@
+"""Contains classes and functions to measure the health of can message ingest
+
+Classes:
+    MessageStatistics
+
+Functions:
+    interface_statistics
+    socket_statistics
+"""
+import os
+import socket
+import struct
+from array import array
+from math import log10
+
+# Inter-arrival times are counted in a histogram with logarithmic bins from 1us to 100s,
+# so percentiles can be estimated without storing every interval
+HISTOGRAM_MIN_DECADE = -6
+HISTOGRAM_BINS_PER_DECADE = 20
+HISTOGRAM_BINS = 8 * HISTOGRAM_BINS_PER_DECADE
+
+# Receive statistics of the network interface which indicate lost messages
+INTERFACE_COUNTERS = ['rx_packets', 'rx_dropped', 'rx_over_errors', 'rx_fifo_errors', 'rx_errors']
+
+# Socket option returning the memory usage and drop counter of a socket (linux/sock_diag.h),
+# read up to SK_MEMINFO_DROPS, the last field
+SO_MEMINFO = getattr(socket, 'SO_MEMINFO', 55)
+SOCKET_MEMINFO = struct.Struct('9I')
+
+
+class MessageStatistics:
+    """Receive statistics of a single can message id
+
+    Recording a message only updates a few counters and one histogram bin, so the cost
+    per message is constant
+
+    Attributes:
+        count (int): number of messages received
+        first_timestamp (float): timestamp of the first message received
+        last_timestamp (float): timestamp of the latest message received
+        min_interval (float): shortest time between consecutive messages
+        max_interval (float): longest time between consecutive messages
+        interval_sum (float): sum of the time between consecutive messages
+        histogram (array.array): count of intervals in each logarithmic bin
+
+    Methods:
+        record(timestamp: float)
+        percentile(fraction: float) -> float
+            Estimates a percentile of the intervals between messages
+        summary(now: float) -> dict
+        reset
+    """
+
+    __slots__ = ('count', 'first_timestamp', 'last_timestamp', 'min_interval', 'max_interval',
+                 'interval_sum', 'histogram')
+
+    def __init__(self) -> None:
+        self.histogram = array('L', bytes(array('L').itemsize * HISTOGRAM_BINS))
+        self.reset()
+
+    def reset(self) -> None:
+        self.count = 0
+        self.first_timestamp = None
+        self.last_timestamp = None
+        self.min_interval = None
+        self.max_interval = None
+        self.interval_sum = 0.0
+        for index in range(HISTOGRAM_BINS):
+            self.histogram[index] = 0
+
+    def record(self, timestamp: float) -> None:
+        last_timestamp = self.last_timestamp
+        self.count += 1
+        self.last_timestamp = timestamp
+        if last_timestamp is None:
+            self.first_timestamp = timestamp
+            return
+        interval = timestamp - last_timestamp
+        self.interval_sum += interval
+        if self.min_interval is None or interval < self.min_interval:
+            self.min_interval = interval
+        if self.max_interval is None or interval > self.max_interval:
+            self.max_interval = interval
+        if interval > 0:
+            index = int((log10(interval) - HISTOGRAM_MIN_DECADE) * HISTOGRAM_BINS_PER_DECADE)
+            index = 0 if index < 0 else HISTOGRAM_BINS - 1 if index >= HISTOGRAM_BINS else index
+        else:
+            index = 0
+        self.histogram[index] += 1
+
+    def percentile(self, fraction: float):
+        """Estimates a percentile of the intervals between messages
+
+        Returns the upper edge of the histogram bin containing the percentile, so the
+        estimate is within one bin (about 12%) of the true value
+
+        Args:
+            fraction (float): percentile as a fraction, e.g. 0.99
+        """
+        intervals = self.count - 1
+        if intervals < 1:
+            return None
+        target = fraction * intervals
+        total = 0
+        for index, bin_count in enumerate(self.histogram):
+            total += bin_count
+            if total >= target:
+                upper = 10 ** ((index + 1) / HISTOGRAM_BINS_PER_DECADE + HISTOGRAM_MIN_DECADE)
+                return min(upper, self.max_interval)
+        return self.max_interval
+
+    def summary(self, now: float) -> dict:
+        """Returns the statistics of the message id
+
+        Args:
+            now (float): current time, in the same clock as the message timestamps
+        """
+        intervals = self.count - 1
+        duration = self.last_timestamp - self.first_timestamp if intervals > 0 else 0
+        return {
+            'count': self.count,
+            'rate': intervals / duration if duration > 0 else None,
+            'interval_min': self.min_interval,
+            'interval_mean': self.interval_sum / intervals if intervals > 0 else None,
+            'interval_max': self.max_interval,
+            'interval_p99': self.percentile(0.99),
+            'since_last': now - self.last_timestamp if self.last_timestamp is not None else None,
+        }
+
+
+def interface_statistics(channel: str) -> dict:
+    """Reads the receive counters of a network interface (e.g. can0) from sysfs
+
+    rx_dropped, rx_over_errors and rx_fifo_errors count messages lost by the driver or
+    controller before python could read them
+
+    Returns:
+        (dict) counter values, empty if the interface has no statistics (e.g. virtual buses)
+    """
+    statistics_path = os.path.join('/sys/class/net', str(channel), 'statistics')
+    counters = {}
+    for counter in INTERFACE_COUNTERS:
+        try:
+            with open(os.path.join(statistics_path, counter)) as counter_file:
+                counters[counter] = int(counter_file.read())
+        except (OSError, ValueError):
+            continue
+    return counters
+
+
+def socket_statistics(bus) -> dict:
+    """Reads the receive queue usage and drop counter of the socket of a bus
+
+    drops counts messages the kernel discarded because the socket's receive buffer was full,
+    i.e. python did not read them fast enough. These are not included in the interface
+    counters, which only count messages lost before reaching the socket. The counter is the
+    one SO_RXQ_OVFL reports, read with SO_MEMINFO instead, as python-can's receive path does
+    not accept the extra ancillary data SO_RXQ_OVFL attaches to every message
+
+    Returns:
+        (dict) rx_queued_bytes and rx_buffer_size of the receive buffer, and drops. Empty if the
+               bus has no socket (e.g. virtual buses) or the kernel does not report drops
+    """
+    bus_socket = getattr(bus, 'socket', None)
+    if bus_socket is None:
+        return {}
+    try:
+        meminfo = SOCKET_MEMINFO.unpack(bus_socket.getsockopt(socket.SOL_SOCKET, SO_MEMINFO, SOCKET_MEMINFO.size))
+    except (OSError, struct.error):
+        return {}
+    return {'rx_queued_bytes': meminfo[0], 'rx_buffer_size': meminfo[1], 'drops': meminfo[8]}
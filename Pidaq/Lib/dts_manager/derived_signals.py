@@ -0,0 +1,239 @@
+from array import array
+from collections import deque
+from math import sqrt
+
+from dts_manager import dts_manager
+
+NAN = float('nan')
+
+
+class RollingWindow():
+    """ Mean, variance, minimum and maximum of the most recent samples of a signal
+
+    Samples are kept in a preallocated ring buffer. The mean and variance are updated with
+    Welford's algorithm, adding the new sample and removing the one that leaves the window,
+    and the minimum and maximum are kept in monotonic queues, so each sample costs O(1)
+    however long the window is
+
+    Fields:
+        size (int): number of samples in a full window
+        count (int): number of samples in the window
+        mean (float): mean of the samples in the window, None if empty
+        minimum (float): smallest sample in the window, None if empty
+        maximum (float): largest sample in the window, None if empty
+
+    Methods:
+        add(value: float)
+        variance -> float
+            Returns the sample variance of the window, None with fewer than 2 samples
+        reset
+    """
+
+    __slots__ = ('size', 'count', 'samples', 'total', 'mean', 'm2', 'minima', 'maxima')
+
+    def __init__(self, size: int) -> None:
+        if size < 1:
+            raise ValueError(f'Error: window size must be at least 1, not {size}')
+        self.size = size
+        self.samples = array('d', bytes(8 * size))
+        self.minima = deque()
+        self.maxima = deque()
+        self.reset()
+
+    def reset(self) -> None:
+        self.count = 0
+        self.total = 0
+        self.mean = None
+        self.m2 = 0.0
+        self.minima.clear()
+        self.maxima.clear()
+
+    def add(self, value: float) -> None:
+        total = self.total
+        slot = total % self.size
+        if self.count < self.size:
+            self.count += 1
+            if self.mean is None:
+                self.mean = 0.0
+            delta = value - self.mean
+            self.mean += delta / self.count
+            self.m2 += delta * (value - self.mean)
+        else:
+            old = self.samples[slot]
+            mean = self.mean
+            self.mean = mean + (value - old) / self.size
+            self.m2 += (value - old) * (value - self.mean + old - mean)
+            if self.m2 < 0:
+                # Rounding error when the window is constant
+                self.m2 = 0.0
+        self.samples[slot] = value
+        self.total = total + 1
+
+        # Samples with an index before oldest have left the window
+        oldest = self.total - self.size
+        minima = self.minima
+        while minima and minima[-1][1] >= value:
+            minima.pop()
+        minima.append((total, value))
+        if minima[0][0] < oldest:
+            minima.popleft()
+        maxima = self.maxima
+        while maxima and maxima[-1][1] <= value:
+            maxima.pop()
+        maxima.append((total, value))
+        if maxima[0][0] < oldest:
+            maxima.popleft()
+
+    @property
+    def minimum(self):
+        return self.minima[0][1] if self.minima else None
+
+    @property
+    def maximum(self):
+        return self.maxima[0][1] if self.maxima else None
+
+    def variance(self):
+        if self.count < 2:
+            return None
+        return self.m2 / (self.count - 1)
+
+
+class DerivedSignals():
+    """ Computes signals derived from DTS telemetry as each message is decoded
+
+    Every result is written to the telemetry's signal store, so derived signals are read like
+    any decoded signal (e.g. telemetry.electrical_power), and are included in snapshots and in
+    shared memory publishing. Each update costs O(1) per decoded message, however long the
+    windows are
+
+    Derived signals:
+        electrical_power: dc_bus_voltage * dc_bus_current
+        phase_a_current_rms, phase_b_current_rms, phase_c_current_rms: RMS of each phase
+            current over the last phase_window samples
+        phase_current_rms: RMS of the three phase currents together
+        phase_current_imbalance: largest deviation of a phase RMS from their average, as a
+            fraction of the average (NEMA definition)
+        <signal>_mean, <signal>_variance, <signal>_min, <signal>_max: rolling statistics of
+            each signal given in windows, which can also be electrical_power or phase_current_rms
+
+    Fields:
+        telemetry (dts_manager.DTS.DTSTelemetry)
+        windows (dict): RollingWindow of each signal with rolling statistics, keyed by signal name
+        phase_window (int): number of samples the phase current RMS is computed over
+        phase_squares (array.array): ring buffer of the squares of the phase a, b and c currents,
+                                     interleaved
+        phase_sums (list(float)): sum of the squares in the window of each phase
+        phase_count (int): number of phase current samples received
+
+    Methods:
+        on_decoded(self, message_id: int, values: list)
+            Updates the signals derived from a decoded message, called by the telemetry
+        reset(self)
+            Clears all windows
+    """
+
+    def __init__(self, telemetry: dts_manager.DTS.DTSTelemetry, windows=None, phase_window=100):
+        """ Registers with the telemetry, so derived signals are updated on every decoded message
+
+        Args:
+            telemetry (dts_manager.DTS.DTSTelemetry)
+            windows (dict): number of samples in the rolling window of each signal, keyed by name,
+                            e.g. {'dc_bus_voltage': 100, 'motor_temperature': 600}
+            phase_window (int): number of samples the phase current RMS is computed over
+        """
+        self.telemetry = telemetry
+        store = telemetry.store
+        self.windows = {name: RollingWindow(size) for name, size in (windows or {}).items()}
+        if phase_window < 1:
+            raise ValueError(f'Error: phase window must be at least 1, not {phase_window}')
+        # Only the mean square of each phase is needed, so the phases are kept in a plain
+        # ring buffer with running sums rather than in RollingWindows
+        self.phase_window = phase_window
+        self.phase_squares = array('d', bytes(8 * 3 * phase_window))
+        self.phase_sums = [0.0, 0.0, 0.0]
+        self.phase_count = 0
+
+        # Store slots of the inputs and outputs
+        self.power_input_slots = store.indices(['dc_bus_voltage', 'dc_bus_current'])
+        self.power_slots = store.indices(dts_manager.DERIVED_SIGNALS[:1])
+        self.phase_slots = store.indices(dts_manager.DERIVED_SIGNALS[1:])
+        self.rolling_slots = {
+            name: store.indices([f'{name}_mean', f'{name}_variance', f'{name}_min', f'{name}_max'])
+            for name in self.windows
+        }
+
+        # Updates needed for the signals of each decoder, built when a message is first decoded
+        self.message_updates = {}
+        telemetry.decode_callbacks.append(self.on_decoded)
+
+    def _compile_updates(self, decoder) -> tuple:
+        """ Returns (updates power, phase current indices, [(value index, window, slots)]) for a decoder"""
+        names = decoder.names
+        updates_power = 'dc_bus_voltage' in names or 'dc_bus_current' in names
+        phases = ('phase_a_current', 'phase_b_current', 'phase_c_current')
+        phase_indices = tuple(names.index(name) for name in phases) \
+            if all(name in names for name in phases) else None
+        rolling = [(names.index(name), window, self.rolling_slots[name])
+                   for name, window in self.windows.items() if name in names]
+        return updates_power, phase_indices, rolling
+
+    def on_decoded(self, message_id: int, values: list) -> None:
+        reading = self.telemetry.messages[message_id]
+        updates = self.message_updates.get(reading.decoder)
+        if updates is None:
+            updates = self.message_updates[reading.decoder] = self._compile_updates(reading.decoder)
+        updates_power, phase_indices, rolling = updates
+        store = self.telemetry.store
+        timestamp = reading.timestamp
+
+        for index, window, slots in rolling:
+            self._roll(window, slots, values[index], timestamp)
+
+        if updates_power:
+            voltage_slot, current_slot = self.power_input_slots
+            power = store.values[voltage_slot] * store.values[current_slot]
+            store.update(self.power_slots, [power], timestamp)
+            if 'electrical_power' in self.windows and power == power:
+                self._roll(self.windows['electrical_power'], self.rolling_slots['electrical_power'],
+                           power, timestamp)
+
+        if phase_indices is not None:
+            squares = self.phase_squares
+            sums = self.phase_sums
+            slot = 3 * (self.phase_count % self.phase_window)
+            self.phase_count += 1
+            samples = self.phase_count if self.phase_count < self.phase_window else self.phase_window
+            for phase in range(3):
+                current = values[phase_indices[phase]]
+                square = current * current
+                total = sums[phase] + square - squares[slot + phase]
+                sums[phase] = total if total > 0 else 0.0
+                squares[slot + phase] = square
+            rms_a = sqrt(sums[0] / samples)
+            rms_b = sqrt(sums[1] / samples)
+            rms_c = sqrt(sums[2] / samples)
+            average = (rms_a + rms_b + rms_c) / 3
+            total_rms = sqrt((sums[0] + sums[1] + sums[2]) / (3 * samples))
+            if average > 0:
+                imbalance = max(abs(rms_a - average), abs(rms_b - average), abs(rms_c - average)) / average
+            else:
+                imbalance = NAN
+            store.update(self.phase_slots, (rms_a, rms_b, rms_c, total_rms, imbalance), timestamp)
+            if 'phase_current_rms' in self.windows:
+                self._roll(self.windows['phase_current_rms'], self.rolling_slots['phase_current_rms'],
+                           total_rms, timestamp)
+
+    def _roll(self, window: RollingWindow, slots: tuple, value: float, timestamp) -> None:
+        window.add(value)
+        variance = window.variance()
+        self.telemetry.store.update(
+            slots, [window.mean, NAN if variance is None else variance, window.minimum, window.maximum],
+            timestamp)
+
+    def reset(self) -> None:
+        for window in self.windows.values():
+            window.reset()
+        for index in range(len(self.phase_squares)):
+            self.phase_squares[index] = 0.0
+        self.phase_sums = [0.0, 0.0, 0.0]
+        self.phase_count = 0
@@ -1,3 +1,5 @@
+import os
+import threading
 import time
 from collections import deque
 from enum import Enum
@@ -5,6 +7,46 @@ from enum import Enum
 import can
 
 from can_manager import can_manager
+from can_manager.signal_store import SignalStore
+
+
+# Default can offset of the inverter messages, can be changed in EEPROM. The message
+# configuration is written for this offset
+DEFAULT_CAN_OFFSET = 160
+# The command message id is the can offset plus COMMAND_OFFSET
+COMMAND_OFFSET = 32
+
+
+# Signals computed by derived_signals.DerivedSignals, preallocated in every telemetry store
+DERIVED_SIGNALS = (
+    'electrical_power', 'phase_a_current_rms', 'phase_b_current_rms', 'phase_c_current_rms',
+    'phase_current_rms', 'phase_current_imbalance',
+)
+
+
+def config_signals(config_file='message_config.json', path=None) -> tuple:
+    """ Returns the names of the signals decoded from a DTS message configuration
+
+    Args:
+        config_file (str): message configuration file name
+        path (str): folder containing the configuration, defaults to the dts_manager package
+
+    Returns:
+        (tuple) list of the names of every signal, and list of the names of the boolean signals
+    """
+    path = os.path.dirname(os.path.abspath(__file__)) if path is None else path
+    names, booleans = [], []
+    for reading in can_manager.load_message_config('dts', config_file, path).values():
+        decoder = reading.decoder
+        if decoder is not None:
+            names.extend(decoder.names)
+            booleans.extend(decoder.names[len(decoder.divisors):])
+    return names, booleans
+
+
+def project_name(can_offset: int) -> str:
+    """ Returns the name the readings of an inverter are read under, 'dts' at the default can offset"""
+    return 'dts' if can_offset == DEFAULT_CAN_OFFSET else f'dts_{can_offset}'
 
 
 class InverterMode(Enum):
@@ -68,17 +110,76 @@ class MotorCommand():
         self.duration = duration
 
 
+class SignalSubscription():
+    """ Subscription to changes of a single telemetry signal
+
+    Fields:
+        name (str): name of the signal
+        callback (callable): called with (name, value) when the signal changes
+        deadband (float): change from the last reported value required to call the callback
+        last_value: value last passed to the callback, None until the first call
+    """
+
+    __slots__ = ('name', 'callback', 'deadband', 'last_value')
+
+    def __init__(self, name: str, callback, deadband=0.0):
+        if deadband < 0:
+            raise ValueError(f'Error: deadband of {name} must not be negative, not {deadband}')
+        self.name = name
+        self.callback = callback
+        self.deadband = deadband
+        self.last_value = None
+
+    def update(self, value) -> bool:
+        """ Calls the callback if value differs from the last reported value by more than the deadband"""
+        last_value = self.last_value
+        if last_value is not None and abs(value - last_value) <= self.deadband:
+            return False
+        self.last_value = value
+        self.callback(self.name, value)
+        return True
+
+
 class DTS():
-    def __init__(self, bus: can_manager.CanManager):
-        self.control = DTS.DTSControl(bus)
-        self.telemetry = DTS.DTSTelemetry(bus)
+    def __init__(self, bus: can_manager.CanManager, channel=None, can_offset=DEFAULT_CAN_OFFSET):
+        """
+        Args:
+            bus (can_manager.CanManager)
+            channel (str): channel the inverter is connected to, defaults to the primary channel
+            can_offset (int): can offset configured on the inverter, several inverters on the same
+                              channel need different offsets
+        """
+        self.can_offset = can_offset
+        self.control = DTS.DTSControl(bus, channel, can_offset)
+        self.telemetry = DTS.DTSTelemetry(bus, channel, can_offset)
         # Add state here if necessary in future
 
+    def read_message_config(self, config_file='message_config.json', path=None, **kwargs) -> None:
+        """ Reads the DTS message configuration for this inverter's can offset
+
+        The readings are offset from the DEFAULT_CAN_OFFSET the configuration is written for, and
+        read under the telemetry's project name, so several inverters can share a channel
+
+        Args:
+            config_file (str): message configuration file name
+            path (str): folder containing the configuration, defaults to the dts_manager package
+            **kwargs: passed on to CanManager.read_message_config, e.g. passthrough_ids
+        """
+        path = os.path.dirname(os.path.abspath(__file__)) if path is None else path
+        self.telemetry.bus.read_message_config('dts', config_file, path, channel=self.telemetry.channel,
+                                               id_offset=self.can_offset - DEFAULT_CAN_OFFSET,
+                                               name=self.telemetry.project, **kwargs)
+        # Signals only defined in a custom configuration
+        names, booleans = config_signals(config_file, path)
+        self.telemetry.store.indices(names, booleans)
+        self.telemetry.subscribed_slots = None
+
     class DTSControl():
         """ Handles control aspects of DTS motor/inverter
 
         Fields:
             bus (can_manager.CanManager): instance of CanManager to communicate with Can bus
+            channel (str): channel of the CanManager the inverter is connected to
             torque_command (int)
             speed_command (int)
             direction_command (int)
@@ -89,8 +190,26 @@ class DTS():
             commanded_torque_limit (int)
             message_offset (int)
             command_id (int)
+            disable_message (can.Message): precomputed command message disabling the inverter,
+                                           with zero torque and speed
+            stop_bus (can.BusABC): bus the disable message is sent on, a dedicated send only socket
+                                   with socketcan, the channel's bus with other interfaces
+            stopped (bool): whether an emergency stop is active, no commands are sent while it is
+            stop_alarm (limits.Alarm): alarm that triggered the active emergency stop, None if none
+            stop_latency (float): time in seconds from the trigger of the last emergency stop to
+                                  the disable message being sent, None if no trigger time was given
+            stop_error (can.CanError): error sending the disable message on the stop bus during the
+                                       last emergency stop, None if it was sent
+            command_data (bytes): payload of the last command message sent
+            command_time (float): time.monotonic() the command payload last changed
+            command_callbacks (list): functions called with (command_time, command_data) whenever
+                                      the command payload changes
 
         Methods:
+            command_message(self, data: bytes) -> can.Message:
+                Builds a command message, every command message is built by it so all use the
+                same (standard, 11 bit) frame format
+
             configure_motor(self, configuration=MotorConfig()) -> None:
                 When given a MotorConfig object, this method reads all the properties,
                 converts them to bytes which can then be sent in the command message
@@ -98,19 +217,72 @@ class DTS():
             send_motor_command(self):
                 Sends motor command over the can bus with the correct message ID to be interpreted
                 by the DTS inverter
+
+            tag_command(self, data: bytes) -> tuple:
+                Records the time the command payload changed, called with command_lock held
+
+            check_not_stopped(self) -> None:
+                Raises an exception if an emergency stop is active, called with command_lock held
+                before sending a command
+
+            notify_command(self, change: tuple) -> None:
+                Calls command_callbacks with a change returned by tag_command, once command_lock
+                is released
+
+            emergency_stop(self, trigger_time=None) -> float:
+                Immediately sends the disable message, and keeps sending it instead of commands
+
+            stop_on_alarm(self, alarm) -> None:
+                Emergency stop triggered by a limits.LimitChecker alarm
+
+            clear_emergency_stop(self) -> None:
+                Allows commands to be sent again after an emergency stop
+
+            shutdown(self) -> None:
+                Closes the dedicated stop bus, if one was opened
         """
 
-        def __init__(self, bus: can_manager.CanManager):
+        def __init__(self, bus: can_manager.CanManager, channel=None, can_offset=DEFAULT_CAN_OFFSET):
             self.bus = bus
+            self.channel = bus.channel if channel is None else channel
 
-            # Default can offset is 160, can be changed in EEPROM
-            self.message_offset = 160
-            self.command_id = self.message_offset + 32
+            # Can offset configured in the inverter EEPROM, 160 by default
+            self.message_offset = can_offset
+            self.command_id = self.message_offset + COMMAND_OFFSET
 
             self.current_command_message = None
             self.start_time = None
             self.commands_finished = False
 
+            # The disable message is built and its socket opened up front, so an emergency stop
+            # is a single send that does not wait behind the periodic command task. Other
+            # interfaces (e.g. virtual, for benchmarks) send on the channel's bus, which is
+            # thread safe
+            self.disable_message = self.command_message(bytes(8))
+            if bus.interface == 'socketcan':
+                self.stop_bus = bus.open_bus(self.channel, receive=False)
+            else:
+                self.stop_bus = bus.buses[self.channel]
+            # Held while a command is being sent, so an emergency stop can overwrite it afterwards
+            self.command_lock = threading.Lock()
+            self.stopped = False
+            self.stop_alarm = None
+            self.stop_latency = None
+            self.stop_error = None
+
+            self.command_data = None
+            self.command_time = None
+            self.command_callbacks = []
+
+        def command_message(self, data) -> can.Message:
+            """ Builds a command message with the given payload
+
+            The inverter's messages use standard (11 bit) ids, so the command does too. The periodic
+            command task is modified in place with every command message, so they must all have
+            the same frame format
+            """
+            return can.Message(arbitration_id=self.command_id, data=data, is_extended_id=False)
+
         def configure_motor(self, configuration=MotorConfig()) -> None:
             """ Configures the motor configuration message"""
             self.torque_command = int(
@@ -136,7 +308,42 @@ class DTS():
             """
             command_list = self.torque_command + self.speed_command + \
                 self.direction_command + self.mode + self.commanded_torque_limit
-            self.bus.send_message(self.command_id, command_list)
+            with self.command_lock:
+                self.check_not_stopped()
+                self.bus.send_can_message(self.command_message(command_list), self.channel)
+                change = self.tag_command(command_list)
+            self.notify_command(change)
+
+        def check_not_stopped(self) -> None:
+            if self.stopped:
+                raise Exception('Error: emergency stop is active, clear it before sending commands')
+
+        def tag_command(self, data):
+            """ Records the time the command payload changed, called with command_lock held whenever
+            a command is sent
+
+            Args:
+                data (bytes): payload of the command message that was sent
+
+            Returns:
+                (tuple) (command_time, command_data) if the payload changed, None otherwise, to be
+                passed to notify_command once command_lock is released
+            """
+            data = bytes(data)
+            if data == self.command_data:
+                return None
+            self.command_data = data
+            self.command_time = time.monotonic()
+            return self.command_time, data
+
+        def notify_command(self, change) -> None:
+            """ Calls command_callbacks with a change returned by tag_command
+
+            Called after command_lock is released, so a callback can send commands itself
+            """
+            if change is not None:
+                for callback in self.command_callbacks:
+                    callback(*change)
 
         def send_motor_command(self, command: float, mode=InverterMode.Torque, duration=None):
             """ Sends a motor command using existing info plus new speed/torque command and mode
@@ -144,32 +351,120 @@ class DTS():
             Uses all existing message configuration except for speed/torque command, and mode.
             Can be used to issue subsequent commands after the motor has been configured intially
 
+            The command message is sent by a single long lived periodic task, and each new
+            command only modifies its data, so the change goes out on the next period without
+            a gap in the command stream. If a duration is given, the current task is stopped
+            and a new one is started that only runs for that duration
+
             Args:
                 command (float): New speed/torque command, depending on the mode
                 mode (InverterMode)
-                duration (float): duration for which the message should be sent
+                duration (float): duration for which the message should be sent, None to send
+                                  until the next command
             """
             speed_command = int(
-                command * 10 if mode == InverterMode.Speed else 0).to_bytes(2, 'little')
-            torque_commmand = (
-                command * 10 if mode == InverterMode.Torque else 0).to_bytes(2, 'little')
+                command * 10 if mode == InverterMode.Speed else 0).to_bytes(2, 'little', signed=True)
+            torque_commmand = int(
+                command * 10 if mode == InverterMode.Torque else 0).to_bytes(2, 'little', signed=True)
             mode = ((int(mode.value) << 2) +
                     (int(self.inverter_discharge) << 1) + (int(self.inverter_enable) << 0)).to_bytes(1, 'little')
             command_list = torque_commmand + speed_command + \
                 self.direction_command + mode + self.commanded_torque_limit
-            message = can.Message(arbitration_id=192, data=command_list)
-            if self.current_command_message is not None:
-                self.current_command_message.stop()
-            self.current_command_message = self.bus.send_message_periodic(message, duration)
+            message = self.command_message(command_list)
+            with self.command_lock:
+                self.check_not_stopped()
+                if duration is None:
+                    self.current_command_message = self.bus.update_periodic_message(message, self.channel)
+                else:
+                    self.bus.stop_periodic_message(self.command_id, self.channel)
+                    self.current_command_message = self.bus.send_message_periodic(message, duration, self.channel)
+                change = self.tag_command(command_list)
+            self.notify_command(change)
+
+        def emergency_stop(self, trigger_time=None):
+            """ Disables the inverter as quickly as possible
+
+            The precomputed disable message (inverter disabled, zero torque and speed) is sent
+            straight away on the dedicated stop bus, without taking any lock, so it can be called
+            from any thread, e.g. the telemetry receiver or a limit alarm callback. The periodic
+            command task is then switched to the disable message, overwriting any command that
+            was being sent at the same time, so the inverter keeps receiving command messages
+            (avoiding a command message lost fault) but stays disabled. Until
+            clear_emergency_stop is called, sending commands raises an exception and
+            send_test_commands finishes. An error sending on the stop bus (e.g. a full transmit
+            buffer) is recorded in stop_error rather than raised, so it does not stop the ingest
+            loop an alarm callback runs in, and the periodic task still sends the disable message
+
+            Args:
+                trigger_time (float): time.time() at which the stop was triggered, e.g. the
+                                      timestamp of the alarm, used to measure stop_latency
+
+            Returns:
+                (float) stop_latency, None if no trigger time was given or the disable message could
+                        not be sent on the stop bus
+            """
+            self.stopped = True
+            try:
+                self.stop_bus.send(self.disable_message, timeout=0.01)
+                self.stop_error = None
+            except can.CanError as error:
+                self.stop_error = error
+            sent_time = time.time()
+            if trigger_time is None or self.stop_error is not None:
+                self.stop_latency = None
+            else:
+                self.stop_latency = sent_time - trigger_time
+            with self.command_lock:
+                self.current_command_message = self.bus.update_periodic_message(self.disable_message, self.channel)
+                change = self.tag_command(self.disable_message.data)
+            self.notify_command(change)
+            return self.stop_latency
+
+        def stop_on_alarm(self, alarm) -> None:
+            """ Emergency stop for limits.LimitChecker.alarm_callbacks, ignored if already stopped
+
+            The LimitChecker calls it again whenever the alarm trips after its condition cleared,
+            so the inverter is stopped again if the same limit is exceeded after a clear
+            """
+            if not self.stopped:
+                self.stop_alarm = alarm
+                self.emergency_stop(alarm.timestamp)
+
+        def clear_emergency_stop(self) -> None:
+            """ Allows commands to be sent again, the disable message is sent until the next command
+
+            Raises:
+                Exception: if the alarm that stopped the inverter is still active, as it would not
+                           trip again to stop the inverter while its condition persists
+            """
+            alarm = self.stop_alarm
+            if alarm is not None and alarm.active:
+                raise Exception(f'Error: {alarm.name} is still beyond its {alarm.kind} limit, '
+                                f'the emergency stop can not be cleared')
+            self.stop_alarm = None
+            self.stopped = False
+
+        def shutdown(self) -> None:
+            # The channel's bus belongs to the CanManager
+            if self.stop_bus is not self.bus.buses[self.channel]:
+                self.stop_bus.shutdown()
 
         def send_test_commands(self, initial_config: MotorConfig=MotorConfig(), commands=None):
             """ Sends all the commands for the test, for the specified durations
 
+            Steps only advance when this is called, so they are stretched by whatever the calling
+            loop does in between. scheduler.StepScheduler runs the same profile in its own thread,
+            on absolute deadlines
+
             Args:
                 initial_config (MotorConfig): MotorConfig object with initial motor configuration
                 commands (List[MotorCommand]): List of motor command objects, which will be executed in order
                                                for the specified duration
             """
+            if self.stopped:
+                self.commands_finished = True
+                return self.commands_finished
+
             # Initial setup branch, only executes the first time the method is ran
             if self.start_time is None:
                 self.configure_motor(initial_config)
@@ -188,7 +483,11 @@ class DTS():
                 if len(self.messages) == 0:
                     self.commands_finished = True
                     try:
-                        self.current_command_message.stop()
+                        # Unless an emergency stop switched the periodic task to the disable
+                        # message, checked under the lock so one can not land in between
+                        with self.command_lock:
+                            if not self.stopped:
+                                self.bus.stop_periodic_message(self.command_id, self.channel)
                     finally:
                         return self.commands_finished
 
@@ -203,19 +502,36 @@ class DTS():
         """ Handles the telemetry and data acquisition from the DTS motor/inverter
 
         Fields:
-            See __init__ for fields, all possible data fields are stored within the class
+            See __init__ for fields, all possible data fields are stored within the class.
+            The decoded signals are kept in a SignalStore (store), and are read through
+            attributes of the same name, e.g. dc_bus_voltage
 
         Methods:
-        Note: each method converts a different set of data, depending on the conversion factor
-            defined in the CAN message format manual for the inverter
-
-            convert_angles(self)
-            convert_booleans(self)
-            convert_currents(self)
-            convert_high_voltages(self)
-            convert_low_voltages(self)
-            convert_torques(self)
-            convert_temperatures(self)
+            decode_message(self, message_id: int) -> bool
+                Decodes a message with the decoder compiled from the message configuration
+            update_data(self)
+                Reads the bus and decodes the received message
+            update_data_batch(self, max_frames=256, timeout_seconds=None) -> int
+                Drains the bus and decodes the latest message of each id
+            update_received(self) -> int
+                Decodes the messages received by the CanManager receiver thread
+            subscribe(self, name: str, callback, deadband=0.0) -> SignalSubscription
+                Calls callback(name, value) whenever a decoded signal changes beyond the deadband
+            unsubscribe(self, subscription: SignalSubscription)
+
+        Note: each update method decodes a different set of messages, using the signal layout and
+            conversion factors defined in message_config.json (from the CAN message format manual
+            for the inverter)
+
+            update_angles(self)
+            update_booleans(self)
+            update_currents(self)
+            update_faults(self)
+            update_high_voltages(self)
+            update_internal_states(self)
+            update_low_voltages(self)
+            update_torques(self)
+            update_temperatures(self)
             Data Getters:
                 get_analog_input_voltages_data(self)
                 get_current_data(self)
@@ -233,62 +549,41 @@ class DTS():
                 get_voltage_data(self)
         """
 
-        def __init__(self, bus: can_manager.CanManager):
-            """ Takes reference to a CanManager instance to be used for receiving can messages"""
+        def __init__(self, bus: can_manager.CanManager, channel=None, can_offset=DEFAULT_CAN_OFFSET):
+            """ Takes reference to a CanManager instance to be used for receiving can messages,
+            the channel the inverter is connected to, defaults to the primary channel, and the
+            can offset configured on the inverter
+            """
             self.bus = bus
-            self.module_a_temperature = None
-            self.module_b_temperature = None
-            self.module_c_temperature = None
-            self.gate_driver_board_temperature = None
-            self.control_board_temperature = None
-            self.rtd_1_temperature = None
-            self.rtd_2_temperature = None
-            self.rtd_3_temperature = None
-            self.rtd_4_temperature = None
-            self.rtd_5_temperature = None
-            self.analog_input_1 = None
-            self.analog_input_2 = None
-            self.analog_input_3 = None
-            self.analog_input_4 = None
-            self.dc_bus_voltage = None
-            self.output_voltage = None
-            self.vab_vd_voltage = None
-            self.vbc_vq_voltage = None
-            self.motor_angle = None
-            self.delta_filter_resolved = None
-            self.one_five_voltage_ref = None
-            self.two_five_voltage_ref = None
-            self.five_voltage_ref = None
-            self.twelve_system_voltage = None
-            self.digital_input_1 = None
-            self.digital_input_2 = None
-            self.digital_input_3 = None
-            self.digital_input_4 = None
-            self.digital_input_5 = None
-            self.digital_input_6 = None
-            self.digital_input_7 = None
-            self.digital_input_8 = None
-            self.id_feedback = None
-            self.iq_feedback = None
-            self.torque_shudder = None
-            self.commanded_torque = None
-
-            # Default can offset is 160, can be changed in EEPROM
-            self.default_can_offset = 160
-            self.temp1_id = self.default_can_offset
-            self.temp2_id = self.default_can_offset + 1
-            self.temp3_id = self.default_can_offset + 2
-            self.analog_inputs_id = self.default_can_offset + 3
-            self.digital_input_status_id = self.default_can_offset + 4
-            self.motor_position_id = self.default_can_offset + 5
-            self.current_info_id = self.default_can_offset + 6
-            self.voltage_info_id = self.default_can_offset + 7
-            self.flux_info_id = self.default_can_offset + 8
-            self.internal_voltages_id = self.default_can_offset + 9
-            self.internal_states_id = self.default_can_offset + 10
-            self.fault_codes_id = self.default_can_offset + 11
-            self.torque_timer_id = self.default_can_offset + 12
-            self.modulation_index_id = self.default_can_offset + 13
+            self.channel = bus.channel if channel is None else channel
+            self.messages = bus.channel_messages[self.channel]
+            # Readings of other projects, or other inverters, read onto the same channel are not decoded
+            self.project = project_name(can_offset)
+            # Latest value and timestamp of every signal, read through the attribute of the same
+            # name (e.g. telemetry.dc_bus_voltage). Every signal of the message configuration,
+            # and every derived signal, is allocated up front, so the store is not resized while
+            # decoding, and can be frozen before it is viewed without copying
+            names, booleans = config_signals()
+            self.store = SignalStore(names + list(DERIVED_SIGNALS), booleans)
+            # Store slots of the signals of each decoder, built when a message is first decoded
+            self.signal_indices = {}
+
+            # Can offset configured in the inverter EEPROM, 160 by default
+            self.can_offset = can_offset
+            self.temp1_id = self.can_offset
+            self.temp2_id = self.can_offset + 1
+            self.temp3_id = self.can_offset + 2
+            self.analog_inputs_id = self.can_offset + 3
+            self.digital_input_status_id = self.can_offset + 4
+            self.motor_position_id = self.can_offset + 5
+            self.current_info_id = self.can_offset + 6
+            self.voltage_info_id = self.can_offset + 7
+            self.flux_info_id = self.can_offset + 8
+            self.internal_voltages_id = self.can_offset + 9
+            self.internal_states_id = self.can_offset + 10
+            self.fault_codes_id = self.can_offset + 11
+            self.torque_timer_id = self.can_offset + 12
+            self.modulation_index_id = self.can_offset + 13
 
             # Sets of related ids for quick lookups
             self.temp_ids = set([self.temp1_id, self.temp2_id, self.temp3_id])
@@ -296,233 +591,295 @@ class DTS():
             self.current_ids = set([self.current_info_id, self.flux_info_id, self.modulation_index_id])
             self.torque_ids = set([self.motor_position_id, self.torque_timer_id])
 
+            # Number of messages of each id already decoded by update_received
+            self.received_counts = {}
+
+            # Subscriptions of each signal, and the (index, subscriptions) of every subscribed
+            # signal of each message id, built when the message is first decoded
+            self.subscriptions = {}
+            self.subscribed_fields = {}
+            # (store slot, subscriptions) of the subscribed signals no message decodes, i.e.
+            # derived signals, checked after the decode callbacks. None until rebuilt
+            self.subscribed_slots = None
+            # Functions called with (message_id, values) after every decoded message, e.g.
+            # DerivedSignals.on_decoded
+            self.decode_callbacks = []
+
+        def __getattr__(self, name: str):
+            """ Returns the latest value of a signal in the store, None if not decoded yet"""
+            store = self.__dict__.get('store')
+            if store is None or name not in store:
+                raise AttributeError(f"'DTSTelemetry' object has no attribute '{name}'")
+            return store.get(name)
+
+        def __setattr__(self, name: str, value) -> None:
+            store = self.__dict__.get('store')
+            if store is not None and name in store:
+                store.set(name, value)
+            else:
+                object.__setattr__(self, name, value)
+
         def get_conversion_factor(self, message_id: int):
-            return self.bus.messages[message_id].conversion_factor
+            return self.messages[message_id].conversion_factor
 
         def get_temp1_data(self, start=0, stop=8):
-            if self.bus.messages[self.temp1_id].data:
-                return self.bus.messages[self.temp1_id].data[start:stop]
+            if self.messages[self.temp1_id].data:
+                return self.messages[self.temp1_id].data[start:stop]
             else:
                 return None
 
         def get_temp2_data(self, start=0, stop=8):
-            if self.bus.messages[self.temp2_id].data:
-                return self.bus.messages[self.temp2_id].data[start:stop]
+            if self.messages[self.temp2_id].data:
+                return self.messages[self.temp2_id].data[start:stop]
             else:
                 return None
 
         def get_temp3_data(self, start=0, stop=8):
-            if self.bus.messages[self.temp3_id].data:
-                return self.bus.messages[self.temp3_id].data[start:stop]
+            if self.messages[self.temp3_id].data:
+                return self.messages[self.temp3_id].data[start:stop]
             else:
                 return None
 
         def get_analog_input_voltages_data(self, start=0, stop=8):
-            if self.bus.messages[self.analog_inputs_id].data:
-                return self.bus.messages[self.analog_inputs_id].data[start:stop]
+            if self.messages[self.analog_inputs_id].data:
+                return self.messages[self.analog_inputs_id].data[start:stop]
             else:
                 return None
 
         def get_digital_input_status_data(self, start=0, stop=8):
-            if self.bus.messages[self.digital_input_status_id].data:
-                return self.bus.messages[self.digital_input_status_id].data[start:stop]
+            if self.messages[self.digital_input_status_id].data:
+                return self.messages[self.digital_input_status_id].data[start:stop]
             else:
                 return None
 
         def get_motor_position_data(self, start=0, stop=8):
-            if self.bus.messages[self.motor_position_id].data:
-                return self.bus.messages[self.motor_position_id].data[start:stop]
+            if self.messages[self.motor_position_id].data:
+                return self.messages[self.motor_position_id].data[start:stop]
             else:
                 return None
 
         def get_current_data(self, start=0, stop=8):
-            if self.bus.messages[self.current_info_id].data:
-                return self.bus.messages[self.current_info_id].data[start:stop]
+            if self.messages[self.current_info_id].data:
+                return self.messages[self.current_info_id].data[start:stop]
             else:
                 return None
 
         def get_voltage_data(self, start=0, stop=8):
-            if self.bus.messages[self.voltage_info_id].data:
-                return self.bus.messages[self.voltage_info_id].data[start:stop]
+            if self.messages[self.voltage_info_id].data:
+                return self.messages[self.voltage_info_id].data[start:stop]
             else:
                 return None
 
         def get_flux_data(self, start=0, stop=8):
-            if self.bus.messages[self.flux_info_id].data:
-                return self.bus.messages[self.flux_info_id].data[start:stop]
+            if self.messages[self.flux_info_id].data:
+                return self.messages[self.flux_info_id].data[start:stop]
             else:
                 return None
 
         def get_internal_voltages_data(self, start=0, stop=8):
-            if self.bus.messages[self.internal_voltages_id].data:
-                return self.bus.messages[self.internal_voltages_id].data[start:stop]
+            if self.messages[self.internal_voltages_id].data:
+                return self.messages[self.internal_voltages_id].data[start:stop]
             else:
                 return None
 
         def get_internal_states_data(self, start=0, stop=8):
-            if self.bus.messages[self.internal_states_id].data:
-                return self.bus.messages[self.internal_states_id].data[start:stop]
+            if self.messages[self.internal_states_id].data:
+                return self.messages[self.internal_states_id].data[start:stop]
             else:
                 return None
 
         def get_faults_data(self, start=0, stop=8):
-            if self.bus.messages[self.fault_codes_id].data:
-                return self.bus.messages[self.fault_codes_id].data[start:stop]
+            if self.messages[self.fault_codes_id].data:
+                return self.messages[self.fault_codes_id].data[start:stop]
             else:
                 return None
 
         def get_torque_timer_data(self, start=0, stop=8):
-            if self.bus.messages[self.torque_timer_id].data:
-                return self.bus.messages[self.torque_timer_id].data[start:stop]
+            if self.messages[self.torque_timer_id].data:
+                return self.messages[self.torque_timer_id].data[start:stop]
             else:
                 return None
 
         def get_modulation_index_data(self, start=0, stop=8):
-            if self.bus.messages[self.modulation_index_id].data:
-                return self.bus.messages[self.modulation_index_id].data[start:stop]
+            if self.messages[self.modulation_index_id].data:
+                return self.messages[self.modulation_index_id].data[start:stop]
             else:
                 return None
 
+        def decode_message(self, message_id: int) -> bool:
+            """ Decodes the latest data of a message into the telemetry fields
+
+            Uses the decoder compiled from the message configuration, so every signal in the
+            message is converted with a single unpack. Can be registered as the handler of the
+            dts project with CanManager.register_handler
+
+            Returns:
+                (bool) True if the message had data and was decoded
+            """
+            reading = self.messages[message_id]
+            if reading.decoder is None or not reading.data or reading.project != self.project:
+                return False
+            decoder = reading.decoder
+            values = decoder.decode(reading.data)
+            if values is None:
+                return False
+            indices = self.signal_indices.get(decoder)
+            if indices is None:
+                indices = self.signal_indices[decoder] = self.store.indices(
+                    decoder.names, decoder.names[len(decoder.divisors):])
+            self.store.update(indices, values, reading.timestamp)
+            if self.subscriptions:
+                fields = self.subscribed_fields.get(message_id)
+                if fields is None:
+                    fields = self.subscribed_fields[message_id] = tuple(
+                        (index, self.subscriptions[name])
+                        for index, name in enumerate(decoder.names) if name in self.subscriptions)
+                for index, subscriptions in fields:
+                    for subscription in subscriptions:
+                        subscription.update(values[index])
+            for callback in self.decode_callbacks:
+                callback(message_id, values)
+            if self.subscriptions:
+                slots = self.subscribed_slots
+                if slots is None:
+                    slots = self.subscribed_slots = self._subscribed_slots()
+                store_values = self.store.values
+                for slot, subscriptions in slots:
+                    value = store_values[slot]
+                    if value == value:
+                        for subscription in subscriptions:
+                            subscription.update(value)
+            return True
+
+        def _subscribed_slots(self) -> tuple:
+            decoded = set()
+            for reading in self.messages.values():
+                if reading.decoder is not None:
+                    decoded.update(reading.decoder.names)
+            return tuple((self.store.index[name], subscriptions)
+                         for name, subscriptions in self.subscriptions.items() if name not in decoded)
+
+        def subscribe(self, name: str, callback, deadband=0.0) -> SignalSubscription:
+            """ Subscribes to changes of a decoded signal
+
+            The callback is called with (name, value) when the signal is first decoded, and then
+            only when it has changed by more than deadband since the value last reported, so
+            slowly drifting signals are still reported once the drift exceeds the deadband.
+            Boolean signals are reported on every change with a deadband of 0. Derived signals
+            (see derived_signals.DerivedSignals) are checked after every decoded message
+
+            Args:
+                name (str): name of the signal, as in the message configuration, or of a derived signal
+                callback (callable): called with (name, value)
+                deadband (float): change required to report a new value, in the signal's units
+
+            Returns:
+                (SignalSubscription) subscription, used to unsubscribe
+
+            Raises:
+                ValueError: if the signal is not decoded or derived by the telemetry
+            """
+            if name not in self.store:
+                raise ValueError(f'Error: {name} is not a decoded or derived signal of {self.project}')
+            subscription = SignalSubscription(name, callback, deadband)
+            self.subscriptions.setdefault(name, []).append(subscription)
+            self.subscribed_fields.clear()
+            self.subscribed_slots = None
+            return subscription
+
+        def unsubscribe(self, subscription: SignalSubscription) -> None:
+            subscriptions = self.subscriptions.get(subscription.name, [])
+            if subscription in subscriptions:
+                subscriptions.remove(subscription)
+                if not subscriptions:
+                    del self.subscriptions[subscription.name]
+                self.subscribed_fields.clear()
+                self.subscribed_slots = None
+
         def update_temperatures(self) -> None:
-            if self.get_temp1_data():
-                self.module_a_temperature = int.from_bytes(
-                    self.get_temp1_data(0, 2), byteorder='little', signed=True) / self.get_conversion_factor(self.temp1_id)
-                self.module_b_temperature = int.from_bytes(
-                    self.get_temp1_data(2, 4), byteorder='little', signed=True) / self.get_conversion_factor(self.temp1_id)
-                self.module_c_temperature = int.from_bytes(
-                    self.get_temp1_data(4, 6), byteorder='little', signed=True) / self.get_conversion_factor(self.temp1_id)
-                self.gate_driver_board_temperature = int.from_bytes(
-                    self.get_temp1_data(6, 8), byteorder='little', signed=True) / self.get_conversion_factor(self.temp1_id)
-            if self.get_temp2_data():
-                self.control_board_temperature = int.from_bytes(
-                    self.get_temp2_data(0, 2), byteorder='little', signed=True) / self.get_conversion_factor(self.temp2_id)
-                self.rtd_1_temperature = int.from_bytes(
-                    self.get_temp2_data(2, 4), byteorder='little', signed=True) / self.get_conversion_factor(self.temp2_id)
-                self.rtd_2_temperature = int.from_bytes(
-                    self.get_temp2_data(4, 6), byteorder='little', signed=True) / self.get_conversion_factor(self.temp2_id)
-                self.rtd_3_temperature = int.from_bytes(
-                    self.get_temp2_data(6, 8), byteorder='little', signed=True) / self.get_conversion_factor(self.temp2_id)
-            if self.get_temp3_data():
-                self.rtd_4_temperature = int.from_bytes(
-                    self.get_temp3_data(0, 2), byteorder='little', signed=True) / self.get_conversion_factor(self.temp3_id)['temp']
-                self.rtd_5_temperature = int.from_bytes(
-                    self.get_temp3_data(2, 4), byteorder='little', signed=True) / self.get_conversion_factor(self.temp3_id)['temp']
-                self.motor_temperature = int.from_bytes(
-                    self.get_temp3_data(4, 6), byteorder='little', signed=True) / self.get_conversion_factor(self.temp3_id)['temp']
+            self.decode_message(self.temp1_id)
+            self.decode_message(self.temp2_id)
+            self.decode_message(self.temp3_id)
 
         def update_low_voltages(self) -> None:
-            if self.get_analog_input_voltages_data():
-                self.analog_input_1 = int.from_bytes(
-                    self.get_analog_input_voltages_data(0, 2), byteorder='little', signed=True) / self.get_conversion_factor(self.analog_inputs_id)
-                self.analog_input_2 = int.from_bytes(
-                    self.get_analog_input_voltages_data(2, 4), byteorder='little', signed=True) / self.get_conversion_factor(self.analog_inputs_id)
-                self.analog_input_3 = int.from_bytes(
-                    self.get_analog_input_voltages_data(4, 6), byteorder='little', signed=True) / self.get_conversion_factor(self.analog_inputs_id)
-                self.analog_input_4 = int.from_bytes(
-                    self.get_analog_input_voltages_data(6, 8), byteorder='little', signed=True) / self.get_conversion_factor(self.analog_inputs_id)
-            if self.get_internal_voltages_data():
-                self.one_five_voltage_ref = int.from_bytes(
-                    self.get_internal_voltages_data(0, 2), byteorder='little', signed=True) / self.get_conversion_factor(self.internal_voltages_id)
-                self.two_five_voltage_ref = int.from_bytes(
-                    self.get_internal_voltages_data(2, 4), byteorder='little', signed=True) / self.get_conversion_factor(self.internal_voltages_id)
-                self.five_voltage_ref = int.from_bytes(
-                    self.get_internal_voltages_data(4, 6), byteorder='little', signed=True) / self.get_conversion_factor(self.internal_voltages_id)
-                self.twelve_system_voltage = int.from_bytes(
-                    self.get_internal_voltages_data(6, 8), byteorder='little', signed=True) / self.get_conversion_factor(self.internal_voltages_id)
+            self.decode_message(self.analog_inputs_id)
+            self.decode_message(self.internal_voltages_id)
 
         def update_high_voltages(self) -> None:
-            if self.get_voltage_data():
-                self.dc_bus_voltage = int.from_bytes(
-                    self.get_voltage_data(0, 2), byteorder='little', signed=True) / self.get_conversion_factor(self.voltage_info_id)
-                self.output_voltage = int.from_bytes(
-                    self.get_voltage_data(2, 4), byteorder='little', signed=True) / self.get_conversion_factor(self.voltage_info_id)
-                self.vab_vd_voltage = int.from_bytes(
-                    self.get_voltage_data(4, 6), byteorder='little', signed=True) / self.get_conversion_factor(self.voltage_info_id)
-                self.vbc_vq_voltage = int.from_bytes(
-                    self.get_voltage_data(6, 8), byteorder='little', signed=True) / self.get_conversion_factor(self.voltage_info_id)
+            self.decode_message(self.voltage_info_id)
 
         def update_currents(self) -> None:
-            if self.get_current_data():
-                self.phase_a_current = int.from_bytes(
-                    self.get_current_data(0, 2), byteorder='little', signed=True) / self.get_conversion_factor(self.current_info_id)
-                self.phase_b_current = int.from_bytes(
-                    self.get_current_data(2, 4), byteorder='little', signed=True) / self.get_conversion_factor(self.current_info_id)
-                self.phase_c_current = int.from_bytes(
-                    self.get_current_data(4, 6), byteorder='little', signed=True) / self.get_conversion_factor(self.current_info_id)
-                self.dc_bus_current = int.from_bytes(
-                    self.get_current_data(6, 8), byteorder='little', signed=True) / self.get_conversion_factor(self.current_info_id)
-            if self.get_flux_data():
-                self.id_feedback = int.from_bytes(
-                    self.get_flux_data(4, 6), byteorder='little', signed=True) / self.get_conversion_factor(self.flux_info_id)['current']
-                self.iq_feedback = int.from_bytes(
-                    self.get_flux_data(6, 8), byteorder='little', signed=True) / self.get_conversion_factor(self.flux_info_id)['current']
+            self.decode_message(self.current_info_id)
+            self.decode_message(self.flux_info_id)
 
         def update_angles(self) -> None:
-            if self.get_motor_position_data():
-                self.motor_angle = int.from_bytes(
-                    self.get_motor_position_data(0, 2), byteorder='little', signed=True) / self.get_conversion_factor(self.motor_position_id)['angle']
-                self.delta_filter_resolved = int.from_bytes(
-                    self.get_motor_position_data(6, 8), byteorder='little', signed=True) / self.get_conversion_factor(self.motor_position_id)['angle']
+            self.decode_message(self.motor_position_id)
 
         def update_booleans(self) -> None:
-            BIT_0 = 1 << 0
-            BIT_1 = 1 << 1
-            BIT_2 = 1 << 2
-            BIT_3 = 1 << 3
-            BIT_4 = 1 << 4
-            BIT_5 = 1 << 5
-            BIT_6 = 1 << 6
-            BIT_7 = 1 << 7
-            if self.get_digital_input_status_data():
-                digital_input_status = int.from_bytes(
-                    self.get_digital_input_status_data(), byteorder='little', signed=False)
-                self.digital_input_1 = bool(digital_input_status & BIT_0)
-                self.digital_input_2 = bool(digital_input_status & BIT_1)
-                self.digital_input_3 = bool(digital_input_status & BIT_2)
-                self.digital_input_4 = bool(digital_input_status & BIT_3)
-                self.digital_input_5 = bool(digital_input_status & BIT_4)
-                self.digital_input_6 = bool(digital_input_status & BIT_5)
-                self.digital_input_7 = bool(digital_input_status & BIT_6)
-                self.digital_input_8 = bool(digital_input_status & BIT_7)
+            self.decode_message(self.digital_input_status_id)
+
+        def update_internal_states(self) -> None:
+            self.decode_message(self.internal_states_id)
+
+        def update_faults(self) -> None:
+            self.decode_message(self.fault_codes_id)
 
         def update_torques(self) -> None:
-            if self.get_temp3_data():
-                self.torque_shudder = int.from_bytes(
-                    self.get_temp3_data(6, 8), byteorder='little', signed=True) / self.get_conversion_factor(self.temp3_id)['torque']
-            if self.get_torque_timer_data():
-                self.commanded_torque = int.from_bytes(
-                    self.get_torque_timer_data(0, 2), byteorder='little', signed=True) / self.get_conversion_factor(self.torque_timer_id)
-                self.torque_feedback = int.from_bytes(
-                    self.get_torque_timer_data(2, 4), byteorder='little', signed=True) / self.get_conversion_factor(self.torque_timer_id)
+            self.decode_message(self.temp3_id)
+            self.decode_message(self.torque_timer_id)
 
         def update_data(self):
-            """ Calls the update methods as necessary
+            """ Reads the can bus for the current message and decodes it
 
             Reads the can bus for the current message, assigns the message to the correct
-            sensor reading object, and calls the respective update methods to update data
-            fields based on the data type stored in the message
+            sensor reading object, and decodes the signals of that message into the
+            respective data fields
             """
             current_message = self.bus.read_bus()
-            self.bus.assign_message_data(current_message)
+            channel = self.bus.assign_message_data(current_message)
             message_id = current_message.arbitration_id
-            if message_id in self.temp_ids:
-                self.update_temperatures()
-                self.update_torques()
-            elif message_id in self.low_voltage_ids:
-                self.update_low_voltages()
-            elif message_id == self.digital_input_status_id:
-                self.update_booleans()
-            elif message_id in self.current_ids:
-                self.update_currents()
-            elif message_id == self.voltage_info_id:
-                self.update_high_voltages()
-            elif message_id in self.current_ids:
-                self.update_torques()
-                self.update_angles()
+            if message_id in self.messages and channel == self.channel:
+                self.decode_message(message_id)
+
+        def update_data_batch(self, max_frames=256, timeout_seconds=None) -> int:
+            """ Drains all pending messages from the can bus and decodes them
+
+            Each message id is decoded only once per batch, using the latest message
+            received with that id
+
+            Args:
+                max_frames (int): maximum number of messages to read in one batch
+                timeout_seconds (float): time to wait for the first message, None to block
+
+            Returns:
+                (int) number of messages read from the bus
+            """
+            batch = self.bus.read_batch(max_frames, timeout_seconds)
+            for message_id in self.bus.assign_batch(batch, self.channel):
+                self.decode_message(message_id)
+            return len(batch)
+
+        def update_received(self) -> int:
+            """ Decodes the messages received by the CanManager receiver thread
+
+            Used instead of update_data when CanManager.start_receiver is running. Only
+            messages that were received since the last call are decoded, using their
+            latest data
+
+            Returns:
+                (int) number of messages decoded
+            """
+            decoded = 0
+            for message_id, reading in self.messages.items():
+                count = reading.count
+                if count != self.received_counts.get(message_id, 0):
+                    self.received_counts[message_id] = count
+                    decoded += self.decode_message(message_id)
+            return decoded
 
 
 if __name__ == "__main__":
-    import random
+    from dts_manager.scheduler import StepScheduler
     message_frequency = 0.2
     bus = can_manager.CanManager('vcan0', message_frequency)
     dts = DTS(bus)
@@ -533,14 +890,20 @@ if __name__ == "__main__":
 
     motorCommands = [MotorCommand(300, 5), MotorCommand(400, 5), MotorCommand(500, 5), MotorCommand(400, 5), MotorCommand(100, 5)]
 
-    while True:
-        dts.control.send_test_commands(motorConfiguration, motorCommands)
+    # Only print signals when they change
+    def print_signal(name, value):
+        print('{}: {}'.format(name, value))
+
+    for signal in ['analog_input_1', 'analog_input_2', 'analog_input_3', 'analog_input_4']:
+        dts.telemetry.subscribe(signal, print_signal, deadband=0.05)
+    dts.telemetry.subscribe('commanded_torque', print_signal, deadband=0.5)
+
+    # The profile runs on its own thread, so the steps are not stretched by decoding and printing
+    scheduler = StepScheduler(dts.control, motorConfiguration, motorCommands)
+    scheduler.start()
+
+    while not scheduler.finished.is_set():
         dts.telemetry.update_data()
-        print('Analog Input 1: {}'.format(dts.telemetry.analog_input_1))
-        print('Analog Input 2: {}'.format(dts.telemetry.analog_input_2))
-        print('Analog Input 3: {}'.format(dts.telemetry.analog_input_3))
-        print('Analog Input 4: {}'.format(dts.telemetry.analog_input_4))
-        print('Commanded Torque: {}'.format(dts.telemetry.commanded_torque))
         print('Control Board Temperature: {}'.format(dts.telemetry.control_board_temperature))
         print('DC Bus Voltage: {}'.format(dts.telemetry.dc_bus_voltage))
         print('Delta Filter Resolved: {}'.format(dts.telemetry.delta_filter_resolved))
@@ -564,3 +927,5 @@ if __name__ == "__main__":
         print('Vab Vd Voltage: {}'.format(dts.telemetry.vab_vd_voltage))
         print('Vbc Vq Voltage: {}\n'.format(dts.telemetry.vbc_vq_voltage))
 
+
+    print('Step transitions: {}'.format(scheduler.summary()))
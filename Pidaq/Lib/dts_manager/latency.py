@@ -0,0 +1,207 @@
+import statistics
+import struct
+import threading
+import time
+
+from dts_manager import dts_manager
+
+COMMANDS = struct.Struct('<hh')
+COMMAND_SCALE = 10
+SPEED_MODE_BIT = 1 << 2
+NAN = float('nan')
+
+
+class CommandResponse():
+    """ Response of the inverter to one change of the torque/speed setpoint
+
+    All times are in seconds from the command payload changing, None if not reached (yet)
+
+    Fields:
+        time (float): time.monotonic() the command payload changed
+        mode (dts_manager.InverterMode): mode of the command
+        setpoint (float): commanded torque (Nm) or speed (rpm)
+        initial (float): feedback (torque_feedback or motor_speed) when the command was sent
+        acceptance (float): time until the inverter acknowledged the setpoint. In torque mode,
+                            commanded_torque reaching the setpoint, in speed mode, commanded_torque
+                            moving as the speed loop reacts
+        rise_time (float): time the feedback took to go from 10% to 90% of the step
+        settling_time (float): time until the feedback entered the settling band for good
+        overshoot (float): largest excursion of the feedback beyond the setpoint, as a fraction
+                           of the step
+        superseded (bool): whether another command was sent before the response settled
+    """
+
+    __slots__ = ('time', 'mode', 'setpoint', 'initial', 'initial_commanded', 'acceptance', 'rise_time',
+                 'settling_time', 'overshoot', 'superseded', 'rise_start', 'band_entry')
+
+    def __init__(self, command_time: float, mode: dts_manager.InverterMode, setpoint: float, initial: float,
+                 initial_commanded: float):
+        self.time = command_time
+        self.mode = mode
+        self.setpoint = setpoint
+        self.initial = initial
+        self.initial_commanded = initial_commanded
+        self.acceptance = None
+        self.rise_time = None
+        self.settling_time = None
+        self.overshoot = 0.0
+        self.superseded = False
+        self.rise_start = None
+        self.band_entry = None
+
+    def __repr__(self) -> str:
+        return (f'CommandResponse({self.mode.name} {self.initial} -> {self.setpoint}, acceptance={self.acceptance}, '
+                f'rise_time={self.rise_time}, settling_time={self.settling_time})')
+
+
+class CommandLatency():
+    """ Measures how quickly the inverter accepts and tracks each new setpoint
+
+    Every change of the command payload is tagged with time.monotonic() by DTSControl, and
+    starts a new CommandResponse when the setpoint changes. The response is then followed in
+    the decoded telemetry: commanded_torque for acceptance, and torque_feedback (torque mode)
+    or motor_speed (speed mode) for the rise and settling times. Telemetry timestamps are
+    converted to time.monotonic() with the offset between the clocks when the monitor was
+    created, so the measurements do not include the time taken to read and decode messages
+
+        latency = CommandLatency(dts.control, dts.telemetry)
+        scheduler = StepScheduler(dts.control, motorConfiguration, motorCommands)
+        ...
+        print(latency.summary())
+
+    Fields:
+        control (dts_manager.DTS.DTSControl)
+        telemetry (dts_manager.DTS.DTSTelemetry)
+        tolerance (float): absolute tolerance in Nm or rpm, for acceptance and the settling band
+        settling_band (float): settling band around the setpoint, as a fraction of the step
+        settling_hold (float): time in seconds the feedback must stay in the band to be settled
+        responses (list(CommandResponse)): response to every setpoint change, oldest first
+
+    Methods:
+        on_command(self, command_time: float, data: bytes)
+            Starts following the response to a new command, called by the control
+        on_decoded(self, message_id: int, values: list)
+            Follows the response in a decoded message, called by the telemetry
+        summary(self) -> dict
+            Returns statistics of the acceptance latency, rise time and settling time
+    """
+
+    def __init__(self, control: dts_manager.DTS.DTSControl, telemetry: dts_manager.DTS.DTSTelemetry,
+                 tolerance=0.5, settling_band=0.05, settling_hold=0.1):
+        """ Registers with the control and telemetry
+
+        Args:
+            control (dts_manager.DTS.DTSControl)
+            telemetry (dts_manager.DTS.DTSTelemetry)
+            tolerance (float): absolute tolerance in Nm or rpm, for acceptance and the settling band
+            settling_band (float): settling band around the setpoint, as a fraction of the step
+            settling_hold (float): time in seconds the feedback must stay in the band to be settled
+        """
+        self.control = control
+        self.telemetry = telemetry
+        self.tolerance = tolerance
+        self.settling_band = settling_band
+        self.settling_hold = settling_hold
+        self.responses = []
+        self.current = None
+        # Commands are sent from other threads (e.g. a StepScheduler) than the one decoding
+        self.lock = threading.Lock()
+        self.clock_offset = time.monotonic() - time.time()
+        # (commanded_torque, torque_feedback, motor_speed) value indices of each decoder, built
+        # when a message is first decoded
+        self.message_signals = {}
+        control.command_callbacks.append(self.on_command)
+        telemetry.decode_callbacks.append(self.on_decoded)
+
+    def on_command(self, command_time: float, data: bytes) -> None:
+        torque, speed = COMMANDS.unpack_from(data)
+        speed_mode = data[5] & SPEED_MODE_BIT
+        mode = dts_manager.InverterMode.Speed if speed_mode else dts_manager.InverterMode.Torque
+        setpoint = (speed if speed_mode else torque) / COMMAND_SCALE
+        with self.lock:
+            current = self.current
+            if current is not None and current.mode == mode and current.setpoint == setpoint:
+                return
+            feedback = self.telemetry.store.get('motor_speed' if speed_mode else 'torque_feedback')
+            commanded = self.telemetry.store.get('commanded_torque')
+            if current is not None and current.settling_time is None:
+                current.superseded = True
+            self.current = CommandResponse(command_time, mode, setpoint,
+                                           setpoint if feedback is None else feedback,
+                                           NAN if commanded is None else commanded)
+            self.responses.append(self.current)
+
+    def _compile_signals(self, decoder) -> tuple:
+        names = decoder.names
+        return tuple(names.index(name) if name in names else None
+                     for name in ('commanded_torque', 'torque_feedback', 'motor_speed'))
+
+    def on_decoded(self, message_id: int, values: list) -> None:
+        response = self.current
+        if response is None:
+            return
+        reading = self.telemetry.messages[message_id]
+        signals = self.message_signals.get(reading.decoder)
+        if signals is None:
+            signals = self.message_signals[reading.decoder] = self._compile_signals(reading.decoder)
+        commanded_index, torque_index, speed_index = signals
+        if commanded_index is None and torque_index is None and speed_index is None:
+            return
+        timestamp = reading.timestamp
+        timestamp = time.monotonic() if timestamp is None else timestamp + self.clock_offset
+        with self.lock:
+            response = self.current
+            elapsed = timestamp - response.time
+            if elapsed < 0:
+                return
+            speed_mode = response.mode == dts_manager.InverterMode.Speed
+            if commanded_index is not None and response.acceptance is None:
+                commanded = values[commanded_index]
+                if speed_mode:
+                    accepted = abs(commanded - response.initial_commanded) > self.tolerance
+                else:
+                    accepted = abs(commanded - response.setpoint) <= self.tolerance
+                if accepted:
+                    response.acceptance = elapsed
+            feedback_index = speed_index if speed_mode else torque_index
+            if feedback_index is not None:
+                self._track(response, values[feedback_index], elapsed)
+
+    def _track(self, response: CommandResponse, feedback: float, elapsed: float) -> None:
+        step = response.setpoint - response.initial
+        if step != 0:
+            progress = (feedback - response.initial) / step
+            if progress - 1 > response.overshoot:
+                response.overshoot = progress - 1
+            if response.rise_start is None and progress >= 0.1:
+                response.rise_start = elapsed
+            if response.rise_time is None and response.rise_start is not None and progress >= 0.9:
+                response.rise_time = elapsed - response.rise_start
+        if response.settling_time is not None:
+            return
+        band = max(self.settling_band * abs(step), self.tolerance)
+        if abs(feedback - response.setpoint) <= band:
+            if response.band_entry is None:
+                response.band_entry = elapsed
+            if elapsed - response.band_entry >= self.settling_hold:
+                response.settling_time = response.band_entry
+        else:
+            response.band_entry = None
+
+    def summary(self) -> dict:
+        """ Returns statistics of the responses measured so far
+
+        Returns:
+            (dict) number of responses, and the count, mean and maximum in seconds of the
+            acceptance latency, rise time and settling time, over the responses that reached them
+        """
+        summary = {'responses': len(self.responses)}
+        for field in ('acceptance', 'rise_time', 'settling_time'):
+            measured = [getattr(response, field) for response in self.responses
+                        if getattr(response, field) is not None]
+            summary[field] = {
+                'count': len(measured),
+                'mean': statistics.mean(measured) if measured else None,
+                'max': max(measured) if measured else None,
+            }
+        return summary
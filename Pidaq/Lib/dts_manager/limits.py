@@ -0,0 +1,285 @@
+import time
+from array import array
+
+from dts_manager import dts_manager
+
+INF = float('inf')
+
+# Names of the bits of each fault word of the fault codes message (171), from the CAN
+# message format manual for the inverter. Reserved bits are None
+FAULT_WORDS = {
+    'post_fault_lo': (
+        'hardware_gate_desaturation_fault', 'hardware_over_current_fault', 'accelerator_shorted',
+        'accelerator_open', 'current_sensor_low', 'current_sensor_high', 'module_temperature_low',
+        'module_temperature_high', 'control_pcb_temperature_low', 'control_pcb_temperature_high',
+        'gate_drive_pcb_temperature_low', 'gate_drive_pcb_temperature_high', 'five_volt_sense_voltage_low',
+        'five_volt_sense_voltage_high', 'twelve_volt_sense_voltage_low', 'twelve_volt_sense_voltage_high',
+    ),
+    'post_fault_hi': (
+        'two_five_volt_sense_voltage_low', 'two_five_volt_sense_voltage_high', 'one_five_volt_sense_voltage_low',
+        'one_five_volt_sense_voltage_high', 'dc_bus_voltage_high', 'dc_bus_voltage_low', 'precharge_timeout',
+        'precharge_voltage_failure', 'eeprom_checksum_invalid', 'eeprom_data_out_of_range',
+        'eeprom_update_required', None, None, None, 'brake_shorted', 'brake_open',
+    ),
+    'run_fault_lo': (
+        'motor_over_speed_fault', 'over_current_fault', 'over_voltage_fault', 'inverter_over_temperature_fault',
+        'accelerator_input_shorted_fault', 'accelerator_input_open_fault', 'direction_command_fault',
+        'inverter_response_timeout_fault', 'hardware_gate_desaturation_fault', 'hardware_over_current_fault',
+        'under_voltage_fault', 'can_command_message_lost_fault', 'motor_over_temperature_fault',
+        None, None, None,
+    ),
+    'run_fault_hi': (
+        'brake_input_shorted_fault', 'brake_input_open_fault', 'module_a_over_temperature_fault',
+        'module_b_over_temperature_fault', 'module_c_over_temperature_fault', 'pcb_over_temperature_fault',
+        'gate_drive_board_1_over_temperature_fault', 'gate_drive_board_2_over_temperature_fault',
+        'gate_drive_board_3_over_temperature_fault', 'current_sensor_fault', None, None, None, None, None,
+        'resolver_not_connected',
+    ),
+}
+
+
+class Alarm():
+    """ Latched alarm raised by a LimitChecker
+
+    An alarm stays latched after its condition clears, until it is reset
+
+    Fields:
+        name (str): name of the signal, or of the fault for fault alarms
+        kind (str): 'min', 'max', 'rate' or 'fault'
+        value (float): value that raised the alarm (or last tripped it again), the rate of change
+                       for rate alarms
+        limit (float): limit that was exceeded
+        timestamp (float): time the alarm was raised, or last tripped again after its condition cleared
+        count (int): number of times the condition was detected while latched
+        active (bool): whether the condition is still present, rate of change alarms are
+                       never active
+    """
+
+    __slots__ = ('name', 'kind', 'value', 'limit', 'timestamp', 'count', 'active')
+
+    def __init__(self, name: str, kind: str, value, limit, timestamp: float):
+        self.name = name
+        self.kind = kind
+        self.value = value
+        self.limit = limit
+        self.timestamp = timestamp
+        self.count = 1
+        self.active = kind != 'rate'
+
+    def __repr__(self) -> str:
+        return f'Alarm({self.name}, {self.kind}, value={self.value}, limit={self.limit}, timestamp={self.timestamp})'
+
+
+class LimitChecker():
+    """ Checks every decoded DTS signal against its limits, and decodes the fault words
+
+    Registers with the telemetry, so checks run as each message is decoded, inside the ingest
+    loop. The limits are compiled into arrays when the checker is created, and the limited
+    signals of each message into a tuple when the message is first decoded, so each message
+    only costs a few comparisons per limited signal. Fault words are only decoded when they
+    change. Derived signals (see derived_signals.DerivedSignals) are checked from the signal
+    store each time a message is decoded after they were updated, so the checker should be
+    created after the DerivedSignals to check them in the same decode
+
+        limits = LimitChecker(dts.telemetry, {
+            'dc_bus_voltage': {'min': 250, 'max': 400},
+            'module_a_temperature': {'max': 90, 'rate': 5},
+        })
+        limits.alarm_callbacks.append(dts.control.stop_on_alarm)
+
+    Fields:
+        telemetry (dts_manager.DTS.DTSTelemetry)
+        names (list(str)): names of the limited signals
+        minimums (array.array): minimum of each limited signal, -inf if none
+        maximums (array.array): maximum of each limited signal, inf if none
+        max_rates (array.array): maximum rate of change (units per second) of each limited signal,
+                                 inf if none
+        alarms (dict): latched alarms, keyed by (name, kind)
+        faults (set): names of the faults currently set in the fault words
+        alarm_callbacks (list): functions called with each Alarm when it is latched, and again each
+                                time it trips after its condition had cleared. Rate of change alarms
+                                are never active, so the callbacks are called on every rate trip
+
+    Methods:
+        on_decoded(self, message_id: int, values: list)
+            Checks the signals of a decoded message, called by the telemetry
+        latched(self) -> list
+            Returns the latched alarms, oldest first
+        reset(self, name=None) -> int
+            Unlatches alarms whose condition has cleared
+    """
+
+    def __init__(self, telemetry: dts_manager.DTS.DTSTelemetry, limits=None):
+        """
+        Args:
+            telemetry (dts_manager.DTS.DTSTelemetry)
+            limits (dict): limits of each signal, keyed by name. Each is a dict with any of
+                           'min', 'max' and 'rate' (maximum absolute rate of change per second)
+
+        Raises:
+            ValueError: if a limit is not for a decoded or derived signal of the telemetry, or
+                        is not one of 'min', 'max' and 'rate'
+        """
+        self.telemetry = telemetry
+        limits = limits or {}
+        store = telemetry.store
+        unknown = [name for name in limits if name not in store]
+        if unknown:
+            raise ValueError(f'Error: {unknown} are not decoded or derived signals of {telemetry.project}')
+        for name, limit in limits.items():
+            unknown = set(limit) - {'min', 'max', 'rate'}
+            if unknown:
+                raise ValueError(f'Error: {sorted(unknown)} are not valid limits of {name}')
+        self.names = list(limits)
+        self.index = {name: index for index, name in enumerate(self.names)}
+        self.minimums = array('d', [limits[name].get('min', -INF) for name in self.names])
+        self.maximums = array('d', [limits[name].get('max', INF) for name in self.names])
+        self.max_rates = array('d', [limits[name].get('rate', INF) for name in self.names])
+        # Previous value and timestamp of each limited signal, for rate of change checks
+        self.last_values = array('d', bytes(8 * len(self.names)))
+        self.last_timestamps = array('d', [-INF] * len(self.names))
+        # Whether each limited signal is currently out of limits
+        self.tripped = bytearray(len(self.names))
+
+        self.alarms = {}
+        self.faults = set()
+        self.fault_words = {name: 0 for name in FAULT_WORDS}
+        self.alarm_callbacks = []
+
+        # (value index, limit index) of the limited signals and (value index, word name) of the
+        # fault words of each decoder, built when a message is first decoded
+        self.message_checks = {}
+        # (store slot, limit index) of the limited signals no message decodes, i.e. derived
+        # signals, and the store timestamp each was last checked at
+        decoded = set(dts_manager.config_signals()[0])
+        for reading in telemetry.messages.values():
+            if reading.decoder is not None:
+                decoded.update(reading.decoder.names)
+        self.store_checks = tuple((store.index[name], index) for index, name in enumerate(self.names)
+                                  if name not in decoded)
+        self.checked_timestamps = array('d', [-INF] * len(self.store_checks))
+        telemetry.decode_callbacks.append(self.on_decoded)
+
+    def _compile_checks(self, decoder) -> tuple:
+        checks = tuple((value_index, self.index[name])
+                       for value_index, name in enumerate(decoder.names) if name in self.index)
+        words = tuple((value_index, name)
+                      for value_index, name in enumerate(decoder.names) if name in FAULT_WORDS)
+        return checks, words
+
+    def on_decoded(self, message_id: int, values: list) -> None:
+        reading = self.telemetry.messages[message_id]
+        compiled = self.message_checks.get(reading.decoder)
+        if compiled is None:
+            compiled = self.message_checks[reading.decoder] = self._compile_checks(reading.decoder)
+        checks, words = compiled
+        if self.store_checks:
+            self._check_store()
+        if not checks and not words:
+            return
+        timestamp = reading.timestamp
+        if timestamp is None:
+            timestamp = time.time()
+
+        for value_index, index in checks:
+            self._check(index, values[value_index], timestamp)
+
+        for value_index, name in words:
+            word = int(values[value_index])
+            last_word = self.fault_words[name]
+            if word != last_word:
+                self.fault_words[name] = word
+                self._update_faults(name, word, last_word, timestamp)
+
+    def _check(self, index: int, value: float, timestamp: float) -> None:
+        if value < self.minimums[index]:
+            self._trip(index, 'min', value, self.minimums[index], timestamp)
+        elif value > self.maximums[index]:
+            self._trip(index, 'max', value, self.maximums[index], timestamp)
+        elif self.tripped[index]:
+            self._clear(index)
+        max_rate = self.max_rates[index]
+        if max_rate != INF:
+            elapsed = timestamp - self.last_timestamps[index]
+            if 0 < elapsed < INF:
+                rate = abs(value - self.last_values[index]) / elapsed
+                if rate > max_rate:
+                    self._trip(index, 'rate', rate, max_rate, timestamp)
+            self.last_values[index] = value
+            self.last_timestamps[index] = timestamp
+
+    def _check_store(self) -> None:
+        """ Checks the derived signals updated since they were last checked"""
+        store_values = self.telemetry.store.values
+        store_timestamps = self.telemetry.store.timestamps
+        checked = self.checked_timestamps
+        for position, (slot, index) in enumerate(self.store_checks):
+            value = store_values[slot]
+            timestamp = store_timestamps[slot]
+            # NaN until the signal is first derived, and when derived without a timestamp
+            if value != value or timestamp == checked[position]:
+                continue
+            if timestamp != timestamp:
+                timestamp = time.time()
+            checked[position] = timestamp
+            self._check(index, value, timestamp)
+
+    def _latch(self, name: str, kind: str, value, limit, timestamp: float) -> None:
+        alarm = self.alarms.get((name, kind))
+        if alarm is not None:
+            alarm.count += 1
+            if alarm.active:
+                return
+            # Tripped again after the condition cleared, e.g. after an emergency stop was cleared
+            alarm.active = kind != 'rate'
+            alarm.value = value
+            alarm.timestamp = timestamp
+        else:
+            alarm = self.alarms[(name, kind)] = Alarm(name, kind, value, limit, timestamp)
+        for callback in self.alarm_callbacks:
+            callback(alarm)
+
+    def _trip(self, index: int, kind: str, value, limit, timestamp: float) -> None:
+        if kind != 'rate':
+            self.tripped[index] = 1
+        self._latch(self.names[index], kind, value, limit, timestamp)
+
+    def _clear(self, index: int) -> None:
+        self.tripped[index] = 0
+        for kind in ('min', 'max'):
+            alarm = self.alarms.get((self.names[index], kind))
+            if alarm is not None:
+                alarm.active = False
+
+    def _update_faults(self, word_name: str, word: int, last_word: int, timestamp: float) -> None:
+        names = FAULT_WORDS[word_name]
+        for bit, name in enumerate(names):
+            if name is None:
+                continue
+            mask = 1 << bit
+            if word & mask and not last_word & mask:
+                self.faults.add(name)
+                self._latch(name, 'fault', word, mask, timestamp)
+            elif last_word & mask and not word & mask:
+                self.faults.discard(name)
+                alarm = self.alarms.get((name, 'fault'))
+                if alarm is not None:
+                    alarm.active = False
+
+    def latched(self) -> list:
+        return sorted(self.alarms.values(), key=lambda alarm: alarm.timestamp)
+
+    def reset(self, name=None) -> int:
+        """ Unlatches alarms whose condition has cleared, alarms that are still active stay latched
+
+        Args:
+            name (str): only unlatch the alarms of this signal or fault, None for all
+
+        Returns:
+            (int) number of alarms unlatched
+        """
+        cleared = [key for key, alarm in self.alarms.items()
+                   if (name is None or key[0] == name) and not alarm.active]
+        for key in cleared:
+            del self.alarms[key]
+        return len(cleared)
@@ -0,0 +1,271 @@
+import struct
+import time
+from array import array
+from bisect import bisect_right
+from math import pi, sin
+
+from dts_manager import dts_manager
+from dts_manager.scheduler import StepScheduler, StepTransition
+
+# Torque and speed commands are sent in tenths, as signed 16 bit integers
+COMMAND_SCALE = 10
+COMMAND_LIMIT = 32767 / COMMAND_SCALE
+PAYLOAD_SIZE = 8
+COMMANDS = struct.Struct('<hh')
+
+
+class Ramp():
+    """ Command ramping linearly from start to end over the duration"""
+
+    def __init__(self, start: float, end: float, duration: float):
+        self.start = start
+        self.end = end
+        self.duration = duration
+
+    def value(self, elapsed: float) -> float:
+        return self.start + (self.end - self.start) * elapsed / self.duration
+
+
+class SineSweep():
+    """ Sine command whose frequency sweeps linearly from start_frequency to end_frequency
+
+    Fields:
+        amplitude (float)
+        start_frequency (float): frequency in Hz at the start of the sweep
+        end_frequency (float): frequency in Hz at the end of the sweep
+        duration (float)
+        offset (float): command the sine is centred on
+    """
+
+    def __init__(self, amplitude: float, start_frequency: float, end_frequency: float, duration: float, offset=0.0):
+        self.amplitude = amplitude
+        self.start_frequency = start_frequency
+        self.end_frequency = end_frequency
+        self.duration = duration
+        self.offset = offset
+
+    def value(self, elapsed: float) -> float:
+        sweep_rate = (self.end_frequency - self.start_frequency) / self.duration
+        phase = 2 * pi * (self.start_frequency * elapsed + sweep_rate * elapsed * elapsed / 2)
+        return self.offset + self.amplitude * sin(phase)
+
+
+class Trajectory():
+    """ Arbitrary command trajectory, linearly interpolated between (time, command) points
+
+    The first point must be at time 0, and the trajectory lasts until the last point
+    """
+
+    def __init__(self, points: list):
+        if not points or points[0][0] != 0:
+            raise ValueError('Error: a trajectory must start with a point at time 0')
+        self.times = [float(point[0]) for point in points]
+        self.commands = [float(point[1]) for point in points]
+        if any(later < earlier for earlier, later in zip(self.times, self.times[1:])):
+            raise ValueError('Error: trajectory points must be in time order')
+        self.duration = self.times[-1]
+
+    def value(self, elapsed: float) -> float:
+        index = bisect_right(self.times, elapsed) - 1
+        if index >= len(self.times) - 1:
+            return self.commands[-1]
+        start, end = self.times[index], self.times[index + 1]
+        if end == start:
+            return self.commands[index + 1]
+        return self.commands[index] + (self.commands[index + 1] - self.commands[index]) * (elapsed - start) / (end - start)
+
+
+class CompiledProfile():
+    """ Test profile sampled at the command period and packed into command message payloads
+
+    Fields:
+        period (float): time in seconds between frames
+        mode (dts_manager.InverterMode): whether the commands are torque or speed commands
+        frames (int): number of frames in the profile
+        duration (float): duration of the profile in seconds
+        commands (array.array): command of each frame
+        payloads (bytearray): packed command message payload of each frame, PAYLOAD_SIZE bytes each
+        segment_starts (list(int)): frame each segment of the profile starts at
+    """
+
+    def __init__(self, period: float, mode: dts_manager.InverterMode, commands: array, payloads: bytearray,
+                 segment_starts: list):
+        self.period = period
+        self.mode = mode
+        self.frames = len(commands)
+        self.duration = self.frames * period
+        self.commands = commands
+        self.payloads = payloads
+        self.segment_starts = segment_starts
+
+    def payload(self, frame: int) -> memoryview:
+        return memoryview(self.payloads)[frame * PAYLOAD_SIZE:(frame + 1) * PAYLOAD_SIZE]
+
+
+def compile_profile(control: dts_manager.DTS.DTSControl, segments: list, mode=dts_manager.InverterMode.Torque,
+                    period=None) -> CompiledProfile:
+    """ Samples a profile at the command period and packs every frame's command message payload
+
+    All the encoding is done here, before the run, so streaming the profile only copies payloads.
+    The direction, enable, discharge and torque limit are taken from the control's current
+    configuration, so configure_motor must have been called first
+
+    Args:
+        control (dts_manager.DTS.DTSControl)
+        segments (list): segments of the profile in order, each a dts_manager.MotorCommand (held
+                         for its duration), Ramp, SineSweep or Trajectory
+        mode (dts_manager.InverterMode): whether the commands are torque or speed commands
+        period (float): time in seconds between frames, defaults to the CanManager's message_frequency
+
+    Returns:
+        (CompiledProfile)
+    """
+    period = control.bus.message_frequency if period is None else period
+    if period <= 0:
+        raise ValueError(f'Error: profile period must be positive, not {period}')
+    mode_byte = ((mode.value << 2) + (int(control.inverter_discharge) << 1) +
+                 (int(control.inverter_enable) << 0)).to_bytes(1, 'little')
+    tail = control.direction_command + mode_byte + control.commanded_torque_limit
+
+    commands = array('d')
+    segment_starts = []
+    segment_end = 0.0
+    for index, segment in enumerate(segments):
+        if segment.duration is None or segment.duration < 0:
+            raise ValueError(f'Error: segment {index} of the profile needs a duration, not {segment.duration}')
+        segment_start = segment_end
+        segment_end += segment.duration
+        segment_starts.append(len(commands))
+        # Frames are sampled at whole multiples of the period from the start of the profile,
+        # so the segment boundaries do not accumulate rounding errors
+        frame = len(commands)
+        while frame * period < segment_end - 1e-9:
+            elapsed = frame * period - segment_start
+            command = segment.command if isinstance(segment, dts_manager.MotorCommand) else segment.value(elapsed)
+            if abs(command) > COMMAND_LIMIT:
+                raise ValueError(f'Error: command {command} of segment {index} is outside +-{COMMAND_LIMIT}')
+            commands.append(command)
+            frame += 1
+
+    payloads = bytearray(PAYLOAD_SIZE * len(commands))
+    torque_mode = mode == dts_manager.InverterMode.Torque
+    for frame, command in enumerate(commands):
+        scaled = int(command * COMMAND_SCALE)
+        offset = frame * PAYLOAD_SIZE
+        COMMANDS.pack_into(payloads, offset, scaled if torque_mode else 0, 0 if torque_mode else scaled)
+        payloads[offset + COMMANDS.size:offset + PAYLOAD_SIZE] = tail
+    return CompiledProfile(period, mode, commands, payloads, segment_starts)
+
+
+def segments_from_test_profile(profile) -> tuple:
+    """ Converts a test profile made in the dash app into profile segments
+
+    Args:
+        profile: utils.dts.DtsTestProfile, or its to_dict() representation as exported to profiles.json
+
+    Returns:
+        (tuple) list of dts_manager.MotorCommand segments, and the dts_manager.InverterMode of the profile
+    """
+    if isinstance(profile, dict):
+        test_type = profile['type']
+        steps = [(command['Step Duration(ms)'], command['Value']) for command in profile['commands']]
+    else:
+        test_type = profile.test_type
+        steps = [(command.step, command.value) for command in profile.commands]
+    mode = dts_manager.InverterMode.Speed if test_type == 'RPM' else dts_manager.InverterMode.Torque
+    return [dts_manager.MotorCommand(value, step / 1000) for step, value in steps], mode
+
+
+class ProfileStreamer(StepScheduler):
+    """ Streams a compiled profile through the periodic command message
+
+    A single modifiable periodic task keeps sending the command message at the bus rate, and
+    the streamer thread copies the next precompiled payload into it at every period, on
+    absolute time.monotonic() deadlines. If the streamer is delayed, the periodic task keeps
+    the command stream going with the previous command. The period of the profile should
+    match the CanManager's message_frequency, so each frame is sent once
+
+        dts.control.configure_motor(motorConfiguration)
+        profile = compile_profile(dts.control, [Ramp(0, 100, 5), SineSweep(20, 0.5, 10, 30, offset=100)])
+        streamer = ProfileStreamer(dts.control, motorConfiguration, profile)
+        streamer.start()
+
+    Fields:
+        See StepScheduler, transitions records the start of each segment
+        profile (CompiledProfile)
+        frames_sent (int): number of frames copied into the command message so far
+        late_frames (int): number of frames copied more than a period after their deadline
+        max_frame_lateness (float): longest time in seconds a frame was copied after its deadline
+    """
+
+    def __init__(self, control: dts_manager.DTS.DTSControl, initial_config: dts_manager.MotorConfig,
+                 profile: CompiledProfile, spin_margin=0.0005):
+        """
+        Args:
+            control (dts_manager.DTS.DTSControl)
+            initial_config (dts_manager.MotorConfig): configuration sent when the profile starts, must
+                                                     match the configuration the profile was compiled with
+            profile (CompiledProfile)
+            spin_margin (float): time in seconds before each deadline to start polling the clock
+        """
+        super().__init__(control, initial_config, [], spin_margin)
+        self.profile = profile
+        self.frames_sent = 0
+        self.late_frames = 0
+        self.max_frame_lateness = 0.0
+
+    def _run(self) -> None:
+        control = self.control
+        profile = self.profile
+        period = profile.period
+        segment_starts = {frame: index for index, frame in enumerate(profile.segment_starts)}
+        try:
+            control.configure_motor(self.initial_config)
+            control.send_motor_command_config()
+            message = control.command_message(bytearray(PAYLOAD_SIZE))
+            data = message.data
+            task = None
+            for frame in range(profile.frames):
+                deadline = self.start_time + frame * period
+                if not self._wait_until(deadline):
+                    break
+                with control.command_lock:
+                    control.check_not_stopped()
+                    data[:] = profile.payload(frame)
+                    if task is None:
+                        task = control.current_command_message = \
+                            control.bus.update_periodic_message(message, control.channel)
+                    else:
+                        task.modify_data(message)
+                    change = control.tag_command(data)
+                control.notify_command(change)
+                sent_time = time.monotonic()
+                lateness = sent_time - deadline
+                self.frames_sent += 1
+                if lateness > self.max_frame_lateness:
+                    self.max_frame_lateness = lateness
+                if lateness > period:
+                    self.late_frames += 1
+                if frame in segment_starts:
+                    self.transitions.append(StepTransition(segment_starts[frame], profile.commands[frame],
+                                                           deadline, sent_time))
+            else:
+                end = self.start_time + profile.frames * period
+                if self._wait_until(end):
+                    self.transitions.append(StepTransition(len(profile.segment_starts), None, end, time.monotonic()))
+            # After an emergency stop the periodic task sends the disable message, which must keep
+            # going. The lock keeps an emergency stop from switching to it between check and stop
+            with control.command_lock:
+                if not control.stopped:
+                    control.bus.stop_periodic_message(control.command_id, control.channel)
+        except Exception as error:
+            self.error = error
+        finally:
+            control.commands_finished = True
+            self.finished.set()
+
+    def summary(self) -> dict:
+        summary = super().summary()
+        summary.update(frames_sent=self.frames_sent, late_frames=self.late_frames,
+                       max_frame_lateness=self.max_frame_lateness)
+        return summary
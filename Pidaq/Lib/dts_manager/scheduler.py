@@ -0,0 +1,162 @@
+import statistics
+import threading
+import time
+
+from dts_manager import dts_manager
+
+
+class StepTransition():
+    """ Record of one step of a test profile being sent
+
+    Fields:
+        index (int): position of the step in the profile
+        command (float): torque/speed command of the step, None for the end of the profile
+        deadline (float): time.monotonic() the step was scheduled to start at
+        time (float): time.monotonic() the command was actually sent at
+        lateness (float): time - deadline, in seconds
+    """
+
+    __slots__ = ('index', 'command', 'deadline', 'time', 'lateness')
+
+    def __init__(self, index: int, command: float, deadline: float, sent_time: float):
+        self.index = index
+        self.command = command
+        self.deadline = deadline
+        self.time = sent_time
+        self.lateness = sent_time - deadline
+
+    def __repr__(self) -> str:
+        return f'StepTransition({self.index}, command={self.command}, lateness={self.lateness * 1e3:.3f}ms)'
+
+
+class StepScheduler():
+    """ Runs a DTS test profile in its own thread, on absolute deadlines
+
+    Every step starts at the start time of the profile plus the durations of the steps before
+    it, measured with time.monotonic(), so steps are not stretched by the work done elsewhere
+    (decoding, printing, ...) and scheduling errors do not accumulate over the profile. The
+    thread sleeps until just before each deadline, then waits out the remaining spin_margin
+    with short sleeps, so it only uses the CPU for the last fraction of a millisecond
+
+        scheduler = StepScheduler(dts.control, motorConfiguration, motorCommands)
+        scheduler.start()
+        while not scheduler.finished.is_set():
+            dts.telemetry.update_data()
+        print(scheduler.summary())
+
+    Fields:
+        control (dts_manager.DTS.DTSControl): control the commands are sent through
+        initial_config (dts_manager.MotorConfig): configuration sent when the profile starts
+        commands (list(dts_manager.MotorCommand)): steps of the profile, in order
+        spin_margin (float): time in seconds before each deadline at which the thread stops
+                             sleeping and starts polling the clock
+        start_time (float): time.monotonic() the profile started at
+        transitions (list(StepTransition)): actual start of every step sent so far
+        finished (threading.Event): set once the profile has finished or was stopped
+        error (Exception): exception that stopped the profile, e.g. an emergency stop, None if none
+
+    Methods:
+        start(self, start_time=None) -> None
+            Starts the profile thread
+        stop(self) -> None
+            Stops the profile before its next step
+        join(self, timeout=None) -> bool
+            Waits for the profile to finish
+        summary(self) -> dict
+            Returns jitter statistics of the step transitions
+    """
+
+    def __init__(self, control: dts_manager.DTS.DTSControl, initial_config: dts_manager.MotorConfig,
+                 commands: list, spin_margin=0.0005):
+        """
+        Args:
+            control (dts_manager.DTS.DTSControl)
+            initial_config (dts_manager.MotorConfig): configuration sent when the profile starts
+            commands (List[dts_manager.MotorCommand]): commands executed in order, each for its duration
+            spin_margin (float): time in seconds before each deadline to start polling the clock
+        """
+        for index, command in enumerate(commands):
+            if command.duration is None or command.duration < 0:
+                raise ValueError(f'Error: step {index} of the profile needs a duration, not {command.duration}')
+        self.control = control
+        self.initial_config = initial_config
+        self.commands = list(commands)
+        self.spin_margin = spin_margin
+        self.start_time = None
+        self.transitions = []
+        self.finished = threading.Event()
+        self.error = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='dts_step_scheduler', daemon=True)
+
+    def start(self, start_time=None) -> None:
+        """ Starts running the profile
+
+        Args:
+            start_time (float): time.monotonic() at which the first step starts, defaults to now.
+                                Several schedulers can be given the same start time to run in step
+        """
+        self.start_time = time.monotonic() if start_time is None else start_time
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def join(self, timeout=None) -> bool:
+        """ Waits for the profile to finish, returns whether it has"""
+        return self.finished.wait(timeout)
+
+    def _wait_until(self, deadline: float) -> bool:
+        """ Waits until the deadline, returns False if the scheduler was stopped meanwhile"""
+        remaining = deadline - time.monotonic() - self.spin_margin
+        if remaining > 0 and self._stop.wait(remaining):
+            return False
+        while time.monotonic() < deadline:
+            time.sleep(0)
+        return not self._stop.is_set()
+
+    def _run(self) -> None:
+        control = self.control
+        try:
+            control.configure_motor(self.initial_config)
+            deadline = self.start_time
+            for index, command in enumerate(self.commands):
+                if not self._wait_until(deadline):
+                    break
+                if index == 0:
+                    control.send_motor_command_config()
+                control.send_motor_command(command.command)
+                self.transitions.append(StepTransition(index, command.command, deadline, time.monotonic()))
+                deadline += command.duration
+            else:
+                # Hold the last command for its duration before stopping the command stream
+                if self._wait_until(deadline):
+                    self.transitions.append(StepTransition(len(self.commands), None, deadline, time.monotonic()))
+            # After an emergency stop the periodic task sends the disable message, which must keep
+            # going. The lock keeps an emergency stop from switching to it between check and stop
+            with control.command_lock:
+                if not control.stopped:
+                    control.bus.stop_periodic_message(control.command_id, control.channel)
+        except Exception as error:
+            self.error = error
+        finally:
+            control.commands_finished = True
+            self.finished.set()
+
+    def summary(self) -> dict:
+        """ Returns statistics of how late each step started, relative to its deadline
+
+        Returns:
+            (dict) number of transitions, and the mean, standard deviation, maximum and jitter
+            (maximum minus minimum) of the lateness in seconds, None while no step has started
+        """
+        lateness = [transition.lateness for transition in self.transitions]
+        if not lateness:
+            return {'transitions': 0, 'mean': None, 'stdev': None, 'max': None, 'jitter': None}
+        return {
+            'transitions': len(lateness),
+            'mean': statistics.mean(lateness),
+            'stdev': statistics.pstdev(lateness),
+            'max': max(lateness),
+            'jitter': max(lateness) - min(lateness),
+        }
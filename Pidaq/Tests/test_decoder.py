@@ -0,0 +1,76 @@
+""" Tests of the message decoders compiled from the message configuration
+
+Run from the Pidaq folder, with the custom packages installed, using python3 -m unittest discover Tests
+"""
+import struct
+import unittest
+
+from can_manager.decoder import compile_decoder
+
+
+class CompileDecoderTest(unittest.TestCase):
+
+    def test_decodes_scaled_signals(self):
+        decoder = compile_decoder(160, [
+            {'name': 'module_a_temperature', 'start': 0},
+            {'name': 'module_b_temperature', 'start': 2},
+            {'name': 'module_c_temperature', 'start': 4},
+            {'name': 'gate_driver_board_temperature', 'start': 6},
+        ], 10)
+        values = decoder.decode(struct.pack('<hhhh', 253, -41, 0, 1000))
+        self.assertEqual(decoder.names, ('module_a_temperature', 'module_b_temperature',
+                                         'module_c_temperature', 'gate_driver_board_temperature'))
+        self.assertEqual(values, [25.3, -4.1, 0.0, 100.0])
+
+    def test_named_conversion_factors_and_types(self):
+        decoder = compile_decoder(165, [
+            {'name': 'motor_angle', 'start': 0, 'conversion_factor': 'angle'},
+            {'name': 'motor_speed', 'start': 2, 'conversion_factor': 'speed'},
+            {'name': 'power_on_timer', 'start': 4, 'type': 'I', 'conversion_factor': 1},
+        ], {'angle': 10, 'speed': 1})
+        values = decoder.decode(struct.pack('<hhI', 1800, -3000, 123456))
+        self.assertEqual(values, [180.0, -3000.0, 123456.0])
+
+    def test_skips_undecoded_bytes(self):
+        decoder = compile_decoder(170, [{'name': 'vsm_state', 'start': 0}, {'name': 'inverter_state', 'start': 6}], 1)
+        self.assertEqual(decoder.size, 8)
+        self.assertEqual(decoder.decode(struct.pack('<hhhh', 4, 99, 99, 7)), [4.0, 7.0])
+
+    def test_bit_signals_follow_scaled_signals(self):
+        decoder = compile_decoder(164, [
+            {'name': 'digital_input_1', 'start': 0, 'type': 'B', 'bit': 0},
+            {'name': 'digital_input_2', 'start': 0, 'type': 'B', 'bit': 1},
+            {'name': 'digital_input_8', 'start': 0, 'type': 'B', 'bit': 7},
+            {'name': 'analog', 'start': 2},
+        ], 100)
+        self.assertEqual(decoder.names, ('analog', 'digital_input_1', 'digital_input_2', 'digital_input_8'))
+        self.assertEqual(decoder.decode(bytes([0b10000001, 0]) + struct.pack('<h', 250)), [2.5, True, False, True])
+
+    def test_short_payload_is_not_decoded(self):
+        decoder = compile_decoder(160, [{'name': 'a', 'start': 0}, {'name': 'b', 'start': 6}], 10)
+        self.assertIsNone(decoder.decode(bytes(7)))
+
+    def test_overlapping_signals_are_rejected(self):
+        with self.assertRaisesRegex(ValueError, 'overlap at byte 1'):
+            compile_decoder(160, [{'name': 'a', 'start': 0}, {'name': 'b', 'start': 1}], 10)
+        with self.assertRaisesRegex(ValueError, 'overlap'):
+            compile_decoder(160, [{'name': 'a', 'start': 0, 'type': 'I'}, {'name': 'b', 'start': 2}], 10)
+
+    def test_bits_of_one_field_do_not_overlap(self):
+        decoder = compile_decoder(171, [
+            {'name': 'word', 'start': 0, 'type': 'H'},
+            {'name': 'flag', 'start': 0, 'type': 'H', 'bit': 15},
+        ], 1)
+        self.assertEqual(decoder.decode(struct.pack('<H', 0x8001)), [32769.0, True])
+
+    def test_invalid_definitions_are_rejected(self):
+        with self.assertRaises(ValueError):
+            compile_decoder(160, [{'name': 'a', 'start': 0, 'type': 'f'}], 10)
+        with self.assertRaises(ValueError):
+            compile_decoder(162, [{'name': 'a', 'start': 0}], {'temp': 10})
+        with self.assertRaises(ValueError):
+            compile_decoder(162, [{'name': 'a', 'start': 0, 'conversion_factor': 'torque'}], {'temp': 10})
+
+
+if __name__ == '__main__':
+    unittest.main()
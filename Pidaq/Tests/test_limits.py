@@ -0,0 +1,117 @@
+""" Tests of the LimitChecker alarms, decoding messages received on a virtual bus
+
+Run from the Pidaq folder, with the custom packages installed, using python3 -m unittest discover Tests
+"""
+import struct
+import unittest
+
+import can
+
+from can_manager import can_manager
+from dts_manager import dts_manager
+from dts_manager.limits import LimitChecker
+
+# Message carrying dc_bus_voltage in its first field, scaled by 10
+VOLTAGE_ID = 167
+# Fault codes message, run_fault_lo is its third field
+FAULT_ID = 171
+
+
+class LimitCheckerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.bus = can_manager.CanManager('limits_test', 0.1, interface='virtual')
+        self.dts = dts_manager.DTS(self.bus)
+        self.dts.read_message_config()
+        self.telemetry = self.dts.telemetry
+        self.bus.register_handler(self.telemetry.project, self.telemetry.decode_message)
+        self.limits = LimitChecker(self.telemetry, {'dc_bus_voltage': {'min': 250, 'max': 400}})
+        self.raised = []
+        self.limits.alarm_callbacks.append(self.raised.append)
+        self.timestamp = 0.0
+
+    def tearDown(self):
+        self.dts.control.shutdown()
+        self.bus.bus.shutdown()
+
+    def receive(self, message_id, data):
+        self.timestamp += 0.1
+        self.bus.dispatch_batch([can.Message(arbitration_id=message_id, data=data, timestamp=self.timestamp)])
+
+    def voltage(self, value):
+        self.receive(VOLTAGE_ID, struct.pack('<hhhh', int(value * 10), 0, 0, 0))
+
+    def test_in_limits_raises_nothing(self):
+        self.voltage(300)
+        self.voltage(250)
+        self.voltage(400)
+        self.assertEqual(self.limits.latched(), [])
+        self.assertEqual(self.raised, [])
+
+    def test_alarm_stays_latched_after_clearing(self):
+        self.voltage(300)
+        self.voltage(420)
+        self.voltage(430)
+        self.assertEqual(len(self.raised), 1)
+        alarm = self.limits.alarms[('dc_bus_voltage', 'max')]
+        self.assertIs(self.raised[0], alarm)
+        self.assertTrue(alarm.active)
+        self.assertEqual(alarm.value, 420)
+        self.assertEqual(alarm.limit, 400)
+        self.assertEqual(alarm.count, 2)
+
+        self.voltage(300)
+        self.assertFalse(alarm.active)
+        self.assertEqual(self.limits.latched(), [alarm])
+        self.assertEqual(len(self.raised), 1)
+
+    def test_retrip_after_clearing_calls_callbacks_again(self):
+        self.voltage(420)
+        first_timestamp = self.limits.alarms[('dc_bus_voltage', 'max')].timestamp
+        self.voltage(300)
+        self.voltage(410)
+        alarm = self.limits.alarms[('dc_bus_voltage', 'max')]
+        self.assertEqual(self.raised, [alarm, alarm])
+        self.assertTrue(alarm.active)
+        self.assertEqual(alarm.value, 410)
+        self.assertGreater(alarm.timestamp, first_timestamp)
+        self.assertEqual(alarm.count, 2)
+
+    def test_reset_only_unlatches_cleared_alarms(self):
+        self.voltage(200)
+        self.assertEqual(self.limits.reset(), 0)
+        self.assertIn(('dc_bus_voltage', 'min'), self.limits.alarms)
+
+        self.voltage(300)
+        self.assertEqual(self.limits.reset('module_a_temperature'), 0)
+        self.assertEqual(self.limits.reset('dc_bus_voltage'), 1)
+        self.assertEqual(self.limits.latched(), [])
+
+        self.voltage(200)
+        self.assertEqual(len(self.raised), 2)
+
+    def test_fault_bits_latch_and_clear(self):
+        over_voltage = 1 << 2
+        self.receive(FAULT_ID, struct.pack('<HHHH', 0, 0, over_voltage, 0))
+        alarm = self.limits.alarms[('over_voltage_fault', 'fault')]
+        self.assertEqual(self.limits.faults, {'over_voltage_fault'})
+        self.assertTrue(alarm.active)
+
+        self.receive(FAULT_ID, struct.pack('<HHHH', 0, 0, 0, 0))
+        self.assertEqual(self.limits.faults, set())
+        self.assertFalse(alarm.active)
+        self.assertEqual(self.limits.latched(), [alarm])
+
+        self.receive(FAULT_ID, struct.pack('<HHHH', 0, 0, over_voltage, 0))
+        self.assertEqual(self.raised, [alarm, alarm])
+        self.assertTrue(alarm.active)
+
+    def test_unknown_signals_are_rejected(self):
+        with self.assertRaises(ValueError):
+            LimitChecker(self.telemetry, {'not_a_signal': {'max': 1}})
+        with self.assertRaises(ValueError):
+            LimitChecker(self.telemetry, {'dc_bus_voltage': {'maximum': 1}})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,100 @@
+""" Tests of the binary capture recorder and reader
+
+Run from the Pidaq folder, with the custom packages installed, using python3 -m unittest discover Tests
+"""
+import os
+import shutil
+import tempfile
+import unittest
+
+import can
+
+from can_manager.recorder import CaptureReader, CaptureRecorder, index_path
+
+
+class CaptureTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'run.pdqcap')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def record(self, messages, **kwargs):
+        recorder = CaptureRecorder(self.path, **kwargs)
+        for message in messages:
+            recorder.on_message_received(message)
+        recorder.stop()
+        return recorder
+
+    def test_round_trip(self):
+        messages = [
+            can.Message(timestamp=1.5, arbitration_id=160, data=[1, 2, 3, 4, 5, 6, 7, 8], is_extended_id=False),
+            can.Message(timestamp=1.75, arbitration_id=0x1ABCDE, data=[9, 10], is_extended_id=True),
+            can.Message(timestamp=2.0, arbitration_id=192, dlc=4, is_remote_frame=True, is_extended_id=False),
+        ]
+        self.assertEqual(self.record(messages).record_count, 3)
+        with CaptureReader(self.path) as reader:
+            self.assertEqual(len(reader), 3)
+            for position, expected in enumerate(messages):
+                message = reader.message(position)
+                self.assertEqual(message.timestamp, expected.timestamp)
+                self.assertEqual(message.arbitration_id, expected.arbitration_id)
+                self.assertEqual(message.is_extended_id, expected.is_extended_id)
+                self.assertEqual(message.is_remote_frame, expected.is_remote_frame)
+                self.assertEqual(message.dlc, expected.dlc)
+                if not expected.is_remote_frame:
+                    self.assertEqual(bytes(message.data), bytes(expected.data))
+
+    def test_buffer_is_flushed_when_full(self):
+        messages = [can.Message(timestamp=i, arbitration_id=i, data=[i % 256]) for i in range(10)]
+        self.record(messages, index_interval=4, buffer_records=3)
+        with CaptureReader(self.path) as reader:
+            self.assertEqual(len(reader), 10)
+            self.assertEqual(list(reader.index), [0.0, 4.0, 8.0])
+            self.assertEqual([message.arbitration_id for message in reader.messages()], list(range(10)))
+
+    def test_seek(self):
+        self.record([can.Message(timestamp=i * 0.5, arbitration_id=i) for i in range(100)], index_interval=8)
+        with CaptureReader(self.path) as reader:
+            self.assertEqual(reader.seek(-1), 0)
+            self.assertEqual(reader.seek(0), 0)
+            self.assertEqual(reader.seek(10.0), 20)
+            self.assertEqual(reader.seek(10.1), 21)
+            self.assertEqual(reader.seek(16.0), 32)
+            self.assertEqual(reader.seek(49.5), 99)
+            self.assertEqual(reader.seek(100), 100)
+            for position in range(100):
+                self.assertEqual(reader.seek(position * 0.5), position)
+                self.assertEqual(reader.seek(position * 0.5 - 0.25), position)
+
+    def test_messages_between_timestamps(self):
+        self.record([can.Message(timestamp=i * 0.5, arbitration_id=i) for i in range(100)], index_interval=8)
+        with CaptureReader(self.path) as reader:
+            ids = [message.arbitration_id for message in reader.messages(start_time=3.2, end_time=5.0)]
+            self.assertEqual(ids, list(range(7, 11)))
+
+    def test_missing_index_is_rebuilt(self):
+        self.record([can.Message(timestamp=i * 0.5, arbitration_id=i) for i in range(20)], index_interval=8)
+        os.remove(index_path(self.path))
+        with CaptureReader(self.path) as reader:
+            self.assertEqual(list(reader.index), [0.0, 4.0, 8.0])
+            self.assertEqual(reader.seek(5.0), 10)
+
+    def test_partial_trailing_record_is_ignored(self):
+        self.record([can.Message(timestamp=i, arbitration_id=i) for i in range(5)])
+        with open(self.path, 'ab') as capture:
+            capture.write(bytes(7))
+        with CaptureReader(self.path) as reader:
+            self.assertEqual(len(reader), 5)
+
+    def test_invalid_file_is_rejected(self):
+        with open(self.path, 'wb') as capture:
+            capture.write(bytes(64))
+        with self.assertRaises(ValueError):
+            CaptureReader(self.path)
+
+
+if __name__ == '__main__':
+    unittest.main()